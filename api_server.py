@@ -1,6 +1,7 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, make_response, stream_with_context, g
 from flask_cors import CORS
-from controllers.emission_controller import EmissionController
+from controllers.emission_controller import EmissionController, ECO_TIP_SETS
+from models.emission_model import EmissionModel, DEFAULT_QUANTILES
 import logging
 import time
 import os
@@ -9,7 +10,23 @@ from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 import threading
 import json
-from functools import lru_cache
+import itertools
+import math
+import weakref
+import numpy as np
+from functools import lru_cache, wraps
+from utils.request_logger import get_request_logger
+from utils.profiler import SamplingProfiler, AllocationTracker
+from utils.prediction_cache import PredictionCache
+from utils.shared_state import SharedPredictionCache
+from utils.single_flight import SingleFlight
+from utils.hot_keys import HotKeySketch, load_hot_keys
+from utils import bulk_codec, stream_scoring
+from utils.admission import AdaptiveConcurrencyLimiter, parse_deadline, parse_request_start
+from utils.scheduler import PriorityScheduler
+from utils.evaluation import summarize_report
+import hmac
+import atexit
 
 # Cấu hình logging - Thiết lập hệ thống ghi log để theo dõi hoạt động của server
 logging.basicConfig(
@@ -17,39 +34,100 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'  # Định dạng: thời gian - mức độ - nội dung
 )
 logger = logging.getLogger(__name__)  # Tạo đối tượng logger cho module hiện tại
+# Log của request được đẩy vào hàng đợi và ghi bởi luồng nền (JSON lines, file xoay vòng)
+request_log = get_request_logger()
 
 app = Flask(__name__)  # Khởi tạo ứng dụng Flask
 CORS(app)  # Cho phép truy cập API từ các nguồn khác nhau (Cross-Origin Resource Sharing)
 
+# Trạng thái dùng chung giữa các worker (bộ đếm rate limit và cache dự đoán) trong file
+# memory-map; để trống thì mỗi worker giữ trạng thái riêng trong bộ nhớ
+SHARED_STATE_PATH = os.environ.get('SHARED_STATE_PATH')
+
 # Giảm rate limiting để cho phép nhiều request hơn - Cơ chế hạn chế số lượng request trong một khoảng thời gian
 limiter = Limiter(
     get_remote_address,  # Sử dụng IP của client để theo dõi và giới hạn request
     app=app,
     default_limits=["200 per minute", "20 per second"],  # Giới hạn mặc định: 200 request/phút, 20 request/giây
-    storage_uri="memory://",  # Lưu trữ thông tin giới hạn trong bộ nhớ
+    # Lưu trữ thông tin giới hạn trong bộ nhớ dùng chung (giới hạn chung cho mọi worker) hoặc của riêng worker
+    storage_uri=f"shm://{SHARED_STATE_PATH}.limits" if SHARED_STATE_PATH else "memory://",
     strategy="fixed-window"  # Sử dụng chiến lược cửa sổ cố định để giới hạn
 )
 
 # Các biến toàn cục để quản lý trạng thái của server và mô hình
+# controller chỉ được gán lại nguyên khối (phép gán tham chiếu là nguyên tử),
+# các request đọc tham chiếu một lần rồi dùng - không cần khóa khi dự đoán
 controller = None  # Đối tượng controller chính để xử lý dự đoán
-model_initialized = False  # Cờ đánh dấu mô hình đã được khởi tạo hay chưa
-initialization_in_progress = False  # Cờ đánh dấu quá trình khởi tạo đang diễn ra
-prediction_lock = threading.RLock()  # Khóa đồng bộ hóa cho các thao tác dự đoán
+model_ready = threading.Event()  # Được set khi mô hình sẵn sàng phục vụ
+init_error = None  # Lỗi của lần khởi tạo gần nhất (nếu có)
+_init_lock = threading.Lock()  # Bảo đảm chỉ một luồng khởi tạo chạy tại một thời điểm
+_init_thread = None  # Luồng nền đang/đã khởi tạo mô hình
+# Thời gian tối đa một request chờ mô hình sẵn sàng trước khi trả về 503
+MODEL_READY_TIMEOUT = float(os.environ.get('MODEL_READY_TIMEOUT', '2.0'))
+RETRY_AFTER_SECONDS = 5  # Giá trị header Retry-After khi mô hình chưa sẵn sàng
+
+# Profiling theo yêu cầu - chỉ bật khi có DEBUG_TOKEN, mỗi lúc chỉ chạy một phiên
+profile_lock = threading.Lock()
+MAX_PROFILE_SECONDS = 60  # Giới hạn thời gian profiling (nhỏ hơn timeout của gunicorn)
+allocation_tracker = AllocationTracker()
+if os.environ.get('PROFILE_TRACEMALLOC', 'false').lower() == 'true':
+    # Chụp snapshot gốc ngay khi khởi động để so sánh tăng trưởng bộ nhớ về sau
+    allocation_tracker.start()
 
-# Cache đơn giản cho kết quả dự đoán - Giúp giảm thời gian xử lý cho các request lặp lại
-prediction_cache = {}
+# Cache kết quả dự đoán - Giúp giảm thời gian xử lý cho các request lặp lại
+# Cache có khóa riêng (LRU), không dùng chung khóa với phần chạy mô hình
 MAX_CACHE_SIZE = 500  # Kích thước tối đa của cache - 500 kết quả
+if SHARED_STATE_PATH:
+    prediction_cache = SharedPredictionCache(f"{SHARED_STATE_PATH}.cache", MAX_CACHE_SIZE)
+else:
+    prediction_cache = PredictionCache(MAX_CACHE_SIZE)
+# Gộp các request giống hệt nhau đang chạy đồng thời: chỉ một request chạy mô hình
+prediction_flight = SingleFlight()
+# Các vector đặc trưng được yêu cầu nhiều nhất (top-K) được lưu định kỳ ra file để
+# lần khởi động sau (deploy, worker tái khởi động theo max_requests) nạp sẵn vào cache
+HOT_KEYS_PATH = os.environ.get(
+    'HOT_KEYS_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models', 'artifacts', 'hot_keys.json'))
+HOT_KEYS_PRELOAD = int(os.environ.get('HOT_KEYS_PRELOAD', '256'))  # Số khóa nạp sẵn tối đa
+HOT_KEYS_SAVE_INTERVAL = float(os.environ.get('HOT_KEYS_SAVE_INTERVAL', '60'))  # Chu kỳ lưu (giây); 0 để tắt
+hot_keys = HotKeySketch()
+_hot_keys_pid = None  # PID của tiến trình đã khởi động luồng lưu khóa nóng
+
+# Dự đoán hàng loạt: số dòng mỗi khối duyệt rừng cây (do gunicorn_config hiệu chỉnh)
+# và số dòng tối đa của một request
+MICRO_BATCH_SIZE = int(os.environ.get('MICRO_BATCH_SIZE', '4096'))
+BULK_MAX_ROWS = int(os.environ.get('BULK_MAX_ROWS', '1000000'))
+# Thời gian tối đa (giây) một khối của luồng chấm điểm chờ chỗ xử lý trước khi luồng bị dừng
+STREAM_SLOT_TIMEOUT = float(os.environ.get('STREAM_SLOT_TIMEOUT', '60'))
+# Suy luận anytime khi quá tải: duyệt cây theo thứ tự, dừng khi hết ngân sách hoặc khoảng tin cậy đủ hẹp
+ANYTIME_BUDGET_MS = float(os.environ.get('ANYTIME_BUDGET_MS', '1.0'))
+ANYTIME_TOLERANCE = float(os.environ.get('ANYTIME_TOLERANCE', '2.0'))  # Nửa độ rộng khoảng tin cậy 95% (g/km)
+# Các endpoint có thể trả kết quả giảm độ chính xác thay vì từ chối khi quá tải
+DEGRADABLE_ENDPOINTS = {'predict'}
+MAX_QUANTILES = 9  # Số mức phân vị tối đa của một request có độ bất định
+MAX_SIMILAR_VEHICLES = 50  # Số xe tương tự tối đa một request /vehicles/similar
+# Tiến độ các luồng chấm điểm /predict/stream
+stream_tracker = stream_scoring.StreamTracker()
+
+# Mô hình theo phiên bản cho cached_predict - tham chiếu yếu: mô hình đã bị thay chỉ sống
+# chừng nào còn request đang dùng nó, không bị các mục của lru_cache giữ lại
+_models_by_version = weakref.WeakValueDictionary()
 
 # Chuẩn bị cache function với lru_cache - Decorator để tự động lưu cache kết quả trả về
 @lru_cache(maxsize=1000)
-def cached_predict(engine_size, cylinders, fuel_consumption, horsepower, weight, year):
+def cached_predict(version, engine_size, cylinders, fuel_consumption, horsepower, weight, year):
     """
     Hàm dự đoán có lưu cache - Sử dụng lru_cache để tối ưu hóa hiệu năng
     
     Lưu kết quả dự đoán dựa trên các tham số đầu vào, giúp trả về kết quả ngay lập tức
-    nếu cùng một bộ tham số được sử dụng lại.
+    nếu cùng một bộ tham số được sử dụng lại. Phiên bản mô hình là một phần của khóa
+    cache, nên sau khi mô hình được thay nóng, kết quả của mô hình cũ không bao giờ
+    được trả lại (chúng tự bị đẩy ra khỏi LRU). Khóa chỉ chứa chuỗi phiên bản chứ không
+    chứa đối tượng mô hình, nên các mục cũ không giữ mô hình cũ (mmap, chỉ mục, SHAP) trong bộ nhớ.
     
     Parameters:
+        version: Phiên bản của mô hình dùng để dự đoán; người gọi đăng ký mô hình vào
+                 _models_by_version và giữ tham chiếu tới nó trong suốt lời gọi
         engine_size: Kích thước động cơ (L)
         cylinders: Số xi-lanh
         fuel_consumption: Mức tiêu thụ nhiên liệu (L/100km)
@@ -68,94 +146,418 @@ def cached_predict(engine_size, cylinders, fuel_consumption, horsepower, weight,
         'Weight (kg)': float(weight),
         'Year': int(year)
     }
-    global controller
-    return float(controller.predict_emission(features))
+    # lru_cache tự đồng bộ hóa; mô hình rừng chỉ đọc nên không cần khóa toàn cục. Việc duyệt cây
+    # (numpy trên mảng nhỏ) vẫn giữ GIL phần lớn thời gian: luồng chỉ che I/O, không nhân thông lượng
+    # tính toán - mở rộng theo số CPU là việc của các worker (tiến trình)
+    return float(_models_by_version[version].predict(features))
+
+def _load_model():
+    """
+    Tải/huấn luyện mô hình - chạy trong luồng nền khởi tạo
+
+    Gán controller mới rồi mới set model_ready, nên request nào thấy
+    model_ready đều đọc được controller đã hoàn chỉnh.
+    """
+    global controller, init_error
+    try:
+        logger.info("Starting model initialization...")
+        start_time = time.perf_counter()  # Bắt đầu đo thời gian
+        
+        new_controller = EmissionController()  # Tạo đối tượng controller mới
+        # Sử dụng đường dẫn tuyệt đối đến file dữ liệu
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        csv_path = os.path.join(current_dir, "co2 Emissions.csv")
+        
+        # Kiểm tra sự tồn tại của file dữ liệu
+        if not os.path.exists(csv_path):
+            init_error = f"Could not find the file: {csv_path}"
+            logger.error(init_error)
+            return
+            
+        # Khởi tạo mô hình với dữ liệu từ file
+        test_score = new_controller.initialize_model(csv_path)
+        initialization_time = time.perf_counter() - start_time
+        logger.info(f"Model initialized with test score: {test_score:.3f} in {initialization_time:.2f} seconds")
+        
+        # Nạp sẵn cache cho các khóa nóng trước khi báo sẵn sàng
+        preload_hot_keys(new_controller.model)
+        
+        # Đánh dấu hoàn thành khởi tạo
+        controller = new_controller
+        init_error = None
+        model_ready.set()
+    except Exception as e:
+        init_error = str(e)
+        logger.error(f"Error initializing model: {str(e)}")
+        logger.error(traceback.format_exc())
+
+def start_model_initialization():
+    """
+    Bắt đầu khởi tạo mô hình trong luồng nền (chỉ một lần)
 
-def initialize_model():
+    Nếu luồng đang chạy hoặc mô hình đã sẵn sàng thì không làm gì.
+    Nếu lần khởi tạo trước thất bại, lần gọi tiếp theo sẽ thử lại.
+
+    Returns:
+        threading.Thread hoặc None: Luồng khởi tạo (None nếu mô hình đã sẵn sàng)
+    """
+    global _init_thread
+    if model_ready.is_set():
+        return None
+    with _init_lock:
+        if model_ready.is_set():
+            return None
+        if _init_thread is None or not _init_thread.is_alive():
+            _init_thread = threading.Thread(target=_load_model, name="model-init", daemon=True)
+            _init_thread.start()
+        return _init_thread
+
+def initialize_model(timeout=None):
     """
-    Khởi tạo mô hình nếu chưa được khởi tạo
+    Khởi tạo mô hình nếu chưa được khởi tạo và chờ tối đa timeout giây
     
     Đảm bảo mô hình chỉ được khởi tạo một lần duy nhất, tránh khởi tạo lại
-    khi có nhiều request đồng thời. Hàm kiểm tra và xử lý các trường hợp:
-    - Đang trong quá trình khởi tạo
-    - Mô hình đã được khởi tạo
-    - Cần khởi tạo mô hình mới
+    khi có nhiều request đồng thời.
     
+    Parameters:
+        timeout: Thời gian chờ tối đa (giây), None để chờ đến khi xong
+        
     Returns:
-        bool: True nếu mô hình đã khởi tạo thành công, False nếu có lỗi
+        bool: True nếu mô hình đã sẵn sàng, False nếu hết thời gian chờ hoặc có lỗi
     """
-    global controller, model_initialized, initialization_in_progress
-    
-    # Kiểm tra xem quá trình khởi tạo đã đang diễn ra hay chưa
-    if initialization_in_progress:
-        logger.info("Model initialization already in progress, waiting...")
-        return False
-        
-    if not model_initialized:
+    thread = start_model_initialization()
+    if thread is not None:
+        # Chờ luồng khởi tạo kết thúc (thành công hoặc lỗi) thay vì chỉ chờ sự kiện
+        thread.join(timeout)
+    return model_ready.is_set()
+
+def _restart_initialization_after_fork():
+    """
+    Luồng nền không tồn tại trong tiến trình con sau fork (gunicorn worker):
+    nếu mô hình chưa sẵn sàng lúc fork, tạo lại khóa và khởi tạo lại trong worker
+    """
+    global _init_lock, _init_thread
+    if not model_ready.is_set():
+        _init_lock = threading.Lock()
+        _init_thread = None
+        start_model_initialization()
+    # Luồng theo dõi artifact và luồng lưu khóa nóng cũng không được sao chép qua fork
+    start_model_watcher()
+    start_hot_key_saver()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_initialization_after_fork)
+
+# Kiểm soát tiếp nhận: giới hạn đồng thời thích ứng theo độ trễ và deadline của client
+# Số luồng thật của worker (gunicorn_config truyền qua WORKER_THREADS): số request đồng thời
+# không thể vượt con số này nên giới hạn của bộ điều khiển cũng được kẹp ở đó
+WORKER_THREADS = max(1, int(os.environ.get('WORKER_THREADS', '16')))
+concurrency_limiter = AdaptiveConcurrencyLimiter(
+    initial_limit=int(os.environ.get('ADMISSION_INITIAL_LIMIT', str(WORKER_THREADS))),
+    max_limit=min(int(os.environ.get('ADMISSION_MAX_LIMIT', str(WORKER_THREADS))), WORKER_THREADS)
+)
+# Khi hết chỗ, request xếp hàng theo làn ưu tiên thay vì bị từ chối ngay; các làn được định cỡ
+# theo số luồng vì request chờ vẫn giữ luồng, và một phần luồng chỉ dành cho làn tương tác
+scheduler = PriorityScheduler(concurrency_limiter, WORKER_THREADS)
+# Làn theo nguồn client (header X-Client-Source)
+CLIENT_LANES = {'streamlit-app': 'interactive', 'benchmark': 'batch'}
+# Làn mặc định theo endpoint khi client không khai báo
+ENDPOINT_LANES = {'predict': 'interactive', 'similar_vehicles': 'interactive',
+                  'predict_batch': 'bulk', 'predict_stream': 'bulk'}
+
+# Thay mô hình nóng (không khởi động lại server)
+reload_lock = threading.Lock()  # Mỗi lúc chỉ một lần tải mô hình mới
+last_reload = {}  # Kết quả lần thay mô hình gần nhất (hiển thị qua /admin/model)
+# Chu kỳ (giây) kiểm tra file CURRENT để tự tải phiên bản mới; 0 để tắt
+MODEL_WATCH_INTERVAL = float(os.environ.get('MODEL_WATCH_INTERVAL', '10'))
+_watcher_pid = None  # PID của tiến trình đã khởi động luồng theo dõi
+
+# Các xe mẫu dùng để làm nóng mô hình mới trước khi đưa vào phục vụ
+WARMUP_SAMPLES = [
+    [1.0, 3, 4.0, 100, 1000, 2015],
+    [2.0, 4, 8.0, 200, 1500, 2023],
+    [3.5, 6, 11.0, 350, 1800, 2020],
+    [5.0, 8, 15.0, 500, 2500, 2018],
+    [8.0, 12, 20.0, 800, 4000, 2024]
+]
+
+def warm_up_model(model):
+    """
+    Làm nóng mô hình mới: chạy dự đoán mẫu để nạp các trang bộ nhớ của artifact
+    và kiểm tra kết quả hợp lệ trước khi mô hình nhận request thật
+    """
+    predictions = model.predict_batch(WARMUP_SAMPLES)
+    for features in WARMUP_SAMPLES:
+        model.predict(dict(zip(model.features, features)))
+    if not all(0 < float(p) < 1000 for p in predictions):
+        raise ValueError(f"Warm-up predictions out of range: {list(predictions)}")
+
+def reload_model(version=None):
+    """
+    Tải một artifact mô hình, làm nóng rồi thay thế nguyên tử mô hình đang phục vụ
+
+    Request đang chạy tiếp tục dùng mô hình cũ (đã đọc tham chiếu); request mới dùng
+    mô hình mới. Cache được phân vùng theo phiên bản (khóa là chuỗi phiên bản, không giữ
+    mô hình cũ) nên không cần xóa.
+
+    Parameters:
+        version: Phiên bản artifact (mặc định: phiên bản trong file CURRENT)
+
+    Returns:
+        dict: Kết quả thay mô hình
+    """
+    global last_reload
+    if not reload_lock.acquire(blocking=False):
+        return {'status': 'busy', 'message': 'Another reload is in progress'}
+    try:
+        current = controller
+        if current is None:
+            return {'status': 'error', 'message': 'Model is not initialized'}
+        start_time = time.perf_counter()
+        new_model = EmissionModel()
+        if not new_model.load_artifact(version):
+            result = {'status': 'error', 'message': f'Artifact not found: {version or "CURRENT"}'}
+        elif new_model.version == current.model.version:
+            result = {'status': 'unchanged', 'version': new_model.version}
+        else:
+            warm_up_model(new_model)
+            # Cache được phân vùng theo phiên bản: nạp sẵn khóa nóng cho phiên bản mới trước khi thay
+            preload_hot_keys(new_model)
+            old_version = current.model.version
+            current.swap_model(new_model)
+            result = {
+                'status': 'success',
+                'version': new_model.version,
+                'previous_version': old_version,
+                'reload_time_ms': (time.perf_counter() - start_time) * 1000
+            }
+            logger.info(f"Model reloaded: {old_version} -> {new_model.version}")
+    except Exception as e:
+        result = {'status': 'error', 'message': str(e)}
+        logger.error(f"Error reloading model: {str(e)}")
+    finally:
+        reload_lock.release()
+    if result['status'] != 'unchanged':
+        last_reload = dict(result, at=time.time())
+    request_log.log('model_reload', always=True, **result)
+    return result
+
+def _watch_model_artifact():
+    """Luồng theo dõi: khi file CURRENT trỏ tới phiên bản khác, tải nóng phiên bản đó"""
+    pointer_reader = EmissionModel()
+    while True:
+        time.sleep(MODEL_WATCH_INTERVAL)
         try:
-            initialization_in_progress = True  # Đánh dấu bắt đầu quá trình khởi tạo
-            logger.info("Starting model initialization...")
-            start_time = time.perf_counter()  # Bắt đầu đo thời gian
-            
-            controller = EmissionController()  # Tạo đối tượng controller mới
-            # Sử dụng đường dẫn tuyệt đối đến file dữ liệu
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            csv_path = os.path.join(current_dir, "co2 Emissions.csv")
-            
-            # Kiểm tra sự tồn tại của file dữ liệu
-            if not os.path.exists(csv_path):
-                logger.error(f"Could not find the file: {csv_path}")
-                initialization_in_progress = False
-                return False
-                
-            # Khởi tạo mô hình với dữ liệu từ file
-            test_score = controller.initialize_model(csv_path)
-            initialization_time = time.perf_counter() - start_time
-            logger.info(f"Model initialized with test score: {test_score:.3f} in {initialization_time:.2f} seconds")
-            
-            # Đánh dấu hoàn thành khởi tạo
-            model_initialized = True
-            initialization_in_progress = False
-            return True
+            if not model_ready.is_set():
+                continue
+            version = pointer_reader.current_version()
+            if version and version != controller.model.version:
+                reload_model(version)
         except Exception as e:
-            logger.error(f"Error initializing model: {str(e)}")
-            logger.error(traceback.format_exc())
-            initialization_in_progress = False
-            return False
-    return True
+            logger.error(f"Model watcher error: {str(e)}")
+
+def start_model_watcher():
+    """Khởi động luồng theo dõi artifact (một lần cho mỗi tiến trình)"""
+    global _watcher_pid
+    if MODEL_WATCH_INTERVAL <= 0 or _watcher_pid == os.getpid():
+        return
+    _watcher_pid = os.getpid()
+    threading.Thread(target=_watch_model_artifact, name="model-watcher", daemon=True).start()
 
-# Middleware để khởi tạo mô hình trước khi xử lý request
-@app.before_request
-def setup():
+def preload_hot_keys(model):
     """
-    Khởi tạo mô hình trước khi xử lý các request
-    
-    Được gọi tự động trước mỗi request đến server.
-    Đảm bảo mô hình đã sẵn sàng trước khi xử lý các yêu cầu dự đoán.
+    Nạp sẵn vào cache dự đoán các khóa nóng đã lưu, bằng một lần gọi predict_batch
+
+    Returns:
+        int: Số mục đã nạp (0 nếu chưa có file hoặc có lỗi - không chặn khởi động)
     """
-    global model_initialized
-    if not model_initialized:
-        if not initialize_model():
-            logger.error("Failed to initialize model")
+    try:
+        start_time = time.perf_counter()
+        limit = min(HOT_KEYS_PRELOAD, prediction_cache.max_size)
+        keys = [key for key, _ in load_hot_keys(HOT_KEYS_PATH, limit) if len(key) == len(model.features)]
+        if not keys:
+            return 0
+        predictions = model.predict_batch(keys)
+        for key, prediction in zip(keys, predictions):
+            prediction_cache.put(get_cache_key(dict(zip(model.features, key)), model.version),
+                                 float(prediction))
+        logger.info(f"Preloaded {len(keys)} hot keys for model {model.version} "
+                    f"in {(time.perf_counter() - start_time) * 1000:.1f} ms")
+        return len(keys)
+    except Exception as e:
+        logger.warning(f"Hot key preload failed: {str(e)}")
+        return 0
+
+def save_hot_keys():
+    """Cộng các khóa nóng đã ghi nhận vào file (gọi định kỳ và khi tiến trình kết thúc)"""
+    try:
+        hot_keys.persist(HOT_KEYS_PATH)
+    except Exception as e:
+        logger.warning(f"Could not save hot keys: {str(e)}")
+
+def _save_hot_keys_periodically():
+    while True:
+        time.sleep(HOT_KEYS_SAVE_INTERVAL)
+        save_hot_keys()
+
+def start_hot_key_saver():
+    """Khởi động luồng lưu khóa nóng (một lần cho mỗi tiến trình)"""
+    global _hot_keys_pid
+    if HOT_KEYS_SAVE_INTERVAL <= 0 or _hot_keys_pid == os.getpid():
+        return
+    _hot_keys_pid = os.getpid()
+    threading.Thread(target=_save_hot_keys_periodically, name="hot-key-saver", daemon=True).start()
+
+def overload_response(start_time, reason, message):
+    """Phản hồi 503 nhanh khi request bị từ chối do quá tải hoặc không kịp deadline"""
+    request_log.warning('shed', reason=reason, request_id=request.headers.get('X-Request-ID'))
+    response = jsonify({
+        'error': message,
+        'process_time_ms': (time.perf_counter() - start_time) * 1000,
+        'status': 'rejected',
+        'reason': reason
+    })
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+def request_lane():
+    """
+    Xác định làn ưu tiên của request hiện tại
+
+    Thứ tự: header X-Priority (tên làn), header X-Client-Source, endpoint; mặc định 'batch'
+    """
+    lane = request.headers.get('X-Priority', '').lower()
+    if lane in scheduler.lanes:
+        return lane
+    lane = CLIENT_LANES.get(request.headers.get('X-Client-Source'))
+    return lane or ENDPOINT_LANES.get(request.endpoint, 'batch')
+
+def admission_controlled(view):
+    """
+    Decorator kiểm soát tiếp nhận cho các endpoint tính toán
+
+    - Header X-Request-Deadline (epoch ms): từ chối ngay nếu deadline đã qua,
+      hoặc nếu thời gian còn lại ít hơn độ trễ dự kiến của server
+    - Số request đồng thời vượt giới hạn thích ứng: xếp hàng theo làn ưu tiên
+      (không quá deadline và thời gian chờ tối đa của làn), từ chối với 503 khi
+      hàng đợi của làn đã đầy hoặc hết thời gian chờ; làn batch/bulk bị từ chối ngay khi
+      đã giữ hết phần luồng không dự trữ cho làn tương tác
+    - Header X-Request-Start (do proxy gắn): thời gian đã chờ trong backlog của gunicorn
+      được trừ vào thời gian chờ tối đa của làn và cộng vào mẫu độ trễ của bộ giới hạn
+    Nhờ vậy khi quá tải, server không tốn CPU cho các kết quả mà client sẽ bỏ đi,
+    và request tương tác luôn được phục vụ trước benchmark/bulk.
+
+    Với endpoint trong DEGRADABLE_ENDPOINTS, khi còn request đang chờ ở các làn hoặc thời gian
+    còn lại không đủ cho một lần dự đoán đầy đủ, g.latency_budget (giây) được đặt để handler
+    dùng suy luận anytime (ít cây hơn) thay vì từ chối request.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        start_time = time.perf_counter()
+        g.latency_budget = None
+        degradable = request.endpoint in DEGRADABLE_ENDPOINTS
+        # Thời gian xử lý tối thiểu cần có: endpoint giảm cấp được chỉ cần ngân sách anytime
+        service_time = concurrency_limiter.estimated_latency()
+        if degradable:
+            service_time = min(service_time, ANYTIME_BUDGET_MS / 1000)
+        remaining = parse_deadline(request.headers.get('X-Request-Deadline'))
+        if remaining is not None:
+            if remaining <= 0:
+                return overload_response(start_time, 'deadline_exceeded', 'Request deadline already passed')
+            if remaining < service_time:
+                return overload_response(start_time, 'deadline_unmeetable',
+                                         'Request deadline cannot be met at current load')
+        lane = request_lane()
+        # Thời gian đã nằm trong backlog accept của gunicorn - hàng đợi mà bộ lập lịch không thấy
+        upstream_wait = parse_request_start(request.headers.get('X-Request-Start')) or 0.0
+        # Chờ trong hàng đợi tối đa đến lúc chỉ còn đủ thời gian để xử lý; thời gian chờ của làn
+        # tính từ lúc request tới proxy chứ không phải lúc có luồng
+        timeout = scheduler.lanes[lane].max_wait - upstream_wait
+        if remaining is not None:
+            timeout = min(timeout, remaining - service_time)
+        rejection = scheduler.acquire(lane, timeout)
+        if rejection is not None:
+            return overload_response(start_time, rejection, f"Server is at its concurrency limit ({lane} lane)")
+        if degradable:
+            left = None if remaining is None else remaining - (time.perf_counter() - start_time)
+            if left is not None and left < concurrency_limiter.estimated_latency():
+                g.latency_budget = max(left, 0.0)
+            if scheduler.waiting():
+                # Ngân sách 0.0 (deadline đã dùng hết) vẫn là ngân sách hợp lệ, không phải "chưa đặt"
+                budget = math.inf if g.latency_budget is None else g.latency_budget
+                g.latency_budget = min(budget, ANYTIME_BUDGET_MS / 1000)
+        latency = None  # None: không lấy mẫu độ trễ cho request này
+        success = False
+        # Độ trễ cho bộ giới hạn không tính thời gian xếp hàng do chính nó gây ra,
+        # nhưng tính thời gian chờ trong backlog của gunicorn (quá tải mà nó cần thấy)
+        compute_start = time.perf_counter() - upstream_wait
+        try:
+            response = make_response(view(*args, **kwargs))
+            success = response.status_code < 500
+            # 503 của handler (mô hình chưa sẵn sàng) không phản ánh tải; request bulk chạy lâu
+            # theo kích thước lô nên cũng không dùng làm mẫu độ trễ của một request thông thường;
+            # request đã giảm cấp nhanh một cách nhân tạo nên cũng không được lấy mẫu
+            if response.status_code != 503 and lane != 'bulk' and g.latency_budget is None:
+                latency = time.perf_counter() - compute_start
+            return response
+        except Exception:
+            latency = time.perf_counter() - compute_start
+            raise
+        finally:
+            scheduler.release(latency, success, lane)
+    return wrapper
+
+def model_unavailable_response(start_time):
+    """Phản hồi 503 kèm Retry-After khi mô hình chưa sẵn sàng"""
+    response = jsonify({
+        'error': 'Model is not ready yet',
+        'process_time_ms': (time.perf_counter() - start_time) * 1000,
+        'status': 'unavailable',
+        'message': init_error or 'Model initialization in progress'
+    })
+    response.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+    return response, 503
+
+def requested_quantiles():
+    """
+    Các mức phân vị được yêu cầu qua query string, None nếu request không cần độ bất định
+
+    ?uncertainty=1 dùng DEFAULT_QUANTILES; ?quantiles=0.1,0.5,0.9 chọn mức cụ thể.
+
+    Raises:
+        ValueError: Mức phân vị không hợp lệ
+    """
+    if 'quantiles' in request.args:
+        quantiles = [float(q) for q in request.args['quantiles'].split(',') if q.strip()]
+        if not quantiles or len(quantiles) > MAX_QUANTILES or not all(0.0 <= q <= 1.0 for q in quantiles):
+            raise ValueError(f"quantiles must be 1-{MAX_QUANTILES} comma-separated values in [0, 1]")
+        return quantiles
+    if request.args.get('uncertainty', '').lower() in ('1', 'true', 'yes'):
+        return list(DEFAULT_QUANTILES)
+    return None
 
-def get_cache_key(data):
+def get_cache_key(data, model_version=None):
     """
     Tạo khóa cache từ dữ liệu đầu vào
     
     Chuyển đổi dữ liệu đầu vào thành chuỗi khóa duy nhất để lưu và truy xuất trong cache.
+    Khóa được gắn tiền tố phiên bản mô hình, nên sau khi thay mô hình
+    các mục cũ không còn khớp và không cần xóa toàn bộ cache.
     
     Parameters:
         data: Dictionary chứa các thông số của xe
+        model_version: Phiên bản mô hình tạo ra kết quả
         
     Returns:
         str: Chuỗi khóa duy nhất đại diện cho bộ thông số, hoặc None nếu có lỗi
     """
     try:
-        key_parts = []
+        key_parts = [f"v:{model_version}"]
         for field in ['Engine Size(L)', 'Cylinders', 'Fuel Consumption Comb (L/100 km)', 
                      'Horsepower', 'Weight (kg)', 'Year']:
             if field in data:
-                key_parts.append(f"{field}:{data[field]}")
+                # Dạng số thực chuẩn: 2 và "2.0" cho cùng một khóa
+                key_parts.append(f"{field}:{float(data[field])}")
         return "|".join(key_parts)
     except:
         # Xử lý dự phòng trong trường hợp có lỗi
@@ -163,6 +565,7 @@ def get_cache_key(data):
 
 @app.route('/predict', methods=['POST'])
 @limiter.limit("100 per second")  # Tăng giới hạn lên 100 request/giây cho endpoint này
+@admission_controlled
 def predict():
     """
     Endpoint chính của API để dự đoán lượng khí thải CO2
@@ -185,15 +588,14 @@ def predict():
         return jsonify({'error': 'Request must be JSON', 'status': 'error'}), 400
     
     try:    
-        # Đảm bảo mô hình đã được khởi tạo - nếu không, trả về giá trị dự phòng
-        if not model_initialized:
-            if not initialize_model():
-                logger.warning("Model not initialized, returning fallback value")
-                return jsonify({
-                    'prediction': 200.0,  # Giá trị mặc định: 200g/km
-                    'process_time_ms': (time.perf_counter() - start_time) * 1000,
-                    'status': 'fallback'
-                }), 200
+        # Mô hình chưa sẵn sàng: chờ có giới hạn, hết hạn thì trả 503 + Retry-After
+        # (không trả giá trị giả)
+        if not model_ready.is_set():
+            start_model_initialization()
+            if not model_ready.wait(MODEL_READY_TIMEOUT):
+                request_log.warning('unavailable', reason='model_not_ready',
+                                    request_id=request.headers.get('X-Request-ID'))
+                return model_unavailable_response(start_time)
         
         # Lấy dữ liệu từ request
         data = request.json
@@ -207,7 +609,8 @@ def predict():
         
         # Kiểm tra đầy đủ các trường - nếu thiếu, trả về giá trị dự phòng
         if not all(field in data for field in required_fields):
-            logger.warning(f"Missing required fields, returning fallback. Received: {data}")
+            request_log.warning('fallback', reason='missing_fields', data=data,
+                                request_id=request.headers.get('X-Request-ID'))
             return jsonify({
                 'prediction': 200.0,  # Giá trị mặc định
                 'process_time_ms': (time.perf_counter() - start_time) * 1000,
@@ -215,40 +618,94 @@ def predict():
                 'message': 'Missing fields'
             }), 200
         
+        # Đọc tham chiếu mô hình một lần: cache key và phép dự đoán dùng cùng một phiên bản
+        model = controller.model
+        
         # Kiểm tra cache trước khi thực hiện dự đoán - tối ưu hóa hiệu năng
-        cache_key = get_cache_key(data)
-        if cache_key and cache_key in prediction_cache:
-            cached_result = prediction_cache[cache_key]
+        cache_key = get_cache_key(data, model.version)
+        if cache_key:
+            # Ghi nhận vector đặc trưng chuẩn hóa cho sketch khóa nóng
+            hot_keys.record(tuple(float(data[field]) for field in required_fields))
+        n_estimators = model.forest.n_trees  # Dự đoán đầy đủ dùng mọi cây của rừng
+
+        # Độ bất định (?uncertainty=1 hoặc ?quantiles=...): cần giá trị của từng cây nên không
+        # trả từ cache, nhưng giá trị trung bình vẫn được lưu cho các request thường
+        try:
+            quantiles = requested_quantiles()
+        except ValueError as e:
+            return jsonify({'error': str(e), 'status': 'error'}), 400
+        if quantiles is not None:
+            result = model.predict_with_uncertainty(
+                {field: float(data[field]) for field in required_fields}, quantiles)
+            if cache_key:
+                prediction_cache.put(cache_key, result['prediction'])
+            process_time = (time.perf_counter() - start_time) * 1000
+            request_log.log('prediction', data=data, prediction=round(result['prediction'], 3),
+                            std=round(result['std'], 3), process_time_ms=round(process_time, 3),
+                            request_id=request.headers.get('X-Request-ID'))
+            return jsonify({
+                'prediction': result['prediction'],
+                'std': result['std'],
+                'quantiles': {f"{q:g}": value for q, value in result['quantiles'].items()},
+                'process_time_ms': process_time,
+                'cached': False,
+                'n_estimators_used': n_estimators,
+                'model_version': model.version,
+                'status': 'success'
+            }), 200
+
+        cached_result = prediction_cache.get(cache_key) if cache_key else None
+        if cached_result is not None:
             process_time = (time.perf_counter() - start_time) * 1000
+            request_log.log('prediction', cached=True, prediction=round(float(cached_result), 3),
+                            process_time_ms=round(process_time, 3),
+                            request_id=request.headers.get('X-Request-ID'))
             return jsonify({
                 'prediction': float(cached_result),
                 'process_time_ms': process_time,
                 'cached': True,
+                'n_estimators_used': n_estimators,
+                'model_version': model.version,
+                'status': 'success'
+            }), 200
+
+        # Quá tải hoặc sắp hết deadline: dự đoán anytime với ít cây hơn thay vì giá trị giả;
+        # kết quả không chính xác tuyệt đối nên không được lưu vào cache
+        if g.latency_budget is not None:
+            result = model.predict_anytime({field: float(data[field]) for field in required_fields},
+                                           budget=g.latency_budget, tolerance=ANYTIME_TOLERANCE)
+            process_time = (time.perf_counter() - start_time) * 1000
+            request_log.log('prediction', data=data, prediction=round(result['prediction'], 3),
+                            degraded=True, n_estimators_used=result['n_estimators_used'],
+                            process_time_ms=round(process_time, 3),
+                            request_id=request.headers.get('X-Request-ID'))
+            return jsonify({
+                'prediction': result['prediction'],
+                'process_time_ms': process_time,
+                'cached': False,
+                'degraded': True,
+                'n_estimators_used': result['n_estimators_used'],
+                'ci_halfwidth': result['ci_halfwidth'],
+                'model_version': model.version,
                 'status': 'success'
             }), 200
         
-        # Ghi log request (chỉ log 10% request để giảm tải I/O)
-        if start_time % 10 < 1:
-            logger.info(f"Received prediction request: {data}")
-        
-        # Thực hiện dự đoán với cache lru
+        # Thực hiện dự đoán với cache lru - không giữ khóa toàn cục (các luồng vẫn tranh GIL khi tính)
         try:
-            with prediction_lock:  # Khóa đồng bộ hóa để đảm bảo an toàn thread
-                prediction = cached_predict(
-                    data['Engine Size(L)'],
-                    data['Cylinders'],
-                    data['Fuel Consumption Comb (L/100 km)'],
-                    data['Horsepower'],
-                    data['Weight (kg)'],
-                    data['Year']
-                )
-                
-                # Lưu kết quả vào cache
-                if cache_key and len(prediction_cache) < MAX_CACHE_SIZE:
-                    prediction_cache[cache_key] = prediction
+            # Khóa single-flight là vector đặc trưng chuẩn hóa (float theo thứ tự cố định)
+            # cùng phiên bản mô hình: các request trùng nhau đang chờ dùng chung một lần tính
+            args = tuple(float(data[field]) for field in required_fields)
+            _models_by_version[model.version] = model
+            prediction, coalesced = prediction_flight.do((model.version,) + args,
+                                                         cached_predict, model.version, *args)
+            
+            # Lưu kết quả vào cache (LRU tự loại bỏ phần tử cũ khi đầy)
+            if cache_key:
+                prediction_cache.put(cache_key, prediction)
         except Exception as inner_e:
             # Xử lý lỗi khi dự đoán - trả về giá trị dự phòng
-            logger.error(f"Error making prediction: {str(inner_e)}")
+            request_log.error('prediction_error', error=str(inner_e), data=data,
+                              request_id=request.headers.get('X-Request-ID'))
             return jsonify({
                 'prediction': 200.0,
                 'process_time_ms': (time.perf_counter() - start_time) * 1000,
@@ -259,22 +716,26 @@ def predict():
         # Tính toán thời gian xử lý
         process_time = (time.perf_counter() - start_time) * 1000
         
-        # Ghi log kết quả (chỉ log 10% request)
-        if start_time % 10 < 1:
-            logger.info(f"Prediction: {prediction:.2f}, Processing time: {process_time:.2f}ms")
+        # Ghi log kết quả (lấy mẫu tất định 1/N, ghi bất đồng bộ)
+        request_log.log('prediction', data=data, prediction=round(float(prediction), 3),
+                        process_time_ms=round(process_time, 3),
+                        request_id=request.headers.get('X-Request-ID'))
         
         # Trả về kết quả dự đoán thành công
         return jsonify({
             'prediction': float(prediction),
             'process_time_ms': process_time,
             'cached': False,
+            'coalesced': coalesced,
+            'n_estimators_used': n_estimators,
+            'model_version': model.version,
             'status': 'success'
         }), 200
         
     except Exception as e:
         # Xử lý các lỗi không mong muốn
-        logger.error(f"Error processing request: {str(e)}")
-        logger.error(traceback.format_exc())
+        request_log.error('request_error', error=str(e), traceback=traceback.format_exc(),
+                          request_id=request.headers.get('X-Request-ID'))
         
         # Luôn trả về status 200 với giá trị dự phòng để cải thiện trải nghiệm người dùng
         return jsonify({
@@ -284,6 +745,284 @@ def predict():
             'message': str(e)
         }), 200
 
+@app.route('/predict/batch', methods=['POST'])
+@admission_controlled
+def predict_batch():
+    """
+    Endpoint dự đoán hàng loạt với định dạng dạng cột
+
+    Request (theo Content-Type):
+        application/x-npy: file .npy, mảng float32/float64 kích thước (n_rows, n_features)
+        application/x-co2-columns (hoặc application/octet-stream): header 12 byte
+            '<4sBBHI' (b'CO2B', 1, ord('f'|'d'), n_features, n_rows) rồi các cột liên tục
+        application/json: {"rows": [[...]]}, {"columns": {tên: [...]}} hoặc {"instances": [{...}]}
+    Các cột theo đúng thứ tự đặc trưng của mô hình (xem /admin/model).
+
+    Response (theo header Accept, mặc định cùng định dạng với request):
+        nhị phân: vector dự đoán (cùng kiểu số thực với request), metadata trong header
+        X-Model-Version, X-Rows, X-Process-Time-Ms; JSON: {"predictions": [...], ...}
+        Với ?annotate=1, JSON có thêm "ratings" (A-F), "tip_codes" và bảng tra "tip_table"
+        (tip_table[mã] là danh sách mẹo) - tính vector hóa cho cả lô
+        Với ?uncertainty=1 hoặc ?quantiles=0.1,0.9: JSON có thêm "std" và "quantiles"
+        {mức: [...]}; nhị phân trả nhiều cột (dự đoán, std, các phân vị), tên cột trong X-Columns
+    """
+    start_time = time.perf_counter()
+    if not model_ready.is_set():
+        start_model_initialization()
+        if not model_ready.wait(MODEL_READY_TIMEOUT):
+            return model_unavailable_response(start_time)
+
+    model = controller.model
+    fmt = bulk_codec.request_format(request.content_type)
+    too_many_rows = {'error': f'Too many rows (limit {BULK_MAX_ROWS})', 'status': 'error'}
+    # Body nhị phân: từ chối theo Content-Length trước khi đọc, và chỉ đọc tối đa giới hạn + 1 byte
+    # (body chunked không có Content-Length) - không đọc cả body quá lớn vào bộ nhớ
+    max_bytes = bulk_codec.max_body_bytes(fmt, len(model.features), BULK_MAX_ROWS)
+    if max_bytes is not None and (request.content_length or 0) > max_bytes:
+        return jsonify(too_many_rows), 413
+    body = request.stream.read(max_bytes + 1) if max_bytes is not None else None
+    if body is not None and len(body) > max_bytes:
+        return jsonify(too_many_rows), 413
+    try:
+        json_payload = request.get_json(silent=True) if fmt == 'json' else None
+        X = bulk_codec.decode_matrix(body, fmt, model.features, json_payload)
+    except (ValueError, KeyError, TypeError) as e:
+        return jsonify({'error': f'Invalid payload: {str(e)}', 'status': 'error'}), 400
+    if len(X) > BULK_MAX_ROWS:
+        return jsonify({'error': f'Too many rows ({len(X)} > {BULK_MAX_ROWS})', 'status': 'error'}), 413
+    # NaN/inf không làm lỗi phép duyệt cây mà cho ra dự đoán sai - trả 400 kèm chỉ số các dòng lỗi
+    invalid = bulk_codec.nonfinite_rows(X)
+    if len(invalid):
+        return jsonify({'error': f'Non-finite values in {len(invalid)} rows',
+                        'invalid_rows': invalid[:100].tolist(), 'n_invalid_rows': len(invalid),
+                        'status': 'error'}), 400
+    try:
+        quantiles = requested_quantiles()
+    except ValueError as e:
+        return jsonify({'error': str(e), 'status': 'error'}), 400
+
+    # Suy luận theo từng khối MICRO_BATCH_SIZE dòng trên view của body, không qua đối tượng Python
+    if quantiles is None:
+        predictions = model.predict_batch(X, block_size=MICRO_BATCH_SIZE)
+    else:
+        uncertainty = model.predict_batch_with_uncertainty(X, quantiles, block_size=MICRO_BATCH_SIZE)
+        predictions = uncertainty['mean']
+    process_time = (time.perf_counter() - start_time) * 1000
+    request_log.log('batch_prediction', format=fmt, rows=len(X), process_time_ms=round(process_time, 3),
+                    request_id=request.headers.get('X-Request-ID'))
+
+    out_format = bulk_codec.response_format(request.headers.get('Accept'), fmt)
+    if out_format == 'json':
+        result = {
+            'predictions': predictions.tolist(),
+            'n_rows': len(X),
+            'model_version': model.version,
+            'process_time_ms': process_time,
+            'status': 'success'
+        }
+        if request.args.get('annotate', '').lower() in ('1', 'true', 'yes'):
+            result['ratings'] = controller.get_emission_ratings(predictions).tolist()
+            result['tip_codes'] = controller.get_eco_tip_codes(predictions).tolist()
+            result['tip_table'] = [list(tips) for tips in ECO_TIP_SETS]
+        if quantiles is not None:
+            result['std'] = uncertainty['std'].tolist()
+            result['quantiles'] = {f"{q:g}": values.tolist() for q, values in zip(quantiles, uncertainty['quantiles'])}
+        return jsonify(result), 200
+    dtype = X.dtype if X.dtype in (np.float32, np.float64) else np.float64
+    if quantiles is None:
+        body, mimetype = bulk_codec.encode_vector(predictions, out_format, dtype)
+    else:
+        body, mimetype = bulk_codec.encode_columns(
+            [predictions, uncertainty['std'], *uncertainty['quantiles']], out_format, dtype)
+    response = Response(body, mimetype=mimetype)
+    if quantiles is not None:
+        response.headers['X-Columns'] = ','.join(['prediction', 'std'] + [f"q{q:g}" for q in quantiles])
+    response.headers['X-Model-Version'] = model.version
+    response.headers['X-Rows'] = str(len(X))
+    response.headers['X-Process-Time-Ms'] = f"{process_time:.3f}"
+    return response
+
+@app.route('/vehicles/similar', methods=['POST'])
+@admission_controlled
+def similar_vehicles():
+    """
+    Endpoint tìm các xe thật trong bộ dữ liệu giống với xe đã nhập nhất
+
+    Body giống /predict; số xe trả về qua tham số ?k= (mặc định 5, tối đa MAX_SIMILAR_VEHICLES).
+    Tìm kiếm KD-tree trên không gian đặc trưng đã chuẩn hóa của mô hình.
+    """
+    start_time = time.perf_counter()
+    if not request.is_json:
+        return jsonify({'error': 'Request must be JSON', 'status': 'error'}), 400
+    if not model_ready.is_set():
+        start_model_initialization()
+        if not model_ready.wait(MODEL_READY_TIMEOUT):
+            return model_unavailable_response(start_time)
+
+    model = controller.model
+    if model.vehicle_index is None:
+        return jsonify({'error': 'Similarity index is not available for this model version',
+                        'status': 'unavailable'}), 503
+    data = request.json
+    missing = [field for field in model.features if field not in data]
+    if missing:
+        return jsonify({'error': f'Missing fields: {missing}', 'status': 'error'}), 400
+    try:
+        k = max(1, min(int(request.args.get('k', 5)), MAX_SIMILAR_VEHICLES))
+        vehicles = model.find_similar_vehicles(data, k)
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': str(e), 'status': 'error'}), 400
+    return jsonify({
+        'vehicles': vehicles,
+        'model_version': model.version,
+        'process_time_ms': (time.perf_counter() - start_time) * 1000,
+        'status': 'success'
+    }), 200
+
+def _acquire_stream_slot(lane):
+    """
+    Xin chỗ xử lý cho một khối của luồng; hàng đợi của làn đầy thì chờ rồi thử lại
+
+    Returns:
+        bool: False nếu quá STREAM_SLOT_TIMEOUT mà vẫn chưa có chỗ (làn bulk bão hòa)
+    """
+    deadline = time.monotonic() + STREAM_SLOT_TIMEOUT
+    while True:
+        left = deadline - time.monotonic()
+        if left <= 0:
+            return False
+        if scheduler.acquire(lane, timeout=left, hold_thread=False) is None:
+            return True
+        time.sleep(min(0.05, max(left, 0)))
+
+@app.route('/predict/stream', methods=['POST'])
+def predict_stream():
+    """
+    Endpoint chấm điểm dạng luồng cho file xe rất lớn
+
+    Body (có thể gửi chunked) được đọc từng dòng: NDJSON (application/x-ndjson, mặc định)
+    hoặc CSV (text/csv, dòng đầu là header). Cứ MICRO_BATCH_SIZE dòng được dự đoán một lần
+    và kết quả được trả về ngay (NDJSON hoặc CSV theo Accept, mặc định cùng định dạng),
+    nên bộ nhớ của cả hai phía không phụ thuộc kích thước file.
+
+    Mỗi khối xin một chỗ ở làn ưu tiên bulk, nên request tương tác được xen vào giữa các khối;
+    khối chờ quá STREAM_SLOT_TIMEOUT thì luồng kết thúc bằng một bản ghi lỗi và trả luồng xử lý.
+    Dòng lỗi (kể cả giá trị nan/inf) được trả về kèm thông báo lỗi, không làm dừng luồng.
+    Tiến độ (số dòng, số khối) của các luồng đang chạy có trong /health.
+    """
+    start_time = time.perf_counter()
+    if not model_ready.is_set():
+        start_model_initialization()
+        if not model_ready.wait(MODEL_READY_TIMEOUT):
+            return model_unavailable_response(start_time)
+
+    model = controller.model
+    in_format = stream_scoring.stream_format(request.content_type)
+    accept = (request.headers.get('Accept') or '').lower()
+    if stream_scoring.CSV_MIME in accept or stream_scoring.NDJSON_MIME in accept:
+        out_format = stream_scoring.stream_format(accept)
+    else:
+        out_format = in_format
+
+    lines = (line.decode('utf-8') for line in request.stream)
+    records = stream_scoring.iter_records(lines, in_format, model.features)
+    try:
+        # Đọc trước bản ghi đầu tiên: header CSV sai được báo bằng 400 trước khi bắt đầu trả luồng
+        first = next(records, None)
+    except ValueError as e:
+        return jsonify({'error': str(e), 'status': 'error'}), 400
+    lane = request_lane()
+    # Luồng dữ liệu giữ một luồng của worker suốt thời gian chạy, kể cả giữa các khối
+    rejection = scheduler.enter(lane)
+    if rejection is not None:
+        return overload_response(start_time, rejection, f"Server is at its concurrency limit ({lane} lane)")
+    progress = stream_tracker.start(request.headers.get('X-Request-ID'))
+
+    def score_block(block):
+        # None nếu không có chỗ xử lý trong STREAM_SLOT_TIMEOUT
+        valid = [i for i, (_, _, values, _) in enumerate(block) if values is not None]
+        predictions = [None] * len(block)
+        if valid:
+            if not _acquire_stream_slot(lane):
+                return None
+            success = False
+            try:
+                values = model.predict_batch([block[i][2] for i in valid])
+                success = True
+            finally:
+                # Khối lớn không dùng làm mẫu độ trễ cho bộ giới hạn đồng thời
+                scheduler.release(None, success)
+            for i, prediction in zip(valid, values):
+                predictions[i] = float(prediction)
+        stream_tracker.advance(progress, len(valid), len(block) - len(valid))
+        return stream_scoring.encode_results(
+            [(row, row_id, predictions[i], error) for i, (row, row_id, _, error) in enumerate(block)],
+            out_format)
+
+    def blocks():
+        block = []
+        rows = itertools.chain([first], records) if first is not None else records
+        for row, (row_id, values, error) in enumerate(rows):
+            block.append((row, row_id, values, error))
+            if len(block) >= MICRO_BATCH_SIZE:
+                yield block
+                block = []
+        if block:
+            yield block
+
+    def stream_timeout_record(row):
+        # Bản ghi lỗi cuối luồng: các dòng từ row trở đi không được chấm
+        message = f"Server is at its concurrency limit ({lane} lane); rows from {row} were not scored"
+        request_log.warning('shed', reason='stream_slot_timeout', rows=progress['rows'],
+                            request_id=request.headers.get('X-Request-ID'))
+        if out_format == 'csv':
+            return stream_scoring.encode_results([(row, None, None, message)], out_format)
+        return json.dumps({'error': message, 'status': 'rejected', 'reason': 'queue_timeout',
+                           'row': row, 'rows': progress['rows']}) + '\n'
+
+    def generate():
+        try:
+            if out_format == 'csv':
+                yield 'row,id,prediction,error\n'
+            for block in blocks():
+                chunk = score_block(block)
+                if chunk is None:
+                    yield stream_timeout_record(block[0][0])
+                    return
+                yield chunk
+            if out_format == 'ndjson':
+                # Dòng tổng kết cuối luồng
+                yield json.dumps({'summary': {
+                    'rows': progress['rows'],
+                    'errors': progress['errors'],
+                    'blocks': progress['blocks'],
+                    'model_version': model.version,
+                    'process_time_ms': round((time.perf_counter() - start_time) * 1000, 3)
+                }}) + '\n'
+            request_log.log('stream_prediction', always=True, rows=progress['rows'],
+                            errors=progress['errors'],
+                            process_time_ms=round((time.perf_counter() - start_time) * 1000, 3),
+                            request_id=request.headers.get('X-Request-ID'))
+        finally:
+            stream_tracker.finish(progress)
+
+    response = Response(stream_with_context(generate()),
+                        mimetype=stream_scoring.CSV_MIME if out_format == 'csv' else stream_scoring.NDJSON_MIME)
+    response.headers['X-Model-Version'] = model.version
+    response.headers['X-Stream-Id'] = str(progress['id'])
+    # Trả luồng khi server đóng response - cả khi client ngắt trước lúc luồng kết quả bắt đầu
+    response.call_on_close(lambda: scheduler.leave(lane))
+    return response
+
+def health_evaluation():
+    """Tóm tắt báo cáo đánh giá đã lưu của mô hình đang phục vụ (None nếu chưa được tính)"""
+    try:
+        report = controller.get_evaluation_report()
+    except Exception as e:
+        logger.warning(f"Could not read evaluation report: {str(e)}")
+        return None
+    return summarize_report(report) if report is not None else None
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """
@@ -296,8 +1035,8 @@ def health_check():
         JSON: Thông tin trạng thái API và model
     """
     try:
-        if not model_initialized:
-            if initialization_in_progress:
+        if not model_ready.is_set():
+            if _init_thread is not None and _init_thread.is_alive():
                 return jsonify({
                     "status": "initializing",
                     "message": "Model initialization in progress"
@@ -305,13 +1044,20 @@ def health_check():
             else:
                 return jsonify({
                     "status": "initializing",
-                    "message": "Model not yet initialized"
+                    "message": init_error or "Model not yet initialized"
                 }), 200
         return jsonify({
             "status": "healthy",
             "message": "API is running and model is initialized",
+            "model_version": controller.model.version,
+            "evaluation": health_evaluation(),
             "stats": {
-                "cache_size": len(prediction_cache)  # Thống kê kích thước cache hiện tại
+                "cache_size": len(prediction_cache),  # Thống kê kích thước cache hiện tại
+                "cache": prediction_cache.stats(),
+                "single_flight": prediction_flight.stats(),
+                "admission": concurrency_limiter.stats(),
+                "lanes": scheduler.stats(),
+                "streams": stream_tracker.stats()
             }
         }), 200
     except Exception as e:
@@ -326,16 +1072,14 @@ def clear_cache():
     """
     Endpoint xóa cache dự đoán
     
-    Xóa toàn bộ cache để giải phóng bộ nhớ hoặc cập nhật kết quả dự đoán
-    khi mô hình được cập nhật.
+    Xóa toàn bộ cache để giải phóng bộ nhớ. Khi thay mô hình không cần gọi
+    endpoint này vì khóa cache đã gắn phiên bản mô hình.
     
     Returns:
         JSON: Kết quả thực hiện xóa cache
     """
-    global prediction_cache
     try:
-        old_size = len(prediction_cache)  # Lưu kích thước cache cũ
-        prediction_cache = {}  # Xóa dictionary cache
+        old_size = prediction_cache.clear()  # Xóa cache và lấy số phần tử đã xóa
         cached_predict.cache_clear()  # Xóa lru_cache
         return jsonify({
             "status": "success",
@@ -365,6 +1109,139 @@ def fallback_prediction():
         'cached': False
     }), 200
 
+def is_debug_authorized():
+    """
+    Kiểm tra quyền truy cập các endpoint debug/admin
+
+    Endpoint chỉ hoạt động khi biến môi trường DEBUG_TOKEN được thiết lập,
+    và request phải gửi đúng token trong header X-Debug-Token.
+    """
+    token = os.environ.get('DEBUG_TOKEN')
+    if not token:
+        return False
+    provided = request.headers.get('X-Debug-Token', '')
+    return hmac.compare_digest(provided.encode(), token.encode())
+
+@app.route('/debug/profile', methods=['GET'])
+@limiter.exempt
+def debug_profile():
+    """
+    Endpoint profiling theo yêu cầu cho worker hiện tại
+
+    Query parameters:
+        seconds: Thời gian lấy mẫu (mặc định 5, tối đa MAX_PROFILE_SECONDS)
+        mode: 'cpu' (lấy mẫu stack mọi luồng) hoặc 'alloc' (tracemalloc)
+        since: 'start' - với mode=alloc, so sánh với snapshot lúc khởi động
+               (cần PROFILE_TRACEMALLOC=true)
+        format: 'json' (mặc định) hoặc 'collapsed' (text cho flamegraph)
+        top: Số dòng trong bảng tổng hợp (mặc định 20)
+
+    Returns:
+        JSON hoặc text: Stack dạng collapsed và bảng top-N
+    """
+    if not is_debug_authorized():
+        # Trả về 404 để không lộ sự tồn tại của endpoint
+        return jsonify({'error': 'Not found', 'status': 'error'}), 404
+
+    try:
+        seconds = float(request.args.get('seconds', 5))
+        top_n = int(request.args.get('top', 20))
+    except ValueError:
+        return jsonify({'error': 'Invalid seconds/top', 'status': 'error'}), 400
+    if not math.isfinite(seconds):
+        # nan/inf lọt qua float() nhưng làm time.sleep lỗi (500)
+        return jsonify({'error': 'Invalid seconds/top', 'status': 'error'}), 400
+    seconds = min(max(seconds, 0.0), MAX_PROFILE_SECONDS)
+    mode = request.args.get('mode', 'cpu')
+
+    if not profile_lock.acquire(blocking=False):
+        return jsonify({'error': 'Another profile is running', 'status': 'error'}), 409
+    try:
+        if mode == 'alloc':
+            if request.args.get('since') == 'start':
+                result = allocation_tracker.since_start(top_n)
+                if result is None:
+                    return jsonify({
+                        'error': 'Allocation tracking not enabled (set PROFILE_TRACEMALLOC=true)',
+                        'status': 'error'
+                    }), 400
+            else:
+                result = allocation_tracker.profile(seconds, top_n)
+            result.update({'mode': 'alloc', 'pid': os.getpid(), 'status': 'success'})
+            return jsonify(result), 200
+
+        profiler = SamplingProfiler().run(seconds)
+        if request.args.get('format') == 'collapsed':
+            return Response(profiler.collapsed(), mimetype='text/plain')
+        return jsonify({
+            'mode': 'cpu',
+            'pid': os.getpid(),
+            'duration_s': round(profiler.duration, 3),
+            'samples': profiler.samples,
+            'top': profiler.top(top_n),
+            'collapsed': profiler.collapsed(),
+            'status': 'success'
+        }), 200
+    finally:
+        profile_lock.release()
+
+@app.route('/admin/reload', methods=['POST'])
+@limiter.exempt
+def admin_reload():
+    """
+    Endpoint thay mô hình nóng
+
+    Body JSON (tùy chọn):
+        version: Phiên bản artifact cần chuyển sang (mặc định: phiên bản trong CURRENT).
+                 Nếu được chỉ định, file CURRENT cũng được cập nhật để các worker khác
+                 tự chuyển theo qua luồng theo dõi.
+        wait: true để chờ tải xong rồi mới trả kết quả
+
+    Returns:
+        JSON: 202 khi đã bắt đầu tải nền, hoặc kết quả nếu wait=true
+    """
+    if not is_debug_authorized():
+        return jsonify({'error': 'Not found', 'status': 'error'}), 404
+    if not model_ready.is_set():
+        return model_unavailable_response(time.perf_counter())
+
+    body = request.get_json(silent=True) or {}
+    version = body.get('version')
+    if version:
+        try:
+            EmissionModel().set_current_version(version)
+        except ValueError as e:
+            return jsonify({'error': str(e), 'status': 'error'}), 404
+
+    if body.get('wait'):
+        result = reload_model(version)
+        return jsonify(result), 200 if result['status'] in ('success', 'unchanged') else 409
+    threading.Thread(target=reload_model, args=(version,), name="model-reload", daemon=True).start()
+    return jsonify({'status': 'reloading', 'version': version or 'CURRENT'}), 202
+
+@app.route('/admin/model', methods=['GET'])
+@limiter.exempt
+def admin_model():
+    """Endpoint xem phiên bản mô hình đang phục vụ và kết quả lần thay gần nhất"""
+    if not is_debug_authorized():
+        return jsonify({'error': 'Not found', 'status': 'error'}), 404
+    return jsonify({
+        'version': controller.model.version if model_ready.is_set() else None,
+        'current_pointer': EmissionModel().current_version(),
+        'compression': controller.model.compression if model_ready.is_set() else None,
+        'n_trees': controller.model.forest.n_trees if model_ready.is_set() else None,
+        'updates': controller.model.updates if model_ready.is_set() else [],
+        'last_reload': last_reload,
+        'status': 'success'
+    }), 200
+
+# Bắt đầu khởi tạo mô hình ngay khi module được import (kể cả khi gunicorn preload),
+# request đầu tiên không phải gánh toàn bộ chi phí tải/huấn luyện
+start_model_initialization()
+start_model_watcher()
+start_hot_key_saver()
+atexit.register(save_hot_keys)
+
 # Chỉ thực thi khi chạy trực tiếp file này (không khi được import)
 if __name__ == '__main__':
     # Lấy cổng từ biến môi trường (Render sets this)
@@ -377,7 +1254,7 @@ if __name__ == '__main__':
     try:
         if not initialize_model():
             logger.error("Failed to initialize model at startup")
-            # Vẫn tiếp tục chạy server ngay cả khi khởi tạo thất bại - sẽ sử dụng giá trị dự phòng
+            # Vẫn tiếp tục chạy server - request dự đoán nhận 503 cho đến khi khởi tạo lại thành công
     except Exception as e:
         logger.error(f"Error during initialization: {str(e)}")
         logger.error(traceback.format_exc())
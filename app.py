@@ -25,6 +25,7 @@ st.set_page_config(
 # Import các module sau khi đã cấu hình đường dẫn
 from controllers.emission_controller import EmissionController
 from views.main_view import MainView
+from utils.single_flight import SingleFlight
 
 # Thiết lập URL API - kết nối đến API server được triển khai trên Render.com
 os.environ['API_URL'] = 'https://thuco2tiep.onrender.com'
@@ -36,9 +37,52 @@ api_semaphore = threading.Semaphore(10)  # Tăng lên 10 request đồng thời
 prediction_cache = {}  # Lưu trữ kết quả dự đoán
 cache_lock = threading.Lock()  # Khóa đồng bộ cho cache
 MAX_CACHE_SIZE = 100  # Giới hạn kích thước cache
+# Gộp các lời gọi API trùng nhau đang chạy đồng thời thành một request gửi đi
+api_flight = SingleFlight()
 
-# Giá trị mặc định khi API không phản hồi
+# Giá trị mặc định khi API không phản hồi và chưa có mô hình cục bộ
 DEFAULT_PREDICTION = 200.0  # Giá trị CO2 mặc định (g/km)
+# Đường giảm cấp: dự đoán anytime bằng mô hình cục bộ (gán controller trong main)
+local_controller = None
+LOCAL_FALLBACK_BUDGET = 0.005  # Ngân sách thời gian (giây) của dự đoán cục bộ
+LOCAL_FALLBACK_TOLERANCE = 2.0  # Nửa độ rộng khoảng tin cậy chấp nhận được (g/km)
+
+def fallback_result(features, message):
+    """
+    Kết quả dự phòng khi không gọi được API
+    
+    Dùng dự đoán anytime của mô hình cục bộ (duyệt một phần rừng cây trong ngân sách
+    thời gian, trả kèm số cây đã dùng) thay vì giá trị cố định; chỉ trả DEFAULT_PREDICTION
+    khi chưa có mô hình cục bộ hoặc dự đoán cục bộ lỗi.
+    
+    Parameters:
+        features (dict): Các đặc trưng của xe
+        message (str): Lý do không dùng được API
+        
+    Returns:
+        dict: Kết quả dự đoán với status 'degraded' hoặc 'fallback'
+    """
+    start_time = time.perf_counter()
+    if local_controller is not None and local_controller.trained:
+        try:
+            result = local_controller.predict_anytime(features, budget=LOCAL_FALLBACK_BUDGET,
+                                                      tolerance=LOCAL_FALLBACK_TOLERANCE)
+            return {
+                'prediction': result['prediction'],
+                'process_time_ms': (time.perf_counter() - start_time) * 1000,
+                'status': 'degraded',
+                'degraded': True,
+                'n_estimators_used': result['n_estimators_used'],
+                'message': message
+            }
+        except Exception:
+            pass
+    return {
+        'prediction': DEFAULT_PREDICTION,
+        'process_time_ms': 5.0,
+        'status': 'fallback',
+        'message': message
+    }
 
 def get_session():
     """
@@ -90,6 +134,7 @@ def predict_with_api(features):
     
     Hàm này quản lý các request đến API, bao gồm:
     - Kiểm tra cache trước khi gọi API
+    - Gộp các lời gọi trùng nhau đang chạy đồng thời (single-flight)
     - Kiểm soát số lượng request đồng thời với semaphore
     - Xử lý các trường hợp lỗi và timeout
     - Lưu kết quả vào cache
@@ -108,18 +153,31 @@ def predict_with_api(features):
         if cache_key in prediction_cache:
             return prediction_cache[cache_key]
     
+    if cache_key is None:
+        return _request_prediction(features, cache_key)
+    
+    # Các lời gọi cùng khóa đang chờ dùng chung kết quả của request đầu tiên
+    result, _ = api_flight.do(cache_key, _request_prediction, features, cache_key)
+    return dict(result)
+
+def _request_prediction(features, cache_key):
+    """
+    Gửi một request dự đoán đến API (được gọi qua single-flight từ predict_with_api)
+    
+    Parameters:
+        features (dict): Các đặc trưng của xe cần dự đoán
+        cache_key (str): Khóa cache để lưu kết quả
+        
+    Returns:
+        dict: Kết quả dự đoán từ API hoặc giá trị dự phòng
+    """
     # Cơ chế dự phòng khi không thể gửi request
     try:
         # Sử dụng semaphore để giới hạn số request đồng thời
         acquired = api_semaphore.acquire(timeout=2.0)  # Tăng timeout lên 2.0s
         if not acquired:
-            # Nếu không thể lấy semaphore, trả về giá trị mặc định
-            return {
-                'prediction': DEFAULT_PREDICTION,
-                'process_time_ms': 5.0,
-                'status': 'fallback',
-                'message': 'Too many concurrent requests'
-            }
+            # Nếu không thể lấy semaphore, dự đoán bằng mô hình cục bộ
+            return fallback_result(features, 'Too many concurrent requests')
             
         try:
             # Thêm độ trễ ngẫu nhiên nhỏ để tránh gửi đồng loạt request
@@ -135,10 +193,12 @@ def predict_with_api(features):
             # Tăng timeout cho API call
             api_timeout = 15.0  # Tăng từ 2s lên 15s để xử lý cold start
             
-            # Thêm header để tracking
+            # Thêm header để tracking và deadline (epoch ms) để server bỏ qua
+            # request mà client sẽ không còn chờ kết quả
             headers = {
                 'X-Client-Source': 'streamlit-app',
-                'X-Request-ID': f"req-{int(time.time() * 1000)}"
+                'X-Request-ID': f"req-{int(time.time() * 1000)}",
+                'X-Request-Deadline': str(int((time.time() + api_timeout) * 1000))
             }
             
             if benchmark_mode:
@@ -153,47 +213,29 @@ def predict_with_api(features):
             response.raise_for_status()
             result = response.json()
             
-            # Lưu kết quả vào cache
-            with cache_lock:
-                if len(prediction_cache) < MAX_CACHE_SIZE:
-                    prediction_cache[cache_key] = result
+            # Chỉ lưu kết quả đầy đủ vào cache: kết quả dự phòng/lỗi (status khác success) và
+            # kết quả anytime khi server quá tải (degraded) sẽ kẹt lại sau khi server hồi phục
+            if result.get('status') == 'success' and not result.get('degraded'):
+                with cache_lock:
+                    if len(prediction_cache) < MAX_CACHE_SIZE:
+                        prediction_cache[cache_key] = result
             
             return result
         except requests.exceptions.Timeout:
-            # Xử lý lỗi timeout - trả về giá trị mặc định với thông báo rõ ràng hơn
-            return {
-                'prediction': DEFAULT_PREDICTION,
-                'process_time_ms': 5.0,
-                'status': 'fallback',
-                'message': 'API timeout - server có thể đang quá tải hoặc đang khởi động'
-            }
+            # Xử lý lỗi timeout - dự đoán cục bộ kèm thông báo rõ ràng hơn
+            return fallback_result(features, 'API timeout - server có thể đang quá tải hoặc đang khởi động')
         except requests.exceptions.ConnectionError:
             # Xử lý lỗi kết nối
-            return {
-                'prediction': DEFAULT_PREDICTION,
-                'process_time_ms': 5.0,
-                'status': 'fallback',
-                'message': 'Không thể kết nối đến API server'
-            }
+            return fallback_result(features, 'Không thể kết nối đến API server')
         except requests.exceptions.RequestException as e:
             # Xử lý các lỗi request khác
-            return {
-                'prediction': DEFAULT_PREDICTION,
-                'process_time_ms': 5.0,
-                'status': 'fallback',
-                'message': f'API error: {str(e)}'
-            }
+            return fallback_result(features, f'API error: {str(e)}')
         finally:
             # Đảm bảo luôn giải phóng semaphore
             api_semaphore.release()
     except Exception as e:
         # Xử lý mọi lỗi khác (bao gồm lỗi khi lấy semaphore)
-        return {
-            'prediction': DEFAULT_PREDICTION,
-            'process_time_ms': 5.0,
-            'status': 'fallback',
-            'message': f'Client error: {str(e)}'
-        }
+        return fallback_result(features, f'Client error: {str(e)}')
 
 def check_api_health():
     """
@@ -319,6 +361,10 @@ def main():
         st.error(f"Lỗi khi huấn luyện mô hình: {str(e)}")
         return
 
+    # Mô hình cục bộ làm đường giảm cấp khi API quá tải hoặc không phản hồi
+    global local_controller
+    local_controller = controller
+
     # Khởi tạo và hiển thị giao diện
     view = MainView(controller)
     view.show()
@@ -2,10 +2,15 @@
 # Lớp này đóng vai trò trung gian giữa mô hình và giao diện người dùng
 
 from models.emission_model import EmissionModel
+from utils.request_logger import get_request_logger
+from utils.analytics_cube import AnalyticsCube
+from utils.evaluation import evaluate, evaluation_key, load_report, save_report
 import pandas as pd
+import numpy as np
 import requests
 import os
 import logging
+from bisect import bisect_left, bisect_right
 
 # Cấu hình logging để theo dõi quá trình thực thi
 logging.basicConfig(
@@ -14,12 +19,55 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)  # Khởi tạo logger cho module này
 
+# Các đặc trưng chỉ nhận giá trị nguyên - lưới sweep được làm tròn và bỏ trùng
+INTEGER_FEATURES = ('Cylinders', 'Year')
+MAX_SWEEP_POINTS = 100  # Số điểm lưới tối đa mỗi đặc trưng của một sweep
+
+# Thư mục chứa các file cube phân tích (mỗi file ứng với mã băm của một file dữ liệu)
+CUBE_DIR = 'models/cubes'
+# Thư mục chứa các báo cáo đánh giá (mỗi file ứng với một phiên bản mô hình + file dữ liệu)
+EVALUATION_DIR = 'models/evaluations'
+
+# Xếp hạng khí thải: ngưỡng trên (g/km, không bao gồm) của các hạng A..E, trên ngưỡng cuối là F
+RATING_EDGES = (100, 120, 140, 160, 180)
+RATING_LABELS = np.array(list('ABCDEF'))
+
+# Mẹo thân thiện môi trường theo nhóm: mã 0 (<= 140 g/km), 1 (140-160), 2 (> 160)
+ECO_TIP_EDGES = (140, 160)
+_HIGH_EMISSION_TIPS = (
+    "Xem xét chuyển sang phương tiện tiết kiệm nhiên liệu hơn",
+    "Bảo dưỡng định kỳ có thể giúp giảm khí thải",
+    "Tránh tăng tốc và phanh mạnh"
+)
+_MEDIUM_EMISSION_TIPS = (
+    "Kiểm tra áp suất lốp thường xuyên",
+    "Loại bỏ trọng lượng dư thừa khỏi phương tiện"
+)
+_GENERAL_TIPS = (
+    "Sử dụng kỹ thuật lái xe sinh thái",
+    "Lên kế hoạch cho các chuyến đi để tránh tắc nghẽn giao thông"
+)
+# Bảng tra cứu dùng chung: mã nhóm -> danh sách mẹo
+ECO_TIP_SETS = (
+    _GENERAL_TIPS,
+    _MEDIUM_EMISSION_TIPS + _GENERAL_TIPS,
+    _HIGH_EMISSION_TIPS + _MEDIUM_EMISSION_TIPS + _GENERAL_TIPS
+)
+
 class EmissionController:
-    def __init__(self):
+    def __init__(self, rating_edges=RATING_EDGES):
         # Khởi tạo EmissionController với các thuộc tính ban đầu
         self.model = EmissionModel()  # Tạo instance của mô hình dự đoán
+        # Ngưỡng các hạng A-F (5 giá trị tăng dần), có thể thay đổi khi khởi tạo
+        if len(rating_edges) != len(RATING_LABELS) - 1:
+            raise ValueError(f"rating_edges cần {len(RATING_LABELS) - 1} ngưỡng tăng dần")
+        self.rating_edges = tuple(rating_edges)
         self.trained = False  # Trạng thái huấn luyện của mô hình
         self.avg_emission = None  # Giá trị trung bình của khí thải CO2
+        self.data_path = None  # File dữ liệu đã dùng để khởi tạo mô hình
+        self.analytics_cube = None  # Cube tổng hợp cho trang Analysis (tải khi cần)
+        self.evaluation = None  # Báo cáo đánh giá của mô hình hiện tại (đọc từ EVALUATION_DIR khi cần)
+        self.evaluation_path = None  # (phiên bản mô hình, đường dẫn file báo cáo) - tránh băm lại file dữ liệu
         # URL API từ biến môi trường hoặc mặc định là localhost
         self.api_url = os.environ.get('API_URL', 'http://localhost:10000') + "/predict"
 
@@ -37,6 +85,7 @@ class EmissionController:
         # Lấy điểm kiểm tra (được tính từ mô hình đã tải hoặc từ quá trình huấn luyện)
         test_score = self.model.train(data_path)
         self.trained = True
+        self.data_path = data_path
         
         # Tính toán giá trị khí thải trung bình
         df = self.model.load_and_preprocess_data(data_path)
@@ -50,7 +99,113 @@ class EmissionController:
         if not self.trained:
             raise ValueError("Mô hình cần được huấn luyện trước!")
         
-        return self.model.predict(features)
+        # Đọc tham chiếu mô hình một lần - nếu swap_model chạy song song,
+        # request này vẫn dùng trọn vẹn mô hình cũ
+        model = self.model
+        return model.predict(features)
+
+    def predict_with_uncertainty(self, features, quantiles=(0.05, 0.95)):
+        """Dự đoán cục bộ kèm độ lệch chuẩn và phân vị giữa các cây của rừng"""
+        if not self.trained:
+            raise ValueError("Mô hình cần được huấn luyện trước!")
+        return self.model.predict_with_uncertainty(features, quantiles)
+
+    def predict_anytime(self, features, budget=None, tolerance=None):
+        """Dự đoán cục bộ trong ngân sách thời gian, trả về cả số cây đã dùng"""
+        if not self.trained:
+            raise ValueError("Mô hình cần được huấn luyện trước!")
+        return self.model.predict_anytime(features, budget=budget, tolerance=tolerance)
+
+    def predict_batch(self, X, block_size=None):
+        """
+        Dự đoán cho nhiều xe cùng lúc bằng đường suy luận vector hóa
+
+        Parameters:
+            X: DataFrame chứa các cột đặc trưng hoặc mảng (n_samples, n_features)
+            block_size: Số dòng tối đa mỗi lần duyệt rừng cây
+
+        Returns:
+            np.ndarray: Giá trị dự đoán (g/km) cho từng xe
+        """
+        if not self.trained:
+            raise ValueError("Mô hình cần được huấn luyện trước!")
+        return self.model.predict_batch(X, block_size=block_size)
+
+    def find_similar_vehicles(self, features, k=5):
+        """Tìm k xe thật trong bộ dữ liệu giống với thông số xe đã nhập nhất"""
+        if not self.trained:
+            raise ValueError("Mô hình cần được huấn luyện trước!")
+        return self.model.find_similar_vehicles(features, k)
+
+    def explain_prediction(self, features):
+        """Đóng góp của từng đặc trưng (TreeSHAP, g/km) vào dự đoán của xe đã nhập"""
+        if not self.trained:
+            raise ValueError("Mô hình cần được huấn luyện trước!")
+        return self.model.explain(features)
+
+    def sweep(self, features, vary, ranges=None, points=25):
+        """
+        Phân tích độ nhạy what-if: thay đổi một hoặc hai thông số của xe và dự đoán cả lưới
+
+        Parameters:
+            features: Thông số xe gốc
+            vary: Tên một đặc trưng hoặc danh sách 1-2 đặc trưng cần thay đổi
+            ranges: dict tùy chọn tên đặc trưng -> (min, max); mặc định là khoảng phân vị 5-95
+                    của dữ liệu huấn luyện (mở rộng để chứa giá trị của xe gốc)
+            points: Số điểm lưới mỗi đặc trưng (tối đa MAX_SWEEP_POINTS)
+
+        Returns:
+            dict: 'features' (tên các đặc trưng), 'grids' (các lưới),
+                  'predictions' (mảng 1-D hoặc 2-D g/km), 'base_prediction'
+        """
+        if not self.trained:
+            raise ValueError("Mô hình cần được huấn luyện trước!")
+        model = self.model
+        vary = [vary] if isinstance(vary, str) else list(vary)
+        if not 1 <= len(vary) <= 2 or len(set(vary)) != len(vary):
+            raise ValueError("Cần chọn một hoặc hai đặc trưng khác nhau để sweep")
+        unknown = [name for name in vary if name not in model.features]
+        if unknown:
+            raise ValueError(f"Đặc trưng không hợp lệ: {unknown}")
+        points = max(2, min(int(points), MAX_SWEEP_POINTS))
+
+        grids = {}
+        for name in vary:
+            if ranges and name in ranges:
+                low, high = ranges[name]
+            elif model.partial_dependence is not None:
+                grid = model.partial_dependence[name]['grid']
+                low, high = min(grid[0], features[name]), max(grid[-1], features[name])
+            else:
+                low, high = 0.5 * features[name], 1.5 * features[name]
+            grid = np.linspace(float(low), float(high), points)
+            if name in INTEGER_FEATURES:
+                grid = np.unique(np.round(grid))
+            grids[name] = grid
+        return {
+            'features': vary,
+            'grids': [grids[name] for name in vary],
+            'predictions': model.sweep(features, grids),
+            'base_prediction': float(model.predict(features))
+        }
+
+    def get_partial_dependence(self):
+        """Partial dependence tính sẵn của từng đặc trưng (None nếu artifact chưa có)"""
+        if not self.trained:
+            raise ValueError("Mô hình cần được huấn luyện trước!")
+        return self.model.partial_dependence
+
+    def swap_model(self, new_model):
+        """
+        Thay mô hình đang phục vụ bằng một mô hình đã huấn luyện
+
+        Mô hình được coi là bất biến sau khi huấn luyện; việc thay thế chỉ là
+        một phép gán tham chiếu (nguyên tử), không cần khóa ở đường dự đoán.
+        """
+        if not new_model.trained:
+            raise ValueError("Mô hình cần được huấn luyện trước!")
+        self.model = new_model
+        self.trained = True
 
     def predict_emission_api(self, features):
         """Dự đoán khí thải sử dụng API và trả về phản hồi đầy đủ bao gồm thời gian xử lý"""
@@ -62,6 +217,8 @@ class EmissionController:
             # Trả về dữ liệu phản hồi đầy đủ
             return response.json()
         except requests.exceptions.RequestException as e:
+            # Ghi log lỗi qua hàng đợi bất đồng bộ thay vì ghi trực tiếp ra stderr
+            get_request_logger().error('api_request_failed', url=self.api_url, error=str(e))
             raise Exception(f"Yêu cầu API thất bại: {str(e)}")
 
     def get_feature_importance(self):
@@ -71,44 +228,83 @@ class EmissionController:
         
         return self.model.get_feature_importance()
 
+    def get_analytics_cube(self):
+        """
+        Cube tổng hợp khí thải theo Make, Vehicle Class, Fuel Type, Transmission, Cylinders
+
+        Cube được xây một lần cho mỗi phiên bản file dữ liệu và lưu trong CUBE_DIR;
+        các lần gọi sau chỉ đọc file nén từ đĩa.
+        """
+        if self.analytics_cube is None:
+            if self.data_path is None:
+                raise ValueError("Mô hình cần được khởi tạo với file dữ liệu trước!")
+            self.analytics_cube = AnalyticsCube.load_or_build(
+                self.data_path, self.model.load_and_preprocess_data, CUBE_DIR)
+        return self.analytics_cube
+
+    def get_evaluation_report(self, compute=False):
+        """
+        Báo cáo đánh giá (kiểm định chéo, sai số theo nhóm xe, độ quan trọng hoán vị) của mô hình hiện tại
+
+        Báo cáo được lưu trong EVALUATION_DIR theo phiên bản mô hình và mã băm file dữ liệu;
+        chỉ tính lại khi một trong hai thay đổi.
+
+        Parameters:
+            compute: Tính và lưu báo cáo nếu chưa có (mất vài chục giây: huấn luyện lại CV_FOLDS rừng cây)
+
+        Returns:
+            dict hoặc None nếu chưa có báo cáo và compute=False
+        """
+        if not self.trained:
+            raise ValueError("Mô hình cần được huấn luyện trước!")
+        model = self.model
+        if self.evaluation is not None and self.evaluation['model_version'] == model.version:
+            return self.evaluation
+        if self.evaluation_path is None or self.evaluation_path[0] != model.version:
+            key = evaluation_key(model.version, self.data_path)
+            self.evaluation_path = (model.version, os.path.join(EVALUATION_DIR, f"evaluation-{key}.json"))
+        path = self.evaluation_path[1]
+        report = load_report(path)
+        if report is None and compute:
+            report = evaluate(model, model.load_and_preprocess_data(self.data_path))
+            save_report(report, path)
+        if report is not None:
+            self.evaluation = report
+        return report
+
     def get_average_emission(self):
         """Lấy giá trị khí thải trung bình"""
         return self.avg_emission
 
     def get_emission_rating(self, emission_value):
         """Lấy xếp hạng khí thải (A đến F)"""
-        if emission_value < 100:
-            return 'A'  # Phát thải rất thấp
-        elif emission_value < 120:
-            return 'B'  # Phát thải thấp
-        elif emission_value < 140:
-            return 'C'  # Phát thải trung bình thấp
-        elif emission_value < 160:
-            return 'D'  # Phát thải trung bình
-        elif emission_value < 180:
-            return 'E'  # Phát thải cao
-        else:
-            return 'F'  # Phát thải rất cao
+        # Số ngưỡng <= giá trị chính là chỉ số hạng: < 100 là A, 100-120 là B, ..., >= 180 là F
+        return str(RATING_LABELS[bisect_right(self.rating_edges, emission_value)])
+
+    def get_emission_rating_codes(self, emission_values):
+        """
+        Xếp hạng cho cả mảng giá trị khí thải, không vòng lặp Python
+
+        Returns:
+            np.ndarray: Mã hạng uint8 (0 = A ... 5 = F), tra nhãn qua RATING_LABELS
+        """
+        return np.digitize(np.asarray(emission_values, dtype=np.float64), self.rating_edges).astype(np.uint8)
+
+    def get_emission_ratings(self, emission_values):
+        """Nhãn xếp hạng A-F cho cả mảng giá trị khí thải"""
+        return RATING_LABELS[self.get_emission_rating_codes(emission_values)]
 
     def get_eco_tips(self, emission_value):
         """Cung cấp mẹo thân thiện với môi trường dựa trên giá trị khí thải"""
-        tips = []
-        if emission_value > 160:
-            # Mẹo cho phương tiện phát thải cao
-            tips.extend([
-                "Xem xét chuyển sang phương tiện tiết kiệm nhiên liệu hơn",
-                "Bảo dưỡng định kỳ có thể giúp giảm khí thải",
-                "Tránh tăng tốc và phanh mạnh"
-            ])
-        if emission_value > 140:
-            # Mẹo cho phương tiện phát thải trung bình
-            tips.extend([
-                "Kiểm tra áp suất lốp thường xuyên",
-                "Loại bỏ trọng lượng dư thừa khỏi phương tiện"
-            ])
-        # Mẹo chung cho mọi phương tiện
-        tips.extend([
-            "Sử dụng kỹ thuật lái xe sinh thái",
-            "Lên kế hoạch cho các chuyến đi để tránh tắc nghẽn giao thông"
-        ])
-        return tips 
\ No newline at end of file
+        # Phát thải cao (> 160) nhận thêm mẹo của nhóm trung bình (> 140) và mẹo chung
+        return list(ECO_TIP_SETS[bisect_left(ECO_TIP_EDGES, emission_value)])
+
+    def get_eco_tip_codes(self, emission_values):
+        """
+        Nhóm mẹo cho cả mảng giá trị khí thải
+
+        Returns:
+            np.ndarray: Mã nhóm uint8, danh sách mẹo tương ứng là ECO_TIP_SETS[mã]
+        """
+        return np.digitize(np.asarray(emission_values, dtype=np.float64), ECO_TIP_EDGES,
+                           right=True).astype(np.uint8)
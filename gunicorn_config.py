@@ -1,16 +1,37 @@
 import os
-import multiprocessing
+import sys
+import gc
+import logging
 
-# Cấu hình worker cho gunicorn - Tối ưu hóa cho trường hợp nhiều request đồng thời
-workers = 1  # Giảm xuống 1 worker để tránh cạnh tranh tài nguyên - tốt hơn cho mô hình ML
-threads = 8  # Tăng số lượng thread lên 8 để xử lý nhiều request đồng thời trong một worker
+# Đảm bảo import được các module của dự án khi gunicorn nạp file cấu hình
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from utils.topology import plan_topology
+
+# Cấu hình worker cho gunicorn - Tự động hiệu chỉnh khi khởi động
+# Đo chi phí dự đoán thực tế, đọc số CPU và giới hạn bộ nhớ (kể cả cgroup của container)
+# rồi suy ra số worker, số thread và kích thước micro-batch; lý do được ghi vào log.
+# Mô hình được memory-map dùng chung nên mặc định một worker cho mỗi CPU.
+# Ghi đè bằng WEB_CONCURRENCY/GUNICORN_WORKERS, GUNICORN_THREADS, MICRO_BATCH_SIZE.
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+topology = plan_topology()
+workers = topology['workers']
+threads = topology['threads']
+# Chia sẻ kích thước micro-batch với ứng dụng (các worker kế thừa biến môi trường)
+os.environ['MICRO_BATCH_SIZE'] = str(topology['micro_batch_size'])
+# Số luồng mỗi worker: giới hạn đồng thời và các làn ưu tiên của ứng dụng được tính theo nó
+os.environ['WORKER_THREADS'] = str(threads)
+# Nhiều worker: rate limit và cache dự đoán dùng chung qua file memory-map trong /dev/shm
+# để giới hạn không bị nhân theo số worker và cache không phải làm nóng lại ở từng worker
+if workers > 1 and 'SHARED_STATE_PATH' not in os.environ:
+    shm_dir = '/dev/shm' if os.path.isdir('/dev/shm') else '/tmp'
+    os.environ['SHARED_STATE_PATH'] = os.path.join(shm_dir, f"co2-api-{os.environ.get('PORT', '10000')}")
 
 # Cấu hình kết nối - Địa chỉ IP và cổng để lắng nghe request
 bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"  # Lắng nghe trên tất cả các địa chỉ IP, port từ biến môi trường hoặc mặc định 10000
 
-# Cấu hình worker class và connections
+# Cấu hình worker class
+# (worker_connections chỉ có tác dụng với worker eventlet/gevent nên không đặt ở đây)
 worker_class = "gthread"  # Sử dụng gthread để tận dụng khả năng đa luồng Python
-worker_connections = 1000  # Mỗi worker có thể xử lý đồng thời tối đa 1000 kết nối
 
 # Cấu hình vòng đời worker và độ tin cậy
 max_requests = 10000  # Worker sẽ khởi động lại sau khi xử lý 10000 request để tránh rò rỉ bộ nhớ
@@ -32,6 +53,18 @@ loglevel = 'error'  # Chỉ ghi log lỗi nghiêm trọng
 accesslog = None  # Tắt access log để giảm I/O
 errorlog = '-'  # Ghi error log ra stderr
 
+def when_ready(server):
+    """
+    Nạp mô hình trong tiến trình master trước khi fork các worker (preload_app)
+
+    Sau khi nạp, gc.freeze() chuyển mọi đối tượng hiện có sang thế hệ vĩnh viễn:
+    bộ thu gom rác của worker không quét (và không ghi vào) các đối tượng này,
+    nhờ đó các trang bộ nhớ được chia sẻ copy-on-write không bị sao chép.
+    """
+    import api_server
+    api_server.initialize_model()
+    gc.freeze()
+
 # Cấu hình loại bỏ - Được giữ lại trong file để dễ tham khảo
 # post_worker_init = None  # Không sử dụng hàm callback sau khi worker được khởi tạo
 # post_fork = None  # Không sử dụng hàm callback sau khi fork worker 
\ No newline at end of file
@@ -4,15 +4,47 @@
 import pandas as pd
 import numpy as np
 import os
+import json
+import time
+import hashlib
+import shutil
+import tempfile
 import joblib  # Thư viện lưu/tải mô hình ML
 from sklearn.ensemble import RandomForestRegressor  
 from sklearn.preprocessing import StandardScaler  # Chuẩn hóa dữ liệu
-from sklearn.model_selection import train_test_split  # Chia dữ liệu huấn luyện/kiểm tra
+from sklearn.metrics import r2_score, mean_absolute_error
+from models.flat_forest import FlatForest  # Rừng cây dạng mảng phẳng, memory-map được
+from models.vehicle_index import VehicleIndex  # Chỉ mục KD-tree tìm xe tương tự
+from models.tree_explainer import TreeExplainer  # Giá trị SHAP chính xác trên cấu trúc rừng cây
+
+BASE_ESTIMATORS = 100  # Số cây khi huấn luyện toàn bộ
+# Cập nhật tăng dần khi có dòng dữ liệu mới: trồng thêm cây (warm_start) trên cửa sổ dữ liệu gần nhất
+RECENT_WINDOW_ROWS = 2000  # Số dòng tối thiểu của cửa sổ huấn luyện cây mới (các dòng mới + dòng cũ gần nhất)
+MIN_UPDATE_TREES = 10  # Số cây mới mỗi lần cập nhật: tỉ lệ với phần dữ liệu mới, trong khoảng này
+MAX_UPDATE_TREES = 50
+MAX_FOREST_TREES = 150  # Vượt quá thì loại bỏ các cây cũ nhất (cửa sổ trượt theo thời gian)
+ARTIFACT_KEEP_VERSIONS = 5  # Số phiên bản artifact gần nhất được giữ lại (ngoài CURRENT) để quay lui
+FULL_RETRAIN_FRACTION = 0.5  # Dữ liệu mới chiếm hơn tỉ lệ này thì huấn luyện lại toàn bộ
+SYNTHETIC_COLUMNS = ('Horsepower', 'Weight (kg)', 'Year')  # Cột tổng hợp thêm khi tiền xử lý
+# Tỉ lệ tập kiểm tra: chọn theo mã băm nội dung dòng nên ổn định khi file có thêm dòng
+# (một dòng luôn ở cùng một phía - không cây nào, cũ hay mới, được huấn luyện trên tập kiểm tra)
+TEST_FRACTION = 0.2
+# Nén rừng cây sau khi huấn luyện: cây con có các lá chênh nhau không quá mức này (g/km) được gộp
+COMPRESSION_TOLERANCE = 1.0
+PD_GRID_POINTS = 20  # Số điểm lưới tối đa của đường partial dependence mỗi đặc trưng
+DEFAULT_QUANTILES = (0.05, 0.95)  # Khoảng mặc định: 90% dự đoán của các cây nằm trong khoảng này
+PD_SAMPLE_SIZE = 500  # Số xe lấy mẫu từ tập huấn luyện để tính trung bình partial dependence
+
+def forest_disk_bytes(forest):
+    """Dung lượng trên đĩa (byte) của các file rừng cây khi lưu vào thư mục artifact"""
+    with tempfile.TemporaryDirectory() as directory:
+        forest.save(directory)
+        return sum(entry.stat().st_size for entry in os.scandir(directory))
 
 class EmissionModel:
     def __init__(self):
         # Khởi tạo mô hình rừng ngẫu nhiên với 100 cây và hạt giống cố định
-        self.model = RandomForestRegressor(n_estimators=100, random_state=42)
+        self.model = RandomForestRegressor(n_estimators=BASE_ESTIMATORS, random_state=42)
         self.scaler = StandardScaler()  # Bộ chuẩn hóa dữ liệu
         self.features = [
             'Engine Size(L)',  # Kích thước động cơ (lít)
@@ -26,6 +58,21 @@ class EmissionModel:
         self.trained = False  # Trạng thái huấn luyện
         self.model_path = 'models/trained_model.joblib'  # Đường dẫn lưu mô hình
         self.scaler_path = 'models/trained_scaler.joblib'  # Đường dẫn lưu bộ chuẩn hóa
+        # Thư mục artifact phiên bản hóa: models/artifacts/<version>/ và file CURRENT trỏ tới bản hiện hành
+        self.artifact_dir = 'models/artifacts'
+        self.forest = None  # FlatForest dùng cho suy luận (memory-map chỉ đọc khi tải từ đĩa)
+        self.scaler_mean = None  # Tham số chuẩn hóa dạng mảng cho đường suy luận vector hóa
+        self.scaler_scale = None
+        self.feature_importances = None  # Độ quan trọng đặc trưng lưu cùng artifact
+        self.version = None  # Phiên bản của artifact đang dùng
+        self.compression = None  # Báo cáo nén rừng cây (kích thước, độ chính xác trước/sau)
+        self.vehicle_index = None  # Chỉ mục các xe thật trong bộ dữ liệu (lưu cùng artifact)
+        # Partial dependence tính sẵn khi huấn luyện: tên đặc trưng -> {'grid': [...], 'average': [...]}
+        self.partial_dependence = None
+        self.explainer = None  # TreeSHAP: đóng góp của từng đặc trưng vào một dự đoán (lưu cùng artifact)
+        self.known_rows = None  # Mã băm (đã sắp xếp) các dòng dữ liệu mô hình đã học - nhận diện dòng mới
+        self.tree_generations = None  # Lần cập nhật đã tạo ra từng cây (0 = huấn luyện toàn bộ)
+        self.updates = []  # Nhật ký các lần cập nhật tăng dần kể từ lần huấn luyện toàn bộ gần nhất
 
     def load_and_preprocess_data(self, data_path):
         """Tải và tiền xử lý dữ liệu"""
@@ -55,6 +102,24 @@ class EmissionModel:
         
         return df
 
+    def row_hashes(self, df):
+        """
+        Mã băm nội dung từng dòng dữ liệu gốc - nhận diện dòng mới khi file dữ liệu thay đổi
+
+        Bỏ các cột tổng hợp: giá trị của chúng phụ thuộc số dòng của file (dãy số ngẫu nhiên
+        sinh theo cột), nên thay đổi cả ở các dòng cũ khi file có thêm dòng.
+        """
+        return pd.util.hash_pandas_object(df.drop(columns=list(SYNTHETIC_COLUMNS)), index=False).to_numpy()
+
+    def test_mask(self, hashes):
+        """
+        Mặt nạ các dòng thuộc tập kiểm tra, tính từ mã băm nội dung (row_hashes)
+
+        Khác train_test_split (phụ thuộc số dòng của file), cách chia này không đổi khi file
+        có thêm dòng, và các dòng trùng nhau luôn cùng một phía.
+        """
+        return (np.asarray(hashes, dtype=np.uint64) % np.uint64(1000)) < int(TEST_FRACTION * 1000)
+
     def prepare_features(self, df):
         """Chuẩn bị các đặc trưng cho huấn luyện/dự đoán"""
         X = df[self.features].copy()  # Trích xuất các cột đặc trưng
@@ -69,38 +134,233 @@ class EmissionModel:
         # Tạo thư mục models nếu chưa tồn tại
         os.makedirs(os.path.dirname(self.model_path), exist_ok=True)
         
-        # Lưu mô hình và bộ chuẩn hóa
-        joblib.dump(self.model, self.model_path)
+        # Lưu mô hình và bộ chuẩn hóa (nén zlib: các mảng nút của scikit-learn nén rất tốt,
+        # file chỉ dùng để chuyển đổi/so sánh, không được worker tải khi phục vụ)
+        joblib.dump(self.model, self.model_path, compress=3)
         joblib.dump(self.scaler, self.scaler_path)
         
-    def load_model(self):
+        # Lưu thêm artifact dạng mảng phẳng để các worker memory-map dùng chung
+        self.save_artifact()
+
+    def _use_estimator(self):
+        """Tạo các cấu trúc suy luận (FlatForest, tham số chuẩn hóa) từ mô hình scikit-learn trong RAM"""
+        self.forest = FlatForest.from_sklearn(self.model)
+        self.scaler_mean = np.asarray(self.scaler.mean_, dtype=np.float64)
+        self.scaler_scale = np.asarray(self.scaler.scale_, dtype=np.float64)
+        self.feature_importances = np.asarray(self.model.feature_importances_, dtype=np.float64)
+        self.tree_generations = np.zeros(self.forest.n_trees, dtype=np.int32)
+
+    def _current_pointer(self):
+        """Đường dẫn file CURRENT chứa tên phiên bản artifact hiện hành"""
+        return os.path.join(self.artifact_dir, 'CURRENT')
+
+    def save_artifact(self):
+        """
+        Lưu artifact phiên bản hóa: các mảng .npy không nén + meta.json
+
+        Artifact được ghi vào thư mục phiên bản mới, sau đó file CURRENT được thay
+        thế nguyên tử (os.replace) - worker đang đọc bản cũ không bị ảnh hưởng.
+
+        Returns:
+            str: Tên phiên bản vừa lưu
+        """
+        digest = hashlib.sha1()
+        for array in (self.forest.threshold, self.forest.value, self.scaler_mean, self.scaler_scale):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        version = f"{time.strftime('%Y%m%d%H%M%S')}-{digest.hexdigest()[:8]}"
+        
+        version_dir = os.path.join(self.artifact_dir, version)
+        self.forest.save(version_dir)
+        np.save(os.path.join(version_dir, 'scaler_mean.npy'), self.scaler_mean)
+        np.save(os.path.join(version_dir, 'scaler_scale.npy'), self.scaler_scale)
+        if self.vehicle_index is not None:
+            self.vehicle_index.save(version_dir)
+        if self.partial_dependence is not None:
+            self.save_partial_dependence(version_dir)
+        if self.explainer is not None:
+            self.explainer.save(version_dir)
+        if self.known_rows is not None:
+            np.save(os.path.join(version_dir, 'row_hashes.npy'), self.known_rows)
+        if self.tree_generations is not None:
+            np.save(os.path.join(version_dir, 'tree_generations.npy'), self.tree_generations)
+        with open(os.path.join(version_dir, 'meta.json'), 'w') as f:
+            json.dump({
+                'version': version,
+                'features': self.features,
+                'feature_importances': [float(v) for v in self.feature_importances],
+                'compression': self.compression,
+                'updates': self.updates,
+                'created_at': time.time()
+            }, f, ensure_ascii=False, indent=2)
+        
+        self.set_current_version(version)
+        self.version = version
+        self.prune_artifacts()
+        return version
+
+    def prune_artifacts(self, keep=ARTIFACT_KEEP_VERSIONS):
+        """
+        Xóa các thư mục phiên bản cũ, giữ phiên bản CURRENT và keep phiên bản mới nhất
+
+        Mỗi lần cập nhật tăng dần ghi một phiên bản đầy đủ (~11 MB với các mảng SHAP).
+        Worker còn memory-map một phiên bản đã xóa vẫn đọc được (Linux chỉ giải phóng
+        file khi không còn ánh xạ) cho tới khi luồng theo dõi chuyển sang CURRENT.
+
+        Returns:
+            list: Các phiên bản đã xóa
+        """
+        current = self.current_version()
+        # Tên phiên bản bắt đầu bằng thời điểm tạo nên sắp xếp theo tên là theo thời gian
+        versions = sorted(name for name in os.listdir(self.artifact_dir)
+                          if os.path.isfile(os.path.join(self.artifact_dir, name, 'meta.json')))
+        removed = [version for version in versions[:max(0, len(versions) - keep)]
+                   if version not in (current, self.version)]
+        for version in removed:
+            shutil.rmtree(os.path.join(self.artifact_dir, version), ignore_errors=True)
+        return removed
+
+    def current_version(self):
+        """Đọc tên phiên bản artifact hiện hành từ file CURRENT (None nếu chưa có)"""
+        if not os.path.exists(self._current_pointer()):
+            return None
+        with open(self._current_pointer()) as f:
+            return f.read().strip() or None
+
+    def set_current_version(self, version):
+        """Cập nhật con trỏ CURRENT một cách nguyên tử (ghi file tạm rồi os.replace)"""
+        if not os.path.isdir(os.path.join(self.artifact_dir, version)):
+            raise ValueError(f"Không tìm thấy artifact phiên bản {version}")
+        tmp_pointer = f"{self._current_pointer()}.tmp-{os.getpid()}"
+        with open(tmp_pointer, 'w') as f:
+            f.write(version)
+        os.replace(tmp_pointer, self._current_pointer())
+
+    def load_artifact(self, version=None, mmap_mode='r'):
+        """
+        Tải artifact dạng mảng phẳng (mặc định memory-map chỉ đọc)
+
+        Parameters:
+            version: Phiên bản cần tải (mặc định đọc từ file CURRENT)
+            mmap_mode: 'r' để chia sẻ trang bộ nhớ giữa các tiến trình, None để đọc vào RAM
+
+        Returns:
+            bool: True nếu tải thành công
+        """
+        if version is None:
+            version = self.current_version()
+            if version is None:
+                return False
+        version_dir = os.path.join(self.artifact_dir, version)
+        if not os.path.isdir(version_dir):
+            return False
+        
+        with open(os.path.join(version_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        self.forest = FlatForest.load(version_dir, mmap_mode=mmap_mode)
+        self.scaler_mean = np.load(os.path.join(version_dir, 'scaler_mean.npy'))
+        self.scaler_scale = np.load(os.path.join(version_dir, 'scaler_scale.npy'))
+        self.feature_importances = np.asarray(meta['feature_importances'])
+        self.compression = meta.get('compression')
+        self.updates = meta.get('updates', [])
+        hashes_path = os.path.join(version_dir, 'row_hashes.npy')
+        self.known_rows = np.load(hashes_path) if os.path.exists(hashes_path) else None
+        generations_path = os.path.join(version_dir, 'tree_generations.npy')
+        self.tree_generations = (np.load(generations_path) if os.path.exists(generations_path)
+                                 else np.zeros(self.forest.n_trees, dtype=np.int32))
+        self.vehicle_index = VehicleIndex.load(version_dir)
+        self.explainer = TreeExplainer.load(version_dir, mmap_mode=mmap_mode)
+        pd_path = os.path.join(version_dir, 'partial_dependence.json')
+        if os.path.exists(pd_path):
+            with open(pd_path) as f:
+                self.partial_dependence = json.load(f)
+        else:
+            self.partial_dependence = None
+        self.version = meta['version']
+        self.trained = True
+        return True
+        
+    def load_model(self, mmap_mode='r'):
         """Tải mô hình đã huấn luyện và bộ chuẩn hóa từ đĩa"""
+        # Ưu tiên artifact dạng mảng phẳng: không cần unpickle 100 cây vào RAM của từng worker
+        if self.load_artifact(mmap_mode=mmap_mode):
+            return True
         if os.path.exists(self.model_path) and os.path.exists(self.scaler_path):
             self.model = joblib.load(self.model_path)
             self.scaler = joblib.load(self.scaler_path)
             self.trained = True
+            # Chuyển đổi một lần sang artifact mới cho các lần khởi động sau
+            self._use_estimator()
+            self.save_artifact()
             return True
         return False
 
-    def train(self, data_path):
-        """Huấn luyện mô hình hoặc tải mô hình đã huấn luyện nếu có"""
+    def train(self, data_path, retrain=False):
+        """
+        Huấn luyện mô hình hoặc tải mô hình đã huấn luyện nếu có
+
+        Mô hình đã lưu chỉ được dùng lại khi nó đã học mọi dòng của file dữ liệu. Có dòng mới
+        (theo mã băm nội dung) thì cập nhật tăng dần (update); dữ liệu mới chiếm quá
+        FULL_RETRAIN_FRACTION hoặc không cập nhật được thì huấn luyện lại toàn bộ.
+
+        Parameters:
+            data_path: Đường dẫn file CSV
+            retrain: True để bỏ qua mô hình đã lưu và huấn luyện lại toàn bộ
+        """
         # Thử tải mô hình trước
-        if self.load_model():
+        if not retrain and self.load_model():
             print("Đã tải mô hình đã huấn luyện từ đĩa")
             # Vẫn cần tính toán điểm test cho các đánh giá
             df = self.load_and_preprocess_data(data_path)
             X, y = self.prepare_features(df)
-            X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-            X_test_scaled = self.scaler.transform(X_test)
-            test_score = self.model.score(X_test_scaled, y_test)
-            return test_score
+            hashes = self.row_hashes(df)
+            test = self.test_mask(hashes)
+            X_train, X_test, y_test = X[~test], X[test], y[test]
+            # Artifact cũ chưa nén: nén một lần rồi lưu thành phiên bản mới (kèm mọi phần bổ sung bên dưới)
+            migrate = self.forest.layout != 'compact'
+            if migrate:
+                self.compress_forest(X_test, y_test)
+            # Artifact cũ chưa ghi các dòng đã học: coi như đã học file dữ liệu hiện tại
+            if self.known_rows is None:
+                self.known_rows = np.unique(hashes)
+                if not migrate:
+                    np.save(os.path.join(self.artifact_dir, self.version, 'row_hashes.npy'), self.known_rows)
+            new_rows = ~np.isin(hashes, self.known_rows)
+            updated = False
+            if new_rows.any():
+                print(f"Có {int(new_rows.sum())} dòng dữ liệu mới chưa được học")
+                if new_rows.mean() <= FULL_RETRAIN_FRACTION:
+                    updated = self.update(df, hashes, new_rows)
+                retrain = not updated
+            if not retrain:
+                # Artifact cũ chưa có chỉ mục xe/partial dependence: tính và bổ sung vào thư mục phiên bản hiện tại
+                if self.vehicle_index is None:
+                    self.build_vehicle_index(df)
+                    if not migrate:
+                        self.vehicle_index.save(os.path.join(self.artifact_dir, self.version))
+                if self.partial_dependence is None:
+                    self.compute_partial_dependence(X_train)
+                    if not migrate:
+                        self.save_partial_dependence(os.path.join(self.artifact_dir, self.version))
+                if self.explainer is None:
+                    self.build_explainer(X_train)
+                    if not migrate:
+                        self.explainer.save(os.path.join(self.artifact_dir, self.version))
+                if migrate and not updated:
+                    self.save_artifact()
+                return r2_score(y_test, self.predict_batch(X_test))
+            print("Huấn luyện lại toàn bộ mô hình")
+            # Bắt đầu lại từ mô hình và bộ chuẩn hóa mới (bản đã tải có thể đã được huấn luyện)
+            self.model = RandomForestRegressor(n_estimators=BASE_ESTIMATORS, random_state=42)
+            self.scaler = StandardScaler()
             
         # Nếu không có mô hình đã huấn luyện, huấn luyện mô hình mới
         df = self.load_and_preprocess_data(data_path)
         X, y = self.prepare_features(df)
+        hashes = self.row_hashes(df)
         
-        # Chia dữ liệu
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+        # Chia dữ liệu theo mã băm dòng (ổn định khi file có thêm dòng, xem test_mask)
+        test = self.test_mask(hashes)
+        X_train, X_test, y_train, y_test = X[~test], X[test], y[~test], y[test]
         
         # Chuẩn hóa các đặc trưng
         X_train_scaled = self.scaler.fit_transform(X_train)
@@ -108,36 +368,417 @@ class EmissionModel:
         # Huấn luyện mô hình
         self.model.fit(X_train_scaled, y_train)
         self.trained = True
+        self.known_rows = np.unique(hashes)
+        self.updates = []
         
-        # Lưu mô hình đã huấn luyện
+        # Tạo cấu trúc suy luận (đã nén), chỉ mục xe, partial dependence và bộ giải thích, rồi lưu cùng mô hình
+        self._use_estimator()
+        self.compress_forest(X_test, y_test)
+        self.build_vehicle_index(df)
+        self.compute_partial_dependence(X_train)
+        self.build_explainer(X_train)
         self.save_model()
         
-        # Tính toán và trả về các chỉ số
-        X_test_scaled = self.scaler.transform(X_test)
-        test_score = self.model.score(X_test_scaled, y_test)
-        return test_score
+        # Điểm kiểm tra của mô hình đang phục vụ (rừng cây đã nén)
+        return self.compression['r2_after']
+
+    def update(self, df, hashes, new_rows):
+        """
+        Cập nhật tăng dần: trồng thêm cây trên dữ liệu gần nhất, loại bỏ các cây cũ nhất
+
+        Rừng cây scikit-learn đã lưu được huấn luyện tiếp với warm_start: chỉ các cây mới được
+        huấn luyện, trên cửa sổ gồm các dòng mới và các dòng cũ cuối file (tổng cộng ít nhất
+        RECENT_WINDOW_ROWS dòng, chỉ lấy các dòng ngoài tập kiểm tra test_mask), nên chi phí tỉ lệ với lượng dữ liệu mới chứ không với toàn bộ
+        lịch sử. Số cây mới tỉ lệ với phần dữ liệu mới; khi rừng vượt MAX_FOREST_TREES cây,
+        các cây cũ nhất bị loại. Bộ chuẩn hóa giữ nguyên để mọi cây dùng chung một thang đo.
+        Kết quả được lưu thành phiên bản artifact mới (thay con trỏ CURRENT nguyên tử).
+
+        Parameters:
+            df: Toàn bộ dữ liệu đã tiền xử lý
+            hashes: Mã băm từng dòng của df (row_hashes)
+            new_rows: Mặt nạ các dòng mới
+
+        Returns:
+            bool: False nếu không có rừng cây scikit-learn đồng bộ với artifact để huấn luyện tiếp
+        """
+        start_time = time.perf_counter()
+        if not (os.path.exists(self.model_path) and os.path.exists(self.scaler_path)):
+            return False
+        estimator = joblib.load(self.model_path)
+        scaler = joblib.load(self.scaler_path)
+        if (len(getattr(estimator, 'estimators_', [])) != self.forest.n_trees
+                or not np.allclose(scaler.mean_, self.scaler_mean)):
+            return False
+
+        X = self._to_array(df).astype(np.float64)
+        y = df[self.target].to_numpy(dtype=np.float64)
+        new_index = np.flatnonzero(new_rows)
+        test = self.test_mask(hashes)
+        # Cửa sổ: các dòng mới + các dòng cũ gần nhất (cuối file) cho đủ RECENT_WINDOW_ROWS dòng,
+        # không bao giờ gồm dòng của tập kiểm tra để điểm kiểm tra sau cập nhật vẫn khách quan
+        new_train = np.flatnonzero(new_rows & ~test)
+        known_train = np.flatnonzero(~new_rows & ~test)
+        fill = max(0, RECENT_WINDOW_ROWS - len(new_train))
+        window = np.concatenate([known_train[max(0, len(known_train) - fill):], new_train])
+        # Sai số của mô hình cũ trên các dòng mới (chưa từng thấy) - mức độ lỗi thời của mô hình
+        mae_before = float(mean_absolute_error(y[new_index], self.predict_batch(X[new_index])))
+
+        n_added = int(np.clip(np.ceil(self.forest.n_trees * len(new_index) / len(df)),
+                              MIN_UPDATE_TREES, MAX_UPDATE_TREES))
+        # Mỗi lần cập nhật dùng random_state riêng theo thế hệ: với warm_start, hạt giống của cây mới
+        # được rút sau len(estimators_) lần rút đầu của random_state; sau khi cây cũ bị loại danh sách
+        # ngắn lại, nên cùng một random_state sẽ rút lại đúng các hạt giống (và cây) đã có trong rừng
+        generation = int(self.tree_generations.max(initial=-1)) + 1
+        estimator.set_params(warm_start=True, random_state=42 + generation,
+                             n_estimators=len(estimator.estimators_) + n_added)
+        estimator.fit((X[window] - self.scaler_mean) / self.scaler_scale, y[window])
+        estimator.set_params(warm_start=False)
+        seeds = [tree.random_state for tree in estimator.estimators_]
+        if len(set(seeds)) != len(seeds):
+            print("Hạt giống của các cây trong rừng bị trùng, huấn luyện lại toàn bộ")
+            return False
+        added = FlatForest.from_sklearn(estimator, trees=slice(-n_added, None)).compress(COMPRESSION_TOLERANCE)
+
+        # Loại các cây cũ nhất (đầu danh sách) khỏi cả rừng phẳng và rừng scikit-learn để hai bên đồng bộ
+        n_retired = max(0, self.forest.n_trees + n_added - MAX_FOREST_TREES)
+        self.forest = FlatForest.concatenate([self.forest.select(np.arange(n_retired, self.forest.n_trees)), added])
+        del estimator.estimators_[:n_retired]
+        estimator.set_params(n_estimators=len(estimator.estimators_))
+        self.tree_generations = np.concatenate([self.tree_generations[n_retired:],
+                                                np.full(n_added, generation, dtype=np.int32)])
+        self.model, self.scaler = estimator, scaler
+        self.known_rows = np.union1d(self.known_rows, hashes[new_index])
+        # Độ quan trọng và báo cáo nén phải mô tả rừng cây sau cập nhật, không phải rừng đã loại bỏ
+        self.feature_importances = np.asarray(estimator.feature_importances_, dtype=np.float64)
+        self._compression_report(FlatForest.from_sklearn(estimator), X[test], y[test])
+
+        # Các cấu trúc phụ phụ thuộc dữ liệu/cây được xây lại cho phiên bản mới
+        self.build_vehicle_index(df)
+        self.compute_partial_dependence(X[~test])
+        self.build_explainer(X[~test])
+        self.updates.append({
+            'created_at': time.time(),
+            'generation': generation,
+            'new_rows': int(len(new_index)),
+            'window_rows': int(len(window)),
+            'trees_added': n_added,
+            'trees_retired': n_retired,
+            'n_trees': self.forest.n_trees,
+            'mae_new_rows_before': mae_before,
+            'elapsed_seconds': time.perf_counter() - start_time
+        })
+        self.save_model()
+        print(f"Đã cập nhật mô hình: +{n_added} cây, -{n_retired} cây cũ, phiên bản {self.version}")
+        return True
+
+    def compress_forest(self, X_test, y_test, tolerance=COMPRESSION_TOLERANCE):
+        """
+        Nén rừng cây đang dùng và báo cáo mức tiết kiệm cùng độ chính xác trước/sau
+
+        Gộp các cây con có lá chênh nhau không quá tolerance, chuyển sang bố trí 'compact'
+        (không lưu con trái, chỉ số hẹp, float32). Sai lệch dự đoán tối đa là tolerance.
+
+        Parameters:
+            X_test, y_test: Tập kiểm tra để đo độ chính xác trước và sau khi nén
+            tolerance: Chênh lệch giá trị lá tối đa được gộp (g/km)
+
+        Returns:
+            dict: Số nút, dung lượng mảng nút (byte), dung lượng file rừng cây trên đĩa (byte),
+                  R2/MAE trước và sau, thay đổi dự đoán lớn nhất
+        """
+        original = self.forest
+        self.forest = original.compress(tolerance)
+        return self._compression_report(original, X_test, y_test, tolerance)
+
+    def _compression_report(self, original, X_test, y_test, tolerance=COMPRESSION_TOLERANCE):
+        """Báo cáo nén của rừng đang dùng so với rừng chưa nén original (cùng các cây)"""
+        compressed = self.forest
+        y_test = np.asarray(y_test, dtype=np.float64)
+        self.forest = original
+        try:
+            before = self.predict_batch(X_test)
+        finally:
+            self.forest = compressed
+        after = self.predict_batch(X_test)
+        self.compression = {
+            'tolerance': tolerance,
+            'nodes_before': int(original.n_nodes),
+            'nodes_after': int(compressed.n_nodes),
+            'bytes_before': int(original.nbytes),
+            'bytes_after': int(compressed.nbytes),
+            'disk_bytes_before': forest_disk_bytes(original),
+            'disk_bytes_after': forest_disk_bytes(compressed),
+            'r2_before': float(r2_score(y_test, before)),
+            'r2_after': float(r2_score(y_test, after)),
+            'mae_before': float(mean_absolute_error(y_test, before)),
+            'mae_after': float(mean_absolute_error(y_test, after)),
+            'max_abs_change': float(np.abs(after - before).max())
+        }
+        return self.compression
+
+    def record_compression_benchmark(self, benchmark):
+        """
+        Lưu kết quả đo bộ nhớ/thông lượng của rừng nén so với rừng chưa nén
+        (utils.benchmark_utils.benchmark_compression) vào báo cáo nén của phiên bản hiện tại
+
+        meta.json của thư mục phiên bản được ghi lại nguyên tử; phiên bản không đổi.
+        """
+        if self.compression is None:
+            return None
+        self.compression['benchmark'] = benchmark
+        meta_path = os.path.join(self.artifact_dir, self.version, 'meta.json')
+        with open(meta_path) as f:
+            meta = json.load(f)
+        meta['compression'] = self.compression
+        tmp_path = f"{meta_path}.tmp-{os.getpid()}"
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, meta_path)
+        return self.compression
+
+    def build_vehicle_index(self, df):
+        """Xây chỉ mục KD-tree các xe trong bộ dữ liệu trên không gian đặc trưng đã chuẩn hóa"""
+        X_raw = self._to_array(df)
+        self.vehicle_index = VehicleIndex.build(
+            (X_raw - self.scaler_mean) / self.scaler_scale, X_raw, df[self.target].to_numpy(),
+            df, self.features)
+        return self.vehicle_index
+
+    def build_explainer(self, X):
+        """Xây bộ giải thích TreeSHAP cho rừng cây đang dùng, độ phủ nút lấy từ dữ liệu huấn luyện X"""
+        self.explainer = TreeExplainer.build(self.forest, (self._to_array(X) - self.scaler_mean) / self.scaler_scale)
+        return self.explainer
+
+    def compute_partial_dependence(self, X, grid_points=PD_GRID_POINTS, sample_size=PD_SAMPLE_SIZE):
+        """
+        Tính partial dependence của từng đặc trưng trên dữ liệu huấn luyện
+
+        Với mỗi điểm lưới, gán giá trị đó cho đặc trưng trên toàn bộ mẫu rồi lấy trung bình dự đoán;
+        cả lưới của một đặc trưng được dự đoán trong một lần gọi predict_batch.
+
+        Parameters:
+            X: Dữ liệu huấn luyện (DataFrame hoặc mảng chưa chuẩn hóa)
+            grid_points: Số điểm lưới (phân vị 5-95 của dữ liệu, bỏ trùng)
+            sample_size: Số dòng lấy mẫu để tính trung bình
+
+        Returns:
+            dict: tên đặc trưng -> {'grid': [...], 'average': [...]}
+        """
+        X = self._to_array(X).astype(np.float64)
+        rng = np.random.default_rng(42)
+        sample = X[rng.choice(len(X), sample_size, replace=False)] if len(X) > sample_size else X
+        partial_dependence = {}
+        for j, feature in enumerate(self.features):
+            # Lưới lấy từ giá trị thật của dữ liệu (method='nearest'): đặc trưng nguyên vẫn là số nguyên
+            grid = np.unique(np.percentile(X[:, j], np.linspace(5, 95, grid_points), method='nearest'))
+            X_grid = np.repeat(sample[None], len(grid), axis=0)
+            X_grid[:, :, j] = grid[:, None]
+            predictions = self.predict_batch(X_grid.reshape(-1, X.shape[1]), block_size=PD_SAMPLE_SIZE * 4)
+            partial_dependence[feature] = {
+                'grid': grid.tolist(),
+                'average': predictions.reshape(len(grid), -1).mean(axis=1).tolist()
+            }
+        self.partial_dependence = partial_dependence
+        return partial_dependence
+
+    def save_partial_dependence(self, directory):
+        """Lưu partial dependence vào thư mục artifact"""
+        with open(os.path.join(directory, 'partial_dependence.json'), 'w') as f:
+            json.dump(self.partial_dependence, f, ensure_ascii=False)
+
+    def sweep(self, features_dict, grids):
+        """
+        Dự đoán trên lưới giá trị của một hoặc hai đặc trưng, các đặc trưng khác giữ như xe gốc
+
+        Parameters:
+            features_dict: Thông số xe gốc
+            grids: dict tên đặc trưng -> dãy giá trị (1 hoặc 2 đặc trưng)
+
+        Returns:
+            np.ndarray: Kích thước (len(lưới 1),) hoặc (len(lưới 1), len(lưới 2))
+        """
+        names = list(grids)
+        mesh = np.meshgrid(*[np.asarray(grids[name], dtype=np.float64) for name in names], indexing='ij')
+        base = np.array([float(features_dict[feature]) for feature in self.features])
+        # Mỗi dòng là xe gốc với các đặc trưng được thay bằng một điểm lưới - dự đoán cả lưới một lần
+        X = np.tile(base, (mesh[0].size, 1))
+        for name, values in zip(names, mesh):
+            X[:, self.features.index(name)] = values.ravel()
+        return self.predict_batch(X).reshape(mesh[0].shape)
+
+    def find_similar_vehicles(self, features_dict, k=5):
+        """
+        Tìm k xe thật trong bộ dữ liệu gần nhất với thông số đã nhập
+
+        Returns:
+            list: Thông tin xe (Make, Model, Vehicle Class), đặc trưng, CO2 đo được, khoảng cách
+        """
+        if self.vehicle_index is None:
+            raise ValueError("Chưa có chỉ mục xe cho mô hình này!")
+        x = np.array([float(features_dict[feature]) for feature in self.features])
+        return self.vehicle_index.nearest((x - self.scaler_mean) / self.scaler_scale, k)
 
     def predict(self, features_dict):
         """Thực hiện dự đoán"""
         if not self.trained:
             raise ValueError("Mô hình cần được huấn luyện trước!")
             
-        # Chuyển đổi từ dictionary sang DataFrame
-        features_df = pd.DataFrame([features_dict])
-        
-        # Chuẩn hóa các đặc trưng
-        features_scaled = self.scaler.transform(features_df)
+        # Chuyển đổi từ dictionary sang mảng theo thứ tự đặc trưng (rẻ hơn nhiều so với DataFrame)
+        features_row = [[features_dict[feature] for feature in self.features]]
         
-        # Thực hiện dự đoán
-        prediction = self.model.predict(features_scaled)[0]
+        # Chuẩn hóa và dự đoán qua đường vector hóa
+        prediction = self.predict_batch(features_row)[0]
         
         return prediction
 
+    def _to_array(self, X):
+        """
+        Chuyển DataFrame/mảng đầu vào sang ma trận số thực theo đúng thứ tự self.features
+
+        Mảng float32/float64 được giữ nguyên (không sao chép) - phép chuẩn hóa theo từng khối
+        trong predict_batch tự nâng lên float64.
+        """
+        if isinstance(X, pd.DataFrame):
+            X = X[self.features].to_numpy(dtype=np.float64)
+        X = np.asarray(X)
+        if X.dtype not in (np.float32, np.float64):
+            X = X.astype(np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        return X
+
+    def predict_batch(self, X, block_size=None):
+        """
+        Dự đoán cho nhiều xe cùng lúc
+
+        Parameters:
+            X: DataFrame chứa các cột self.features hoặc mảng (n_samples, n_features)
+            block_size: Số dòng tối đa mỗi lần duyệt rừng cây (mặc định: một khối).
+                        Bộ nhớ tạm của phép duyệt tỉ lệ với n_trees * số dòng,
+                        nên lô lớn cần chia khối để bộ nhớ không tăng theo kích thước lô
+
+        Returns:
+            np.ndarray: Giá trị dự đoán (g/km) cho từng xe
+        """
+        if not self.trained:
+            raise ValueError("Mô hình cần được huấn luyện trước!")
+        
+        X = self._to_array(X)
+        if block_size is None or len(X) <= block_size:
+            return self.forest.predict((X - self.scaler_mean) / self.scaler_scale)
+        predictions = np.empty(len(X))
+        for start in range(0, len(X), block_size):
+            block = X[start:start + block_size]
+            predictions[start:start + block_size] = self.forest.predict(
+                (block - self.scaler_mean) / self.scaler_scale)
+        return predictions
+
+    def predict_batch_with_uncertainty(self, X, quantiles=DEFAULT_QUANTILES, block_size=None):
+        """
+        Dự đoán kèm độ bất định cho nhiều xe
+
+        Giá trị lá của mọi cây được lấy trong cùng một lần duyệt như predict_batch, rồi tính
+        trung bình, độ lệch chuẩn và phân vị giữa các cây - chi phí thêm chỉ là phép thống kê
+        trên ma trận (n_trees, n_samples) đã có. Khoảng phân vị thể hiện mức bất đồng giữa các cây,
+        không phải khoảng tin cậy của giá trị đo thực tế.
+
+        Parameters:
+            X: DataFrame chứa các cột self.features hoặc mảng (n_samples, n_features)
+            quantiles: Các mức phân vị trong khoảng [0, 1]
+            block_size: Số dòng tối đa mỗi lần duyệt rừng cây (như predict_batch)
+
+        Returns:
+            dict: 'mean', 'std' (n_samples,) và 'quantiles' (len(quantiles), n_samples)
+        """
+        if not self.trained:
+            raise ValueError("Mô hình cần được huấn luyện trước!")
+
+        X = self._to_array(X)
+        quantiles = np.asarray(quantiles, dtype=np.float64)
+        block_size = block_size or max(len(X), 1)
+        mean, std = np.empty(len(X)), np.empty(len(X))
+        values = np.empty((len(quantiles), len(X)))
+        for start in range(0, len(X), block_size):
+            block = X[start:start + block_size]
+            end = start + len(block)
+            mean[start:end], std[start:end], values[:, start:end] = self.forest.predict_distribution(
+                (block - self.scaler_mean) / self.scaler_scale, quantiles)
+        return {'mean': mean, 'std': std, 'quantiles': values}
+
+    def predict_with_uncertainty(self, features_dict, quantiles=DEFAULT_QUANTILES):
+        """
+        Dự đoán một xe kèm độ lệch chuẩn và phân vị giữa các cây
+
+        Returns:
+            dict: 'prediction', 'std' và 'quantiles' (mức phân vị -> giá trị g/km)
+        """
+        result = self.predict_batch_with_uncertainty(
+            [[features_dict[feature] for feature in self.features]], quantiles)
+        return {
+            'prediction': float(result['mean'][0]),
+            'std': float(result['std'][0]),
+            'quantiles': {float(q): float(v) for q, v in zip(quantiles, result['quantiles'][:, 0])}
+        }
+
+    def predict_anytime(self, features_dict, budget=None, tolerance=None):
+        """
+        Dự đoán một xe trong giới hạn thời gian (duyệt cây theo thứ tự cố định, dừng sớm)
+
+        Parameters:
+            features_dict: Thông số xe
+            budget: Ngân sách thời gian (giây)
+            tolerance: Nửa độ rộng khoảng tin cậy 95% chấp nhận được (g/km)
+
+        Returns:
+            dict: 'prediction', 'n_estimators_used', 'n_estimators', 'ci_halfwidth'
+        """
+        if not self.trained:
+            raise ValueError("Mô hình cần được huấn luyện trước!")
+        x = (np.array([float(features_dict[feature]) for feature in self.features]) - self.scaler_mean) / self.scaler_scale
+        prediction, n_used, halfwidth = self.forest.predict_anytime(x, budget=budget, tolerance=tolerance)
+        return {
+            'prediction': prediction,
+            'n_estimators_used': n_used,
+            'n_estimators': self.forest.n_trees,
+            'ci_halfwidth': halfwidth
+        }
+
+    def explain_batch(self, X):
+        """
+        Đóng góp (giá trị SHAP) của từng đặc trưng vào dự đoán của nhiều xe
+
+        Parameters:
+            X: DataFrame chứa các cột self.features hoặc mảng (n_samples, n_features)
+
+        Returns:
+            tuple: (giá trị gốc g/km, mảng đóng góp (n_samples, n_features) g/km);
+                   giá trị gốc + tổng đóng góp của một xe bằng dự đoán của xe đó
+        """
+        if self.explainer is None:
+            raise ValueError("Chưa có bộ giải thích cho mô hình này!")
+        X = self._to_array(X)
+        return self.explainer.expected_value, self.explainer.shap_values((X - self.scaler_mean) / self.scaler_scale)
+
+    def explain(self, features_dict):
+        """
+        Giải thích dự đoán của một xe
+
+        Returns:
+            dict: 'base_value' (dự đoán trung bình), 'contributions' (tên đặc trưng -> g/km),
+                  'prediction' (= base_value + tổng contributions)
+        """
+        base_value, contributions = self.explain_batch([[features_dict[feature] for feature in self.features]])
+        return {
+            'base_value': base_value,
+            'contributions': {feature: float(value) for feature, value in zip(self.features, contributions[0])},
+            'prediction': base_value + float(contributions[0].sum())
+        }
+
     def get_feature_importance(self):
         """Lấy điểm quan trọng của các đặc trưng"""
         if not self.trained:
             raise ValueError("Mô hình cần được huấn luyện trước!")
             
         # Tạo dictionary ánh xạ tên đặc trưng với độ quan trọng tương ứng
-        importance_dict = dict(zip(self.features, self.model.feature_importances_))
+        importance_dict = dict(zip(self.features, self.feature_importances))
         return importance_dict 
\ No newline at end of file
@@ -0,0 +1,391 @@
+# Mô tả: Biểu diễn rừng cây quyết định dưới dạng các mảng phẳng
+# Toàn bộ nút của mọi cây được nối thành vài mảng NumPy liên tục, lưu thành file .npy
+# để có thể memory-map chỉ đọc: nhiều worker gunicorn dùng chung một bản trong page cache
+# (đối tượng Tree của scikit-learn luôn sao chép dữ liệu nút khi unpickle nên không chia sẻ được)
+#
+# Hai cách bố trí nút:
+#   'absolute': left/right là chỉ số toàn cục int32, threshold/value float64 (28 byte/nút)
+#   'compact':  nút theo thứ tự tiền tự (DFS) nên con trái luôn là nút kế tiếp và không cần lưu;
+#               right là khoảng cách tới con phải (uint16/uint32), feature int8 (-1 = lá),
+#               threshold/value float32 (11 byte/nút) - tạo bởi compress()
+
+import os
+import json
+import math
+import time
+import numpy as np
+
+# Các mảng được lưu thành file .npy riêng trong thư mục artifact (theo cách bố trí)
+FOREST_ARRAYS = ('left', 'right', 'feature', 'threshold', 'value', 'roots')
+COMPACT_ARRAYS = ('right', 'feature', 'threshold', 'value', 'roots')
+ANYTIME_MIN_TREES = 10  # Số cây tối thiểu trước khi được phép dừng sớm
+
+
+class FlatForest:
+    """
+    Rừng cây hồi quy dạng mảng phẳng
+
+    Thuộc tính:
+        left, right: Chỉ số toàn cục của nút con trái/phải (-1 nếu là lá);
+                     bố trí 'compact': left là None, right là khoảng cách từ nút tới con phải
+        feature: Chỉ số đặc trưng dùng để chia tại nút (bố trí 'compact': -1 tại lá)
+        threshold: Ngưỡng chia (đi sang trái nếu x <= threshold, giống scikit-learn)
+        value: Giá trị dự đoán tại nút
+        roots: Chỉ số nút gốc của từng cây
+    """
+    def __init__(self, left, right, feature, threshold, value, roots, max_depth, n_features,
+                 layout='absolute'):
+        self.left = left
+        self.right = right
+        self.feature = feature
+        self.threshold = threshold
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)  # Độ sâu lớn nhất - giới hạn số vòng duyệt
+        self.n_features = int(n_features)
+        self.layout = layout
+
+    @property
+    def array_names(self):
+        """Tên các mảng nút của cách bố trí hiện tại"""
+        return COMPACT_ARRAYS if self.layout == 'compact' else FOREST_ARRAYS
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def n_nodes(self):
+        return len(self.value)
+
+    @property
+    def nbytes(self):
+        """Tổng dung lượng các mảng nút (byte)"""
+        return sum(getattr(self, name).nbytes for name in self.array_names)
+
+    @classmethod
+    def from_sklearn(cls, forest, trees=None):
+        """
+        Chuyển RandomForestRegressor đã huấn luyện sang dạng mảng phẳng
+
+        Parameters:
+            forest: RandomForestRegressor (hoặc bất kỳ mô hình nào có estimators_)
+            trees: slice các cây cần chuyển (mặc định tất cả), ví dụ slice(-10, None) cho 10 cây mới nhất
+        """
+        lefts, rights, features, thresholds, values, roots = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for estimator in forest.estimators_[trees or slice(None)]:
+            tree = estimator.tree_
+            left = tree.children_left.astype(np.int32)
+            right = tree.children_right.astype(np.int32)
+            # Chuyển chỉ số cục bộ của cây sang chỉ số toàn cục, giữ -1 cho lá
+            lefts.append(np.where(left >= 0, left + offset, -1).astype(np.int32))
+            rights.append(np.where(right >= 0, right + offset, -1).astype(np.int32))
+            features.append(np.maximum(tree.feature, 0).astype(np.int32))
+            thresholds.append(tree.threshold.astype(np.float64))
+            values.append(tree.value.reshape(tree.node_count).astype(np.float64))
+            roots.append(offset)
+            max_depth = max(max_depth, tree.max_depth)
+            offset += tree.node_count
+        return cls(
+            left=np.concatenate(lefts),
+            right=np.concatenate(rights),
+            feature=np.concatenate(features),
+            threshold=np.concatenate(thresholds),
+            value=np.concatenate(values),
+            roots=np.asarray(roots, dtype=np.int64),
+            max_depth=max_depth,
+            n_features=forest.n_features_in_
+        )
+
+    def save(self, directory):
+        """Lưu các mảng thành file .npy (không nén) cùng file mô tả forest.json"""
+        os.makedirs(directory, exist_ok=True)
+        for name in self.array_names:
+            np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(getattr(self, name)))
+        with open(os.path.join(directory, 'forest.json'), 'w') as f:
+            json.dump({'max_depth': self.max_depth, 'n_features': self.n_features,
+                       'n_trees': self.n_trees, 'n_nodes': self.n_nodes, 'layout': self.layout}, f)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """
+        Tải rừng cây từ thư mục
+
+        Parameters:
+            directory: Thư mục chứa các file .npy
+            mmap_mode: 'r' để memory-map chỉ đọc (mặc định), None để đọc hẳn vào RAM
+        """
+        with open(os.path.join(directory, 'forest.json')) as f:
+            info = json.load(f)
+        layout = info.get('layout', 'absolute')  # Artifact cũ không ghi cách bố trí
+        names = COMPACT_ARRAYS if layout == 'compact' else FOREST_ARRAYS
+        # np.asarray bỏ lớp np.memmap (vẫn dùng chung vùng nhớ đã map) để tránh chi phí
+        # của lớp con trên mỗi phép chỉ mục trong vòng duyệt cây
+        arrays = {name: np.asarray(np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode))
+                  for name in names}
+        arrays.setdefault('left', None)
+        return cls(max_depth=info['max_depth'], n_features=info['n_features'], layout=layout, **arrays)
+
+    def select(self, trees):
+        """
+        Rừng con gồm các cây được chọn (giữ thứ tự), sao chép đoạn nút của từng cây
+
+        Parameters:
+            trees: Mảng chỉ số cây
+        """
+        trees = np.asarray(trees, dtype=np.int64)
+        ends = np.append(np.asarray(self.roots[1:]), self.n_nodes)
+        starts, sizes = np.asarray(self.roots)[trees], ends[trees] - np.asarray(self.roots)[trees]
+        new_roots = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+        nodes = np.concatenate([np.arange(start, start + size) for start, size in zip(starts, sizes)]
+                               or [np.empty(0, dtype=np.int64)])
+        arrays = {name: np.asarray(getattr(self, name))[nodes] for name in self.array_names if name != 'roots'}
+        if self.layout != 'compact':
+            # Chỉ số toàn cục dịch theo vị trí mới của cây; bố trí 'compact' lưu khoảng cách nên không đổi
+            shift = np.repeat(new_roots - starts, sizes).astype(np.int32)
+            for name in ('left', 'right'):
+                arrays[name] = np.where(arrays[name] >= 0, arrays[name] + shift, -1).astype(np.int32)
+        arrays.setdefault('left', None)
+        return FlatForest(roots=new_roots, max_depth=self.max_depth, n_features=self.n_features,
+                          layout=self.layout, **arrays)
+
+    @classmethod
+    def concatenate(cls, forests):
+        """Nối các rừng cây cùng cách bố trí thành một rừng (các cây giữ thứ tự)"""
+        layout = forests[0].layout
+        if any(forest.layout != layout for forest in forests):
+            raise ValueError("Không thể nối các rừng cây khác cách bố trí")
+        offsets = np.cumsum([0] + [forest.n_nodes for forest in forests[:-1]])
+        names = [name for name in forests[0].array_names if name != 'roots']
+        arrays = {}
+        for name in names:
+            parts = [np.asarray(getattr(forest, name)) for forest in forests]
+            if layout != 'compact' and name in ('left', 'right'):
+                parts = [np.where(part >= 0, part + offset, -1).astype(np.int32)
+                         for part, offset in zip(parts, offsets)]
+            # np.concatenate nâng kiểu khi cần (ví dụ khoảng cách uint16 với uint32)
+            arrays[name] = np.concatenate(parts)
+        arrays.setdefault('left', None)
+        return cls(roots=np.concatenate([np.asarray(forest.roots) + offset
+                                         for forest, offset in zip(forests, offsets)]).astype(np.int64),
+                   max_depth=max(forest.max_depth for forest in forests),
+                   n_features=forests[0].n_features, layout=layout, **arrays)
+
+    def children(self):
+        """
+        Chỉ số toàn cục của con trái/phải cho mọi nút (-1 tại lá), với cả hai cách bố trí
+
+        Dùng cho các phép biến đổi cấu trúc (nén, giải thích), không dùng trên đường dự đoán.
+        """
+        if self.layout != 'compact':
+            return np.asarray(self.left, dtype=np.int64), np.asarray(self.right, dtype=np.int64)
+        nodes = np.arange(self.n_nodes, dtype=np.int64)
+        internal = np.asarray(self.feature) >= 0
+        left = np.where(internal, nodes + 1, -1)
+        right = np.where(internal, nodes + self.right.astype(np.int64), -1)
+        return left, right
+
+    def compress(self, tolerance=0.0):
+        """
+        Tạo bản nén của rừng cây theo bố trí 'compact'
+
+        - Gộp cây con: nút trong có mọi giá trị lá bên dưới chênh nhau không quá tolerance
+          trở thành lá (giá trị của nút là trung bình có trọng số các lá nên sai lệch mỗi cây,
+          và do đó cả rừng, không vượt quá tolerance)
+        - Bỏ mảng left (con trái là nút kế tiếp theo thứ tự tiền tự), chỉ số con phải lưu dạng
+          khoảng cách uint16 khi đủ, feature int8
+        - threshold/value float32; threshold được làm tròn xuống float32 gần nhất nên với đầu vào
+          float32 (như apply), mọi phép so sánh x <= threshold cho kết quả y hệt bản gốc
+
+        Parameters:
+            tolerance: Chênh lệch giá trị lá tối đa được gộp (cùng đơn vị dự đoán), 0 = chỉ gộp lá bằng nhau
+
+        Returns:
+            FlatForest: Rừng cây mới (bản gốc không thay đổi)
+        """
+        left, right = self.children()
+        n_nodes = self.n_nodes
+        internal = left >= 0
+        # Thứ tự tiền tự: con trái của mọi nút trong là nút kế tiếp (scikit-learn xây cây theo chiều sâu)
+        if not np.all(left[internal] == np.flatnonzero(internal) + 1):
+            raise ValueError("Nút không theo thứ tự tiền tự, không thể nén")
+        value = np.asarray(self.value, dtype=np.float64)
+
+        # Độ sâu của từng nút, duyệt theo tầng từ các gốc
+        depth = np.zeros(n_nodes, dtype=np.int32)
+        frontier = np.asarray(self.roots, dtype=np.int64)
+        level = 0
+        while frontier.size:
+            depth[frontier] = level
+            frontier = frontier[internal[frontier]]
+            frontier = np.concatenate([left[frontier], right[frontier]])
+            level += 1
+
+        # Khoảng giá trị lá của mỗi cây con, tính từ tầng sâu nhất lên
+        low, high = value.copy(), value.copy()
+        for level in range(depth.max(), -1, -1):
+            nodes = np.flatnonzero(internal & (depth == level))
+            low[nodes] = np.minimum(low[left[nodes]], low[right[nodes]])
+            high[nodes] = np.maximum(high[left[nodes]], high[right[nodes]])
+        collapse = internal & (high - low <= tolerance)
+
+        # Bỏ hậu duệ của các nút được gộp, tính từ gốc xuống
+        removed = np.zeros(n_nodes, dtype=bool)
+        for level in range(depth.max() + 1):
+            nodes = np.flatnonzero(internal & (depth == level))
+            hidden = removed[nodes] | collapse[nodes]
+            removed[left[nodes]] = hidden
+            removed[right[nodes]] = hidden
+        kept = np.flatnonzero(~removed)
+        new_index = np.cumsum(~removed) - 1  # Thứ tự tiền tự được giữ nguyên sau khi bỏ các đoạn cây con
+
+        split = internal[kept] & ~collapse[kept]
+        offsets = np.zeros(len(kept), dtype=np.int64)
+        offsets[split] = new_index[right[kept[split]]] - np.arange(len(kept))[split]
+        offset_dtype = np.uint16 if offsets.max(initial=0) <= np.iinfo(np.uint16).max else np.uint32
+        feature_dtype = np.int8 if self.n_features <= np.iinfo(np.int8).max else np.int16
+        feature = np.where(split, np.asarray(self.feature)[kept], -1).astype(feature_dtype)
+
+        threshold = np.asarray(self.threshold, dtype=np.float64)[kept]
+        threshold32 = threshold.astype(np.float32)
+        rounded_up = threshold32.astype(np.float64) > threshold
+        threshold32[rounded_up] = np.nextafter(threshold32[rounded_up], np.float32(-np.inf))
+        threshold32[~split] = 0.0
+
+        # Độ sâu lớn nhất sau khi gộp
+        kept_depth = depth[kept]
+        return FlatForest(
+            left=None,
+            right=offsets.astype(offset_dtype),
+            feature=feature,
+            threshold=threshold32,
+            value=value[kept].astype(np.float32),
+            roots=new_index[np.asarray(self.roots)].astype(np.int64),
+            max_depth=int(kept_depth[~split].max(initial=0)) if len(kept) else 0,
+            n_features=self.n_features,
+            layout='compact'
+        )
+
+    def apply(self, X, trees=None):
+        """
+        Tìm nút lá của từng mẫu trong từng cây - duyệt đồng thời mọi cây và mọi mẫu
+
+        Parameters:
+            X: Mảng (n_samples, n_features) đã chuẩn hóa
+            trees: Danh sách/slice chỉ số cây cần duyệt (mặc định tất cả)
+
+        Returns:
+            np.ndarray: Chỉ số lá toàn cục, kích thước (n_trees, n_samples)
+        """
+        # scikit-learn so sánh đặc trưng ở dạng float32 - làm giống để kết quả trùng khớp
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n_samples, n_features = X.shape
+        roots = np.asarray(self.roots if trees is None else self.roots[trees])
+        node = np.repeat(roots[:, None], n_samples, axis=1).ravel()
+        # Vị trí bắt đầu của hàng tương ứng trong X đã duỗi phẳng
+        row_offset = np.tile(np.arange(n_samples) * n_features, len(roots))
+        X_flat = X.ravel()
+        compact = self.layout == 'compact'
+        # Chỉ tiếp tục duyệt các đường đi chưa tới lá - tập này co lại sau mỗi tầng
+        active = np.flatnonzero(self.feature[node] >= 0 if compact else self.left[node] >= 0)
+        for _ in range(self.max_depth):
+            if active.size == 0:
+                break
+            current = node[active]
+            go_left = X_flat[row_offset[active] + self.feature[current]] <= self.threshold[current]
+            if compact:
+                current = np.where(go_left, current + 1, current + self.right[current])
+                node[active] = current
+                active = active[self.feature[current] >= 0]
+            else:
+                current = np.where(go_left, self.left[current], self.right[current])
+                node[active] = current
+                active = active[self.left[current] >= 0]
+        return node.reshape(len(roots), n_samples)
+
+    def predict_per_tree(self, X, trees=None):
+        """Giá trị dự đoán của từng cây, kích thước (n_trees, n_samples)"""
+        return self.value[self.apply(X, trees)]
+
+    def predict(self, X):
+        """Dự đoán trung bình của rừng cây cho mỗi mẫu"""
+        # Cộng dồn float64 kể cả khi giá trị lá lưu float32
+        return self.predict_per_tree(X).mean(axis=0, dtype=np.float64)
+
+    def predict_distribution(self, X, quantiles=()):
+        """
+        Trung bình, độ lệch chuẩn và các phân vị của dự đoán giữa các cây - cùng một lần duyệt
+
+        Parameters:
+            X: Mảng (n_samples, n_features) đã chuẩn hóa
+            quantiles: Các mức phân vị trong khoảng [0, 1]
+
+        Returns:
+            tuple: (mean (n_samples,), std (n_samples,), quantiles (len(quantiles), n_samples))
+        """
+        per_tree = self.predict_per_tree(X).astype(np.float64, copy=False)
+        if len(quantiles):
+            values = np.quantile(per_tree, quantiles, axis=0)
+        else:
+            values = np.empty((0, per_tree.shape[1]))
+        return per_tree.mean(axis=0), per_tree.std(axis=0), values
+
+    def predict_anytime(self, x, budget=None, tolerance=None, min_trees=ANYTIME_MIN_TREES, z=1.96):
+        """
+        Dự đoán một mẫu bằng cách duyệt lần lượt từng cây theo thứ tự cố định và dừng sớm
+
+        Dừng khi hết ngân sách thời gian, hoặc khi nửa độ rộng khoảng tin cậy của trung bình
+        cả rừng (ước lượng từ các cây đã duyệt) không vượt quá tolerance. Duyệt vô hướng từng
+        cây (~7 µs/cây) nên chi phí tỉ lệ với số cây thực dùng; phép duyệt vector hóa của
+        predict có chi phí gần như cố định theo độ sâu cây với một mẫu.
+
+        Parameters:
+            x: Vector đặc trưng đã chuẩn hóa (n_features,)
+            budget: Ngân sách thời gian (giây), None nếu không giới hạn
+            tolerance: Nửa độ rộng khoảng tin cậy chấp nhận được (cùng đơn vị dự đoán)
+            min_trees: Số cây tối thiểu trước khi xét điều kiện dừng
+            z: Hệ số của khoảng tin cậy (1.96 ~ 95%)
+
+        Returns:
+            tuple: (trung bình các cây đã duyệt, số cây đã dùng, nửa độ rộng khoảng tin cậy)
+        """
+        deadline = None if budget is None else time.perf_counter() + budget
+        # So sánh ở dạng float32 như apply (giá trị float32 chuyển sang float Python là chính xác)
+        x = np.asarray(x, dtype=np.float32).ravel().tolist()
+        left, right, feature, threshold, value = self.left, self.right, self.feature, self.threshold, self.value
+        compact = self.layout == 'compact'
+        n_trees = self.n_trees
+        mean = m2 = 0.0
+        n = 0
+        halfwidth = math.inf
+        for node in self.roots.tolist():
+            if compact:
+                while True:
+                    split_feature = feature.item(node)
+                    if split_feature < 0:
+                        break
+                    node = node + 1 if x[split_feature] <= threshold.item(node) else node + right.item(node)
+            else:
+                while True:
+                    child = left.item(node)
+                    if child < 0:
+                        break
+                    node = child if x[feature.item(node)] <= threshold.item(node) else right.item(node)
+            # Cập nhật trung bình/phương sai trực tuyến (Welford)
+            n += 1
+            leaf_value = value.item(node)
+            delta = leaf_value - mean
+            mean += delta / n
+            m2 += delta * (leaf_value - mean)
+            if min_trees <= n < n_trees:
+                # Hiệu chỉnh tổng thể hữu hạn: mục tiêu là trung bình của đúng n_trees cây
+                halfwidth = z * math.sqrt(m2 / (n - 1) / n * (n_trees - n) / (n_trees - 1))
+                if tolerance is not None and halfwidth <= tolerance:
+                    break
+                if deadline is not None and time.perf_counter() >= deadline:
+                    break
+        if n == n_trees:
+            halfwidth = 0.0
+        return mean, n, halfwidth
@@ -0,0 +1,93 @@
+# Mô tả: Chỉ mục không gian (KD-tree) để tìm các xe thật trong bộ dữ liệu giống xe người dùng nhập
+# Tìm kiếm trong không gian đặc trưng đã chuẩn hóa của mô hình (cùng StandardScaler),
+# nên mỗi đặc trưng đóng góp như nhau vào khoảng cách. Chỉ mục được lưu cùng artifact mô hình.
+
+import os
+import json
+import joblib
+import numpy as np
+from sklearn.neighbors import KDTree
+
+# Các cột mô tả xe được trả về cùng kết quả tìm kiếm
+VEHICLE_COLUMNS = ('Make', 'Model', 'Vehicle Class')
+
+
+class VehicleIndex:
+    """
+    Tìm k xe gần nhất trong bộ dữ liệu
+
+    Thuộc tính:
+        tree: KDTree trên ma trận đặc trưng đã chuẩn hóa
+        features: Ma trận đặc trưng gốc (chưa chuẩn hóa) để hiển thị
+        co2: Lượng CO2 đo được của từng xe (g/km)
+        labels: dict tên cột -> mảng chuỗi (Make, Model, Vehicle Class)
+    """
+    def __init__(self, tree, features, co2, labels, feature_names):
+        self.tree = tree
+        self.features = features
+        self.co2 = co2
+        self.labels = labels
+        self.feature_names = list(feature_names)
+
+    @classmethod
+    def build(cls, X_scaled, X_raw, co2, vehicles, feature_names, leaf_size=16):
+        """
+        Xây chỉ mục từ dữ liệu huấn luyện
+
+        Parameters:
+            X_scaled: Ma trận đặc trưng đã chuẩn hóa (n_vehicles, n_features)
+            X_raw: Ma trận đặc trưng gốc tương ứng
+            co2: Lượng CO2 đo được
+            vehicles: DataFrame chứa các cột VEHICLE_COLUMNS
+            feature_names: Tên các đặc trưng theo thứ tự cột
+        """
+        labels = {column: vehicles[column].astype(str).to_numpy() for column in VEHICLE_COLUMNS
+                  if column in vehicles.columns}
+        return cls(KDTree(np.asarray(X_scaled, dtype=np.float64), leaf_size=leaf_size),
+                   np.asarray(X_raw, dtype=np.float64), np.asarray(co2, dtype=np.float64),
+                   labels, feature_names)
+
+    def save(self, directory):
+        """Lưu chỉ mục vào thư mục artifact"""
+        joblib.dump(self.tree, os.path.join(directory, 'vehicle_index.joblib'))
+        np.save(os.path.join(directory, 'vehicle_features.npy'), self.features)
+        np.save(os.path.join(directory, 'vehicle_co2.npy'), self.co2)
+        with open(os.path.join(directory, 'vehicles.json'), 'w') as f:
+            json.dump({'feature_names': self.feature_names,
+                       'labels': {column: values.tolist() for column, values in self.labels.items()}},
+                      f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory):
+        """Tải chỉ mục đã lưu, trả về None nếu artifact chưa có chỉ mục"""
+        path = os.path.join(directory, 'vehicle_index.joblib')
+        if not os.path.exists(path):
+            return None
+        with open(os.path.join(directory, 'vehicles.json')) as f:
+            info = json.load(f)
+        return cls(joblib.load(path),
+                   np.load(os.path.join(directory, 'vehicle_features.npy')),
+                   np.load(os.path.join(directory, 'vehicle_co2.npy')),
+                   {column: np.asarray(values) for column, values in info['labels'].items()},
+                   info['feature_names'])
+
+    def __len__(self):
+        return len(self.co2)
+
+    def nearest(self, x_scaled, k=5):
+        """
+        Tìm k xe gần nhất với một vector đặc trưng đã chuẩn hóa
+
+        Returns:
+            list: Mỗi phần tử là dict gồm thông tin xe, các đặc trưng, CO2 đo được và khoảng cách
+        """
+        k = max(1, min(int(k), len(self)))
+        distances, indices = self.tree.query(np.asarray(x_scaled, dtype=np.float64).reshape(1, -1), k=k)
+        vehicles = []
+        for distance, i in zip(distances[0], indices[0]):
+            vehicle = {column: str(values[i]) for column, values in self.labels.items()}
+            vehicle['features'] = dict(zip(self.feature_names, self.features[i].tolist()))
+            vehicle['co2_emissions'] = float(self.co2[i])
+            vehicle['distance'] = float(distance)
+            vehicles.append(vehicle)
+        return vehicles
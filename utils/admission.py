@@ -0,0 +1,160 @@
+# Mô tả: Kiểm soát tiếp nhận request (admission control) và loại bỏ tải theo deadline
+# Giới hạn số request xử lý đồng thời một cách thích ứng dựa trên độ trễ quan sát được
+# (thuật toán gradient kết hợp giảm nhân khi quá tải), và từ chối sớm các request
+# có deadline đã qua hoặc không thể đáp ứng, thay vì tính xong rồi bỏ đi
+# Số request đồng thời không bao giờ vượt số luồng của worker, nên giới hạn được kẹp ở đó;
+# thời gian request nằm trong backlog của gunicorn (trước khi có luồng) được đọc từ header
+# X-Request-Start của proxy để bộ giới hạn thấy được cả hàng đợi mà nó không quản lý
+
+import math
+import time
+import threading
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Bộ giới hạn đồng thời thích ứng theo gradient độ trễ
+
+    - baseline_rtt: độ trễ khi không tải (EWMA chậm, luôn kéo xuống theo mẫu nhỏ hơn)
+    - rtt: độ trễ gần đây (EWMA nhanh)
+    - gradient = min(1, tolerance * baseline_rtt / rtt): khi hàng đợi bắt đầu hình thành,
+      rtt tăng so với baseline và giới hạn bị kéo xuống; khi độ trễ ổn định,
+      giới hạn tăng thêm sqrt(limit) để dò thêm công suất
+    - Request lỗi/quá hạn: giảm nhân (backoff_ratio) như AIMD
+    - max_limit nên là số luồng của worker: giới hạn lớn hơn không bao giờ có tác dụng
+    """
+    def __init__(self, initial_limit=16, min_limit=2, max_limit=16,
+                 smoothing=0.2, tolerance=1.5, backoff_ratio=0.9):
+        self.min_limit = min(min_limit, max_limit)
+        self.max_limit = max_limit
+        # Giới hạn hiện tại (số thực để điều chỉnh mượt)
+        self.limit = float(min(max(initial_limit, self.min_limit), max_limit))
+        self.smoothing = smoothing  # Hệ số làm mượt khi cập nhật giới hạn
+        self.tolerance = tolerance  # Mức tăng độ trễ chấp nhận được so với baseline
+        self.backoff_ratio = backoff_ratio  # Hệ số giảm khi request thất bại
+        self.in_flight = 0  # Số request đang được xử lý
+        self.baseline_rtt = None  # Độ trễ không tải ước tính (giây)
+        self.rtt = None  # Độ trễ gần đây (giây)
+        self.accepted = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self, count_rejection=True):
+        """
+        Nhận một request nếu còn chỗ; trả về False ngay (không chờ) nếu đã đầy
+
+        Parameters:
+            count_rejection: False khi bộ lập lịch chỉ thử cấp chỗ cho request đang xếp hàng
+        """
+        with self._lock:
+            if self.in_flight >= int(self.limit):
+                if count_rejection:
+                    self.rejected += 1
+                return False
+            self.in_flight += 1
+            self.accepted += 1
+            return True
+
+    def release(self, latency, success=True):
+        """
+        Trả chỗ và cập nhật giới hạn theo độ trễ của request vừa xong
+
+        Parameters:
+            latency: Thời gian xử lý request (giây), gồm cả thời gian chờ trong backlog của
+                     gunicorn nếu biết; None để không lấy mẫu độ trễ
+            success: False nếu request lỗi hoặc quá hạn
+        """
+        with self._lock:
+            self.in_flight -= 1
+            if latency is None:
+                return
+            if not success:
+                self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+                return
+            if self.rtt is None:
+                self.rtt = self.baseline_rtt = latency
+                return
+            self.rtt = 0.8 * self.rtt + 0.2 * latency
+            # Baseline giảm ngay theo mẫu nhỏ hơn và chỉ tăng rất chậm
+            if latency < self.baseline_rtt:
+                self.baseline_rtt = latency
+            else:
+                self.baseline_rtt = 0.995 * self.baseline_rtt + 0.005 * latency
+            gradient = max(0.5, min(1.0, self.tolerance * self.baseline_rtt / max(self.rtt, 1e-9)))
+            new_limit = self.limit * gradient + math.sqrt(self.limit)
+            self.limit = (1 - self.smoothing) * self.limit + self.smoothing * new_limit
+            self.limit = min(self.max_limit, max(self.min_limit, self.limit))
+
+    def estimated_latency(self):
+        """Độ trễ dự kiến (giây) của một request mới, 0 nếu chưa có dữ liệu"""
+        return self.rtt or 0.0
+
+    def stats(self):
+        """Thống kê cho endpoint /health"""
+        return {
+            'limit': int(self.limit),
+            'in_flight': self.in_flight,
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'rtt_ms': round((self.rtt or 0) * 1000, 3),
+            'baseline_rtt_ms': round((self.baseline_rtt or 0) * 1000, 3)
+        }
+
+
+def parse_deadline(header_value, now=None):
+    """
+    Đọc header X-Request-Deadline
+
+    Giá trị là thời điểm tuyệt đối theo Unix epoch, tính bằng mili giây
+    (ví dụ Date.now() + 500 ở phía client).
+
+    Returns:
+        float hoặc None: Thời gian còn lại (giây), có thể âm nếu đã quá hạn;
+                         None nếu không có header hoặc header không hợp lệ
+    """
+    if not header_value:
+        return None
+    try:
+        deadline_ms = float(header_value)
+    except ValueError:
+        return None
+    now = time.time() if now is None else now
+    return deadline_ms / 1000 - now
+
+
+# Thời gian chờ upstream lớn hơn mức này được coi là lệch đồng hồ giữa proxy và server, bỏ qua
+MAX_REQUEST_QUEUE_SECONDS = 300.0
+
+
+def parse_request_start(header_value, now=None):
+    """
+    Đọc header X-Request-Start do proxy (nginx, Heroku, Render...) gắn khi nhận request
+
+    Chấp nhận dạng "t=<giá trị>" hoặc chỉ giá trị; đơn vị (giây, mili giây, micro giây
+    theo Unix epoch) được suy ra từ độ lớn.
+
+    Returns:
+        float hoặc None: Thời gian (giây) request đã chờ trước khi tới handler - chủ yếu là
+                         backlog accept của gunicorn khi mọi luồng đều bận; None nếu không
+                         có header, header không hợp lệ hoặc lệch đồng hồ bất thường
+    """
+    if not header_value:
+        return None
+    value = header_value.strip()
+    if value.startswith('t='):
+        value = value[2:]
+    try:
+        started = float(value)
+    except ValueError:
+        return None
+    if not math.isfinite(started):
+        return None
+    if started > 1e14:
+        started /= 1e6  # micro giây
+    elif started > 1e11:
+        started /= 1e3  # mili giây
+    now = time.time() if now is None else now
+    queued = now - started
+    if queued > MAX_REQUEST_QUEUE_SECONDS:
+        return None
+    return max(queued, 0.0)
@@ -0,0 +1,254 @@
+# Mô tả: Khối dữ liệu tổng hợp (data cube) tính trước cho trang Analysis
+# Cube lưu cuboid cơ sở: mỗi tổ hợp giá trị thật sự xuất hiện của các chiều (Make, Vehicle Class,
+# Fuel Type, Transmission, Cylinders) giữ count, sum, sum bình phương, min, max và một histogram
+# thưa làm sketch phân vị. Các đại lượng này cộng dồn được, nên mọi phép lọc/drill-down/roll-up
+# chỉ là gom các ô bằng np.bincount - không cần groupby pandas trên toàn bộ dữ liệu mỗi lần vẽ lại.
+# Cube được xây một lần cho mỗi mã băm của file dữ liệu và lưu nén trên đĩa (.npz).
+
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+CUBE_FORMAT = 1  # Tăng khi đổi cấu trúc file cube để các bản cũ được xây lại
+CUBE_DIMENSIONS = ('Make', 'Vehicle Class', 'Fuel Type', 'Transmission', 'Cylinders')
+CUBE_MEASURES = ('CO2 Emissions(g/km)', 'Fuel Consumption Comb (L/100 km)')
+SKETCH_BINS = 256  # Số ngăn histogram của mỗi đại lượng (độ phân giải phân vị = khoảng giá trị / 256)
+QUANTILES = (0.1, 0.5, 0.9)
+
+
+def dataset_hash(data_path, dimensions=CUBE_DIMENSIONS, measures=CUBE_MEASURES):
+    """Mã băm nội dung file dữ liệu + cấu hình cube (tên file cube trên đĩa)"""
+    digest = hashlib.sha1(json.dumps([CUBE_FORMAT, SKETCH_BINS, list(dimensions), list(measures)]).encode())
+    with open(data_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+class AnalyticsCube:
+    """
+    Cuboid cơ sở và các phép truy vấn trên nó
+
+    Thuộc tính:
+        dimensions: Tên các chiều
+        labels: dict chiều -> mảng nhãn (mã của ô là chỉ số trong mảng này)
+        codes: Ma trận (n_cells, n_dimensions) mã nhãn của từng ô
+        count: Số xe của từng ô
+        sums, sumsq, mins, maxs: (n_cells, n_measures) các đại lượng cộng dồn được
+        edges: (n_measures, SKETCH_BINS + 1) biên các ngăn histogram
+        sketch_cell, sketch_bin, sketch_count: Histogram thưa dạng bộ ba
+            (ô, (đại lượng * SKETCH_BINS + ngăn), số xe) - chỉ lưu các ngăn khác 0
+    """
+    def __init__(self, dimensions, measures, labels, codes, count, sums, sumsq, mins, maxs,
+                 edges, sketch_cell, sketch_bin, sketch_count, n_rows):
+        self.dimensions = list(dimensions)
+        self.measures = list(measures)
+        self.labels = labels
+        self.codes = codes
+        self.count = count
+        self.sums = sums
+        self.sumsq = sumsq
+        self.mins = mins
+        self.maxs = maxs
+        self.edges = edges
+        self.sketch_cell = sketch_cell
+        self.sketch_bin = sketch_bin
+        self.sketch_count = sketch_count
+        self.n_rows = n_rows
+
+    @classmethod
+    def build(cls, df, dimensions=CUBE_DIMENSIONS, measures=CUBE_MEASURES, n_bins=SKETCH_BINS):
+        """
+        Xây cube từ DataFrame (một lần groupby cho cả cube)
+
+        Returns:
+            AnalyticsCube
+        """
+        df = df.dropna(subset=list(dimensions) + list(measures))
+        labels, row_codes = {}, []
+        for dimension in dimensions:
+            codes, uniques = pd.factorize(df[dimension], sort=True)
+            labels[dimension] = np.asarray(uniques.astype(str))
+            row_codes.append(codes)
+        row_codes = np.column_stack(row_codes)
+        # Mỗi tổ hợp xuất hiện trong dữ liệu là một ô; cell_of_row ánh xạ dòng -> ô
+        cell_codes, cell_of_row = np.unique(row_codes, axis=0, return_inverse=True)
+        cell_of_row = cell_of_row.ravel()
+        n_cells = len(cell_codes)
+
+        values = df[list(measures)].to_numpy(dtype=np.float64)
+        count = np.bincount(cell_of_row, minlength=n_cells)
+        sums = np.column_stack([np.bincount(cell_of_row, values[:, m], n_cells) for m in range(len(measures))])
+        sumsq = np.column_stack([np.bincount(cell_of_row, values[:, m] ** 2, n_cells)
+                                 for m in range(len(measures))])
+        mins = np.full((n_cells, len(measures)), np.inf)
+        maxs = np.full((n_cells, len(measures)), -np.inf)
+        np.minimum.at(mins, cell_of_row, values)
+        np.maximum.at(maxs, cell_of_row, values)
+
+        # Sketch phân vị: histogram biên cố định trên toàn dữ liệu (ghép được giữa các ô)
+        edges = np.stack([np.linspace(values[:, m].min(), values[:, m].max(), n_bins + 1)
+                          for m in range(len(measures))])
+        bins = np.column_stack([
+            np.clip(np.searchsorted(edges[m], values[:, m], side='right') - 1, 0, n_bins - 1) + m * n_bins
+            for m in range(len(measures))])
+        pairs = np.column_stack([np.repeat(cell_of_row, len(measures)), bins.ravel()])
+        sketch_keys, sketch_count = np.unique(pairs, axis=0, return_counts=True)
+
+        return cls(dimensions, measures, labels, cell_codes.astype(np.int32), count.astype(np.int64),
+                   sums, sumsq, mins, maxs, edges, sketch_keys[:, 0].astype(np.int32),
+                   sketch_keys[:, 1].astype(np.int32), sketch_count.astype(np.int64), len(df))
+
+    def save(self, path):
+        """Ghi cube nén ra file .npz (ghi file tạm rồi os.replace)"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp-{os.getpid()}.npz"
+        np.savez_compressed(
+            tmp_path, codes=self.codes, count=self.count, sums=self.sums, sumsq=self.sumsq,
+            mins=self.mins, maxs=self.maxs, edges=self.edges, sketch_cell=self.sketch_cell,
+            sketch_bin=self.sketch_bin, sketch_count=self.sketch_count,
+            meta=np.array(json.dumps({
+                'dimensions': self.dimensions, 'measures': self.measures, 'n_rows': self.n_rows,
+                'labels': {dimension: values.tolist() for dimension, values in self.labels.items()}
+            })))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Tải cube đã lưu"""
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            return cls(meta['dimensions'], meta['measures'],
+                       {dimension: np.asarray(values) for dimension, values in meta['labels'].items()},
+                       data['codes'], data['count'], data['sums'], data['sumsq'], data['mins'],
+                       data['maxs'], data['edges'], data['sketch_cell'], data['sketch_bin'],
+                       data['sketch_count'], meta['n_rows'])
+
+    @classmethod
+    def load_or_build(cls, data_path, load_fn, cache_dir):
+        """
+        Tải cube của file dữ liệu từ cache_dir, xây và lưu nếu chưa có
+
+        Parameters:
+            data_path: Đường dẫn file CSV (dùng để tính mã băm)
+            load_fn: Hàm đọc + tiền xử lý dữ liệu, nhận data_path trả về DataFrame
+            cache_dir: Thư mục chứa các file cube
+        """
+        path = os.path.join(cache_dir, f"cube-{dataset_hash(data_path)}.npz")
+        if os.path.exists(path):
+            try:
+                return cls.load(path)
+            except (OSError, ValueError, KeyError):
+                pass  # File hỏng (ví dụ bị ngắt khi ghi) - xây lại
+        cube = cls.build(load_fn(data_path))
+        cube.save(path)
+        return cube
+
+    def __len__(self):
+        return len(self.count)
+
+    def values(self, dimension, filters=None):
+        """
+        Các nhãn của một chiều còn xuất hiện sau khi áp dụng bộ lọc của các chiều khác
+
+        Returns:
+            list: Nhãn sắp xếp theo thứ tự trong cube
+        """
+        others = {name: selected for name, selected in (filters or {}).items() if name != dimension}
+        axis = self.dimensions.index(dimension)
+        present = np.unique(self.codes[self._mask(others), axis])
+        return self.labels[dimension][present].tolist()
+
+    def _mask(self, filters):
+        """Mặt nạ các ô thỏa bộ lọc {chiều: danh sách nhãn được chọn} (rỗng = không lọc)"""
+        mask = np.ones(len(self), dtype=bool)
+        for dimension, selected in (filters or {}).items():
+            if not selected:
+                continue
+            labels = self.labels[dimension]
+            wanted = np.isin(labels, np.asarray([str(value) for value in selected]))
+            mask &= wanted[self.codes[:, self.dimensions.index(dimension)]]
+        return mask
+
+    def query(self, filters=None, group_by=(), measure=CUBE_MEASURES[0], quantiles=QUANTILES):
+        """
+        Tổng hợp đại lượng theo các chiều group_by trên lát cắt thỏa filters
+
+        Parameters:
+            filters: dict {chiều: danh sách nhãn}, chiều không có hoặc rỗng thì lấy tất cả
+            group_by: Danh sách chiều để nhóm (rỗng = một dòng tổng cho cả lát cắt)
+            measure: Tên đại lượng
+            quantiles: Các phân vị cần ước lượng từ sketch
+
+        Returns:
+            pd.DataFrame: Các cột nhóm + count, mean, std, min, max, p10/p50/p90...,
+                          sắp xếp theo count giảm dần
+        """
+        m = self.measures.index(measure)
+        group_by = list(group_by)
+        mask = self._mask(filters)
+        cells = np.flatnonzero(mask)
+
+        # Ánh xạ ô -> nhóm (np.unique trên mã các chiều nhóm của các ô được chọn)
+        if group_by:
+            axes = [self.dimensions.index(dimension) for dimension in group_by]
+            group_codes, group_of_cell = np.unique(self.codes[cells][:, axes], axis=0, return_inverse=True)
+            group_of_cell = group_of_cell.ravel()
+        else:
+            group_codes = np.zeros((1, 0), dtype=np.int32)
+            group_of_cell = np.zeros(len(cells), dtype=np.intp)
+        n_groups = len(group_codes) if len(cells) else 0
+
+        count = np.bincount(group_of_cell, self.count[cells], n_groups)
+        total = np.bincount(group_of_cell, self.sums[cells, m], n_groups)
+        total_sq = np.bincount(group_of_cell, self.sumsq[cells, m], n_groups)
+        minimum = np.full(n_groups, np.inf)
+        maximum = np.full(n_groups, -np.inf)
+        np.minimum.at(minimum, group_of_cell, self.mins[cells, m])
+        np.maximum.at(maximum, group_of_cell, self.maxs[cells, m])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / count
+            std = np.sqrt(np.maximum(total_sq / count - mean ** 2, 0.0))
+
+        result = pd.DataFrame({dimension: self.labels[dimension][group_codes[:, i]]
+                               for i, dimension in enumerate(group_by)})
+        result['count'] = count.astype(np.int64)
+        result['mean'] = mean
+        result['std'] = std
+        result['min'] = minimum
+        result['max'] = maximum
+        for q, estimate in zip(quantiles, self._quantiles(mask, group_of_cell, n_groups, m, quantiles,
+                                                          minimum, maximum).T):
+            result[f"p{int(round(q * 100))}"] = estimate
+        return result.sort_values('count', ascending=False, kind='stable').reset_index(drop=True)
+
+    def _quantiles(self, mask, group_of_cell, n_groups, m, quantiles, minimum, maximum):
+        """Ước lượng phân vị của từng nhóm từ histogram ghép (nội suy tuyến tính trong ngăn)"""
+        n_bins = self.edges.shape[1] - 1
+        # Nhóm của mọi ô (-1 = không được chọn), rồi lấy các bộ ba sketch của đại lượng m
+        group_of_all = np.full(len(self), -1, dtype=np.intp)
+        group_of_all[np.flatnonzero(mask)] = group_of_cell
+        groups = group_of_all[self.sketch_cell]
+        keep = (groups >= 0) & (self.sketch_bin // n_bins == m)
+        histogram = np.bincount(groups[keep] * n_bins + self.sketch_bin[keep] % n_bins,
+                                self.sketch_count[keep], n_groups * n_bins).reshape(n_groups, n_bins)
+        cumulative = np.cumsum(histogram, axis=1)
+        totals = cumulative[:, -1:] if n_bins else np.zeros((n_groups, 1))
+        edges = self.edges[m]
+        estimates = np.empty((n_groups, len(quantiles)))
+        for j, q in enumerate(quantiles):
+            target = q * totals[:, 0]
+            # Ngăn đầu tiên có số đếm cộng dồn >= target
+            bin_index = np.minimum((cumulative < target[:, None]).sum(axis=1), n_bins - 1)
+            rows = np.arange(n_groups)
+            before = np.where(bin_index > 0, cumulative[rows, bin_index - 1], 0)
+            inside = np.maximum(histogram[rows, bin_index], 1)
+            fraction = np.clip((target - before) / inside, 0.0, 1.0)
+            estimate = edges[bin_index] + fraction * (edges[bin_index + 1] - edges[bin_index])
+            # Kẹp trong [min, max] thật của nhóm - chính xác cho các nhóm có ít giá trị
+            estimates[:, j] = np.clip(estimate, minimum, maximum)
+        return estimates
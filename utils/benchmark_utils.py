@@ -184,4 +184,243 @@ class BenchmarkUtils:
                       'processing_time', 'network_percentage', 'processing_percentage',
                       'prediction', 'status', 'error']
             df = df[columns]
-        return df 
\ No newline at end of file
+        return df 
+
+def benchmark_concurrent_inference(predict_fn, samples, thread_counts=(1, 2, 4, 8),
+                                   requests_per_thread=200, lock=None):
+    """
+    Đo thông lượng dự đoán khi nhiều luồng gọi mô hình cùng lúc
+
+    Parameters:
+        predict_fn: Hàm dự đoán nhận một dictionary đặc trưng
+        samples: Danh sách các dictionary đặc trưng dùng để gọi lần lượt
+        thread_counts: Các mức số luồng cần đo
+        requests_per_thread: Số lần dự đoán mỗi luồng thực hiện
+        lock: Khóa tùy chọn bao quanh mỗi lần dự đoán (để so sánh với khóa toàn cục cũ)
+
+    Returns:
+        pd.DataFrame: Thông lượng (dự đoán/giây), độ trễ trung bình và p99 cho từng mức luồng
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import threading
+
+    def call(sample):
+        if lock is None:
+            return predict_fn(sample)
+        with lock:
+            return predict_fn(sample)
+
+    rows = []
+    for n_threads in thread_counts:
+        barrier = threading.Barrier(n_threads)
+
+        def worker(offset):
+            latencies = []
+            barrier.wait()  # Tất cả luồng bắt đầu cùng lúc
+            for i in range(requests_per_thread):
+                t0 = time.perf_counter()
+                call(samples[(offset + i) % len(samples)])
+                latencies.append(time.perf_counter() - t0)
+            return latencies
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            results = list(executor.map(worker, range(n_threads)))
+        elapsed = time.perf_counter() - start
+
+        latencies = np.concatenate([np.asarray(r) for r in results]) * 1000  # ms
+        rows.append({
+            'threads': n_threads,
+            'predictions': len(latencies),
+            'throughput_per_s': len(latencies) / elapsed,
+            'avg_latency_ms': latencies.mean(),
+            'p99_latency_ms': np.percentile(latencies, 99)
+        })
+    return pd.DataFrame(rows)
+
+
+def _read_memory_kb():
+    """Đọc RSS và PSS (kB) của tiến trình hiện tại từ /proc (chỉ Linux)"""
+    values = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ('Rss:', 'Pss:'):
+                values[parts[0][:-1].lower()] = int(parts[1])
+    return values
+
+
+def _model_sharing_worker(mode, X, n_predictions, barrier, results, version=None, forest_dir=None):
+    """Tiến trình con của benchmark_model_sharing: tải mô hình, dự đoán, rồi đo bộ nhớ"""
+    from models.emission_model import EmissionModel
+    from models.flat_forest import FlatForest
+    model = EmissionModel()
+    if mode == 'pickle':
+        # Cách cũ: mỗi worker unpickle toàn bộ 100 cây scikit-learn vào RAM riêng
+        import joblib
+        estimator = joblib.load(model.model_path)
+        scaler = joblib.load(model.scaler_path)
+        predict = lambda rows: estimator.predict(scaler.transform(pd.DataFrame(rows, columns=model.features)))
+    elif forest_dir is not None:
+        # Chỉ thay rừng cây: các phần còn lại của artifact memory-map và không được chạm tới
+        model.load_artifact(version, mmap_mode='r')
+        model.forest = FlatForest.load(forest_dir, mmap_mode='r' if mode == 'mmap' else None)
+        predict = model.predict_batch
+    else:
+        model.load_artifact(version, mmap_mode='r' if mode == 'mmap' else None)
+        predict = model.predict_batch
+    predict(X)  # Chạm vào các trang nút của toàn bộ rừng cây
+
+    barrier.wait()
+    start = time.perf_counter()
+    for i in range(n_predictions):
+        predict(X[i % len(X)][None, :])
+    elapsed = time.perf_counter() - start
+    barrier.wait()  # Đo bộ nhớ khi tất cả tiến trình đều đang giữ mô hình
+    memory = _read_memory_kb()
+    results.put({'elapsed': elapsed, **memory})
+    barrier.wait()
+
+
+def benchmark_model_sharing(X, n_workers=4, modes=('pickle', 'ram', 'mmap'), n_predictions=200, version=None,
+                            forest_dir=None):
+    """
+    So sánh bộ nhớ và thông lượng khi nhiều tiến trình worker cùng phục vụ mô hình
+
+    Parameters:
+        X: Mảng (n_samples, n_features) các mẫu đầu vào chưa chuẩn hóa
+        n_workers: Số tiến trình worker mô phỏng
+        modes: 'pickle' (joblib scikit-learn như trước), 'ram' (mảng phẳng đọc vào RAM),
+               'mmap' (mảng phẳng memory-map chỉ đọc, dùng chung page cache)
+        n_predictions: Số lần dự đoán một dòng trong mỗi worker
+        version: Phiên bản artifact cho 'ram'/'mmap' (mặc định bản hiện hành) - để so sánh bản nén
+        forest_dir: Thư mục rừng cây thay cho rừng của artifact ('ram'/'mmap'), các phần khác giữ memory-map
+
+    Returns:
+        pd.DataFrame: Tổng RSS, tổng PSS (bộ nhớ thực sự chiếm dụng) và thông lượng cho từng chế độ
+    """
+    import multiprocessing
+    context = multiprocessing.get_context('fork')
+    X = np.asarray(X, dtype=np.float64)
+    rows = []
+    for mode in modes:
+        barrier = context.Barrier(n_workers)
+        results = context.Queue()
+        processes = [context.Process(target=_model_sharing_worker,
+                                     args=(mode, X, n_predictions, barrier, results, version, forest_dir))
+                     for _ in range(n_workers)]
+        for process in processes:
+            process.start()
+        measurements = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        slowest = max(m['elapsed'] for m in measurements)
+        rows.append({
+            'mode': mode,
+            'workers': n_workers,
+            'total_rss_mb': sum(m['rss'] for m in measurements) / 1024,
+            'total_pss_mb': sum(m['pss'] for m in measurements) / 1024,
+            'throughput_per_s': n_workers * n_predictions / slowest
+        })
+    return pd.DataFrame(rows)
+
+def _save_uncompressed_forest(model_path, n_trees, directory):
+    """Tiến trình con của benchmark_compression: dựng lại rừng chưa nén từ mô hình scikit-learn đã lưu"""
+    import sys
+    import joblib
+    from models.flat_forest import FlatForest
+    estimator = joblib.load(model_path)
+    if len(estimator.estimators_) != n_trees:
+        sys.exit(1)
+    FlatForest.from_sklearn(estimator).save(directory)
+
+
+def benchmark_compression(X, n_workers=4, n_predictions=200, mode='ram'):
+    """
+    Đo bộ nhớ và thông lượng của rừng cây đã nén so với rừng chưa nén của cùng mô hình
+
+    Rừng chưa nén được dựng lại từ mô hình scikit-learn đã lưu (trained_model.joblib) vào thư mục tạm,
+    trong một tiến trình riêng để heap của tiến trình cha (được các worker kế thừa qua fork) không
+    chứa các cây scikit-learn đã giải phóng. Mỗi bên chạy n_workers tiến trình chỉ khác nhau ở rừng cây,
+    nên chênh lệch RSS/PSS là của rừng cây.
+
+    Returns:
+        dict: Tổng RSS/PSS (MB) và thông lượng của hai bên, chênh lệch RSS/PSS (MB, âm là tiết kiệm);
+              lưu vào báo cáo nén bằng EmissionModel.record_compression_benchmark
+    """
+    import os
+    import tempfile
+    import multiprocessing
+    from models.emission_model import EmissionModel
+    model = EmissionModel()
+    if not model.load_artifact():
+        raise ValueError("No model artifact to benchmark")
+    with tempfile.TemporaryDirectory() as directory:
+        process = multiprocessing.get_context('fork').Process(
+            target=_save_uncompressed_forest, args=(model.model_path, model.forest.n_trees, directory))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            raise ValueError("trained_model.joblib is missing or out of sync with the current artifact")
+        frame = pd.concat([
+            benchmark_model_sharing(X, n_workers, (mode,), n_predictions, model.version, forest_dir=directory),
+            benchmark_model_sharing(X, n_workers, (mode,), n_predictions, model.version,
+                                    forest_dir=os.path.join(model.artifact_dir, model.version))
+        ], ignore_index=True)
+    before, after = frame.iloc[0], frame.iloc[1]
+    return {
+        'mode': mode,
+        'workers': n_workers,
+        'version': model.version,
+        'total_rss_mb_before': round(float(before['total_rss_mb']), 1),
+        'total_rss_mb_after': round(float(after['total_rss_mb']), 1),
+        'rss_delta_mb': round(float(after['total_rss_mb'] - before['total_rss_mb']), 1),
+        'total_pss_mb_before': round(float(before['total_pss_mb']), 1),
+        'total_pss_mb_after': round(float(after['total_pss_mb']), 1),
+        'pss_delta_mb': round(float(after['total_pss_mb'] - before['total_pss_mb']), 1),
+        'throughput_per_s_before': round(float(before['throughput_per_s']), 1),
+        'throughput_per_s_after': round(float(after['throughput_per_s']), 1),
+        'measured_at': time.time()
+    }
+
+if __name__ == '__main__':
+    # Chạy: python -m utils.benchmark_utils (từ thư mục gốc của dự án)
+    # So sánh thông lượng dự đoán có và không có khóa toàn cục quanh mô hình
+    import os
+    import threading
+    from controllers.emission_controller import EmissionController
+
+    controller = EmissionController()
+    controller.initialize_model(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                             "co2 Emissions.csv"))
+    rng = np.random.default_rng(0)
+    samples = [{
+        'Engine Size(L)': float(rng.uniform(1.0, 8.0)),
+        'Cylinders': int(rng.integers(3, 12)),
+        'Fuel Consumption Comb (L/100 km)': float(rng.uniform(4.0, 20.0)),
+        'Horsepower': float(rng.uniform(100, 800)),
+        'Weight (kg)': float(rng.uniform(1000, 4000)),
+        'Year': int(rng.integers(2015, 2024))
+    } for _ in range(500)]
+
+    print(f"CPU cores: {os.cpu_count()}")
+    print("Với khóa toàn cục (prediction_lock cũ):")
+    print(benchmark_concurrent_inference(controller.predict_emission, samples,
+                                         lock=threading.RLock()).to_string(index=False))
+    print("Không khóa (đọc đồng thời):")
+    print(benchmark_concurrent_inference(controller.predict_emission, samples).to_string(index=False))
+
+    # Bộ nhớ khi chạy nhiều worker: pickle scikit-learn so với mảng phẳng memory-map
+    X = np.array([[sample[f] for f in controller.model.features] for sample in samples])
+    print("Chia sẻ mô hình giữa các worker:")
+    print(benchmark_model_sharing(X, n_workers=max(2, os.cpu_count() or 1)).to_string(index=False))
+
+    # Rừng nén so với chưa nén; kết quả được lưu vào báo cáo nén của artifact (hiện trong /admin/model)
+    try:
+        compression = benchmark_compression(X, n_workers=max(2, os.cpu_count() or 1))
+    except ValueError as e:
+        print(f"Bỏ qua benchmark nén: {e}")
+    else:
+        controller.model.record_compression_benchmark(compression)
+        print("Rừng cây nén so với chưa nén:")
+        print(pd.Series(compression).to_string())
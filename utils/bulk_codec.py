@@ -0,0 +1,208 @@
+# Mô tả: Mã hóa/giải mã dữ liệu nhị phân dạng cột cho endpoint dự đoán hàng loạt
+# Hỗ trợ file NumPy .npy và bộ đệm thô little-endian có header 12 byte; dữ liệu được đọc
+# bằng np.frombuffer trực tiếp trên body của request (không tạo đối tượng Python cho từng giá trị)
+
+import io
+import struct
+import numpy as np
+
+NPY_MIME = 'application/x-npy'
+RAW_MIME = 'application/x-co2-columns'
+JSON_MIME = 'application/json'
+
+# Header của định dạng thô: magic, phiên bản, mã kiểu ('f' = float32, 'd' = float64),
+# số cột, số dòng; theo sau là các cột liên tục (toàn bộ cột 0, rồi cột 1, ...)
+RAW_HEADER = struct.Struct('<4sBBHI')
+RAW_MAGIC = b'CO2B'
+RAW_VERSION = 1
+RAW_DTYPES = {ord('f'): np.dtype('<f4'), ord('d'): np.dtype('<f8')}
+RAW_CODES = {dtype: code for code, dtype in RAW_DTYPES.items()}
+# Header .npy phiên bản 1.0 dài tối đa 10 + 65535 byte (độ dài header là uint16)
+NPY_HEADER_MAX = 10 + 0xFFFF
+
+
+def request_format(content_type):
+    """Định dạng của body theo Content-Type: 'npy', 'raw' hoặc 'json'"""
+    mime = (content_type or '').split(';')[0].strip().lower()
+    if mime == NPY_MIME:
+        return 'npy'
+    if mime in (RAW_MIME, 'application/octet-stream'):
+        return 'raw'
+    return 'json'
+
+
+def response_format(accept, default):
+    """
+    Chọn định dạng phản hồi theo header Accept
+
+    Không có Accept (hoặc */*) thì trả về cùng định dạng với request.
+    """
+    accept = (accept or '').lower()
+    if NPY_MIME in accept:
+        return 'npy'
+    if RAW_MIME in accept or 'application/octet-stream' in accept:
+        return 'raw'
+    if JSON_MIME in accept:
+        return 'json'
+    return default
+
+
+def max_body_bytes(fmt, n_features, max_rows):
+    """
+    Kích thước body nhị phân lớn nhất có thể chứa tối đa max_rows dòng
+
+    Dùng để từ chối request quá lớn theo Content-Length (hoặc đọc giới hạn) trước khi đọc cả body:
+    body hợp lệ không vượt quá header + max_rows * n_features * 8 byte (float64).
+
+    Returns:
+        int hoặc None: Số byte tối đa; None với JSON (số byte mỗi dòng không cố định)
+    """
+    if fmt == 'json':
+        return None
+    header = NPY_HEADER_MAX if fmt == 'npy' else RAW_HEADER.size
+    return header + max_rows * n_features * np.dtype('<f8').itemsize
+
+
+def nonfinite_rows(X):
+    """Chỉ số các dòng có giá trị NaN/inf; NaN so sánh luôn sai nên sẽ đi lệch nhánh cây một cách âm thầm"""
+    return np.flatnonzero(~np.isfinite(X).all(axis=1))
+
+
+def _decode_npy(body):
+    """Đọc header .npy rồi tạo view trên phần dữ liệu (không sao chép)"""
+    stream = io.BytesIO(body)
+    version = np.lib.format.read_magic(stream)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+    if dtype not in RAW_CODES:
+        raise ValueError(f"Unsupported dtype {dtype}, expected little-endian float32 or float64")
+    if len(shape) != 2:
+        raise ValueError(f"Expected a 2-D array (rows, features), got shape {shape}")
+    count = shape[0] * shape[1]
+    data = np.frombuffer(body, dtype=dtype, count=count, offset=stream.tell())
+    return data.reshape(shape, order='F' if fortran_order else 'C')
+
+
+def _decode_raw(body):
+    """Đọc header thô rồi tạo view (n_rows, n_columns) trên các cột liên tục"""
+    if len(body) < RAW_HEADER.size:
+        raise ValueError("Payload shorter than header")
+    magic, version, code, n_columns, n_rows = RAW_HEADER.unpack_from(body)
+    if magic != RAW_MAGIC or version != RAW_VERSION:
+        raise ValueError("Bad magic or version in binary header")
+    if code not in RAW_DTYPES:
+        raise ValueError(f"Unsupported dtype code {code!r}")
+    dtype = RAW_DTYPES[code]
+    expected = RAW_HEADER.size + n_columns * n_rows * dtype.itemsize
+    if len(body) != expected:
+        raise ValueError(f"Payload size {len(body)} does not match header ({expected} bytes expected)")
+    data = np.frombuffer(body, dtype=dtype, count=n_columns * n_rows, offset=RAW_HEADER.size)
+    # Cột liên tục = mảng (n_columns, n_rows) C-order; chuyển vị là view, không sao chép
+    return data.reshape(n_columns, n_rows).T
+
+
+def _decode_json(payload, features):
+    """
+    Đọc body JSON: {"rows": [[...], ...]}, {"columns": {tên: [...]}}
+    hoặc {"instances": [{tên: giá trị}, ...]}
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("JSON body must be an object with 'rows', 'columns' or 'instances'")
+    if 'rows' in payload:
+        return np.asarray(payload['rows'], dtype=np.float64)
+    if 'columns' in payload:
+        columns = payload['columns']
+        return np.column_stack([np.asarray(columns[name], dtype=np.float64) for name in features])
+    if 'instances' in payload:
+        return np.array([[instance[name] for name in features] for instance in payload['instances']],
+                        dtype=np.float64)
+    raise ValueError("JSON body must contain 'rows', 'columns' or 'instances'")
+
+
+def decode_matrix(body, fmt, features, json_payload=None):
+    """
+    Giải mã body thành ma trận (n_rows, n_features)
+
+    Parameters:
+        body: Bytes của request
+        fmt: 'npy', 'raw' hoặc 'json'
+        features: Danh sách tên đặc trưng theo thứ tự của mô hình
+        json_payload: Body JSON đã parse (định dạng json)
+
+    Raises:
+        ValueError: Dữ liệu không hợp lệ hoặc sai số cột
+    """
+    if fmt == 'npy':
+        X = _decode_npy(body)
+    elif fmt == 'raw':
+        X = _decode_raw(body)
+    else:
+        X = _decode_json(json_payload, features)
+    if X.ndim != 2 or X.shape[1] != len(features):
+        raise ValueError(f"Expected {len(features)} feature columns in order {features}, got shape {X.shape}")
+    return X
+
+
+def encode_vector(values, fmt, dtype=np.float64):
+    """
+    Mã hóa vector kết quả theo định dạng nhị phân
+
+    Returns:
+        tuple: (bytes, mimetype)
+    """
+    values = np.ascontiguousarray(values, dtype=dtype)
+    if fmt == 'npy':
+        buffer = io.BytesIO()
+        np.lib.format.write_array(buffer, values, allow_pickle=False)
+        return buffer.getvalue(), NPY_MIME
+    header = RAW_HEADER.pack(RAW_MAGIC, RAW_VERSION, RAW_CODES[values.dtype], 1, len(values))
+    return header + values.tobytes(), RAW_MIME
+
+
+def encode_columns(columns, fmt, dtype=np.float64):
+    """
+    Mã hóa nhiều vector kết quả cùng độ dài (ví dụ dự đoán, độ lệch chuẩn, phân vị)
+
+    npy: mảng (n_rows, n_columns); thô: header với n_columns cột rồi các cột liên tục.
+
+    Returns:
+        tuple: (bytes, mimetype)
+    """
+    if fmt == 'npy':
+        buffer = io.BytesIO()
+        np.lib.format.write_array(buffer, np.column_stack(columns).astype(dtype, copy=False),
+                                  allow_pickle=False)
+        return buffer.getvalue(), NPY_MIME
+    columns = [np.ascontiguousarray(column, dtype=dtype) for column in columns]
+    header = RAW_HEADER.pack(RAW_MAGIC, RAW_VERSION, RAW_CODES[np.dtype(dtype)], len(columns), len(columns[0]))
+    return header + b''.join(column.tobytes() for column in columns), RAW_MIME
+
+
+def encode_matrix(X, dtype=np.float64):
+    """
+    Mã hóa ma trận (n_rows, n_features) theo định dạng thô dạng cột (phía client)
+
+    Returns:
+        tuple: (bytes, mimetype)
+    """
+    X = np.asarray(X, dtype=dtype)
+    n_rows, n_columns = X.shape
+    header = RAW_HEADER.pack(RAW_MAGIC, RAW_VERSION, RAW_CODES[X.dtype], n_columns, n_rows)
+    # Chuyển vị rồi sao chép liên tục: các cột nằm nối tiếp nhau
+    return header + np.ascontiguousarray(X.T).tobytes(), RAW_MIME
+
+
+def decode_vector(body, mimetype):
+    """Giải mã vector kết quả nhị phân của /predict/batch (phía client)"""
+    if request_format(mimetype) == 'npy':
+        return np.load(io.BytesIO(body), allow_pickle=False)
+    return _decode_raw(body)[:, 0]
+
+
+def decode_columns(body, mimetype):
+    """Giải mã kết quả nhiều cột của /predict/batch thành mảng (n_rows, n_columns) (phía client)"""
+    if request_format(mimetype) == 'npy':
+        return np.load(io.BytesIO(body), allow_pickle=False)
+    return _decode_raw(body)
@@ -0,0 +1,207 @@
+# Mô tả: Báo cáo đánh giá mô hình - kiểm định chéo k-fold, sai số theo nhóm xe, độ quan trọng hoán vị
+# Các phần nặng chạy song song trên mọi nhân CPU bằng joblib: mỗi fold huấn luyện một rừng cây riêng
+# (tiến trình), mỗi đặc trưng được hoán vị trong một tác vụ riêng. Báo cáo được lưu dạng JSON theo
+# phiên bản mô hình + mã băm file dữ liệu, nên trang Analysis và /health chỉ đọc lại, không tính lại.
+
+import os
+import json
+import time
+import hashlib
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.model_selection import KFold
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.metrics import r2_score, mean_absolute_error, mean_squared_error
+
+EVALUATION_FORMAT = 2  # Tăng khi đổi nội dung báo cáo để các bản cũ được tính lại
+CV_FOLDS = 5
+PERMUTATION_REPEATS = 5  # Số lần hoán vị mỗi đặc trưng
+SEGMENT_COLUMNS = ('Fuel Type', 'Vehicle Class')
+
+
+def evaluation_key(model_version, data_path, n_folds=CV_FOLDS, n_repeats=PERMUTATION_REPEATS):
+    """Tên file báo cáo: phiên bản mô hình + mã băm nội dung file dữ liệu và cấu hình đánh giá"""
+    digest = hashlib.sha1(json.dumps([EVALUATION_FORMAT, n_folds, n_repeats, list(SEGMENT_COLUMNS)]).encode())
+    with open(data_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return f"{model_version}-{digest.hexdigest()[:16]}"
+
+
+def _metrics(y_true, y_pred):
+    """R2, MAE và RMSE (g/km) của một tập dự đoán"""
+    return {
+        'r2': float(r2_score(y_true, y_pred)),
+        'mae': float(mean_absolute_error(y_true, y_pred)),
+        'rmse': float(np.sqrt(mean_squared_error(y_true, y_pred)))
+    }
+
+
+def _fit_fold(estimator, X, y, train, test):
+    """Huấn luyện một fold (chạy trong tiến trình worker), trả về dự đoán trên phần kiểm tra"""
+    pipeline = make_pipeline(StandardScaler(), clone(estimator).set_params(n_jobs=1))
+    pipeline.fit(X[train], y[train])
+    return test, pipeline.predict(X[test])
+
+
+def cross_validate(estimator, X, y, n_folds=CV_FOLDS, n_jobs=-1):
+    """
+    Kiểm định chéo k-fold quy trình huấn luyện (chuẩn hóa + rừng cây), các fold chạy song song
+
+    Returns:
+        tuple: (dict chỉ số -> {'mean', 'std', 'folds'}, dự đoán out-of-fold cho mọi dòng)
+    """
+    folds = KFold(n_splits=n_folds, shuffle=True, random_state=42).split(X)
+    results = Parallel(n_jobs=n_jobs)(delayed(_fit_fold)(estimator, X, y, train, test) for train, test in folds)
+    out_of_fold = np.empty(len(y))
+    per_fold = []
+    for test, predictions in results:
+        out_of_fold[test] = predictions
+        per_fold.append(_metrics(y[test], predictions))
+    summary = {}
+    for name in ('r2', 'mae', 'rmse'):
+        values = np.array([fold[name] for fold in per_fold])
+        summary[name] = {'mean': float(values.mean()), 'std': float(values.std()), 'folds': values.tolist()}
+    return summary, out_of_fold
+
+
+def segment_errors(df, y_true, y_pred, columns=SEGMENT_COLUMNS):
+    """
+    Sai số theo từng nhóm xe
+
+    Returns:
+        dict: tên cột -> danh sách {segment, count, mae, rmse, bias}, nhóm sai số lớn nhất trước;
+              bias > 0 nghĩa là mô hình dự đoán cao hơn thực tế
+    """
+    errors = np.asarray(y_pred, dtype=np.float64) - np.asarray(y_true, dtype=np.float64)
+    frame = pd.DataFrame({'error': errors, 'abs_error': np.abs(errors), 'squared_error': errors ** 2})
+    segments = {}
+    for column in columns:
+        if column not in df.columns:
+            continue
+        grouped = frame.groupby(df[column].astype(str).to_numpy()).agg(
+            count=('error', 'size'), mae=('abs_error', 'mean'),
+            mse=('squared_error', 'mean'), bias=('error', 'mean'))
+        grouped['rmse'] = np.sqrt(grouped.pop('mse'))
+        grouped = grouped.sort_values('mae', ascending=False)
+        segments[column] = [
+            {'segment': name, 'count': int(row['count']), 'mae': float(row['mae']),
+             'rmse': float(row['rmse']), 'bias': float(row['bias'])}
+            for name, row in grouped.iterrows()
+        ]
+    return segments
+
+
+def _permute_feature(predict_fn, X, y, column, n_repeats, seed):
+    """Hoán vị một cột n_repeats lần; mọi lần hoán vị được dự đoán trong một lần gọi predict_fn"""
+    rng = np.random.default_rng(seed)
+    X_permuted = np.tile(X, (n_repeats, 1))
+    for r in range(n_repeats):
+        X_permuted[r * len(X):(r + 1) * len(X), column] = rng.permutation(X[:, column])
+    predictions = predict_fn(X_permuted).reshape(n_repeats, len(X))
+    return [r2_score(y, row) for row in predictions], [mean_absolute_error(y, row) for row in predictions]
+
+
+def permutation_importance(predict_fn, X, y, features, n_repeats=PERMUTATION_REPEATS, n_jobs=-1):
+    """
+    Độ quan trọng hoán vị của mô hình đang phục vụ, mỗi đặc trưng là một tác vụ song song
+
+    Khác feature_importances_ (giảm impurity khi huấn luyện), đây là mức giảm độ chính xác
+    thật trên dữ liệu kiểm tra khi thông tin của đặc trưng bị xáo trộn.
+
+    Returns:
+        dict: tên đặc trưng -> {'r2_drop', 'r2_drop_std', 'mae_increase'}, quan trọng nhất trước
+    """
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    baseline = predict_fn(X)
+    base_r2, base_mae = r2_score(y, baseline), mean_absolute_error(y, baseline)
+    # Luồng: predict_fn dùng mô hình memory-map sẵn có của tiến trình, không cần sao chép sang tiến trình khác
+    results = Parallel(n_jobs=n_jobs, prefer='threads')(
+        delayed(_permute_feature)(predict_fn, X, y, j, n_repeats, 42 + j) for j in range(len(features)))
+    importances = {}
+    for feature, (r2_values, mae_values) in zip(features, results):
+        drops = base_r2 - np.array(r2_values)
+        importances[feature] = {'r2_drop': float(drops.mean()), 'r2_drop_std': float(drops.std()),
+                                'mae_increase': float(np.mean(mae_values) - base_mae)}
+    return dict(sorted(importances.items(), key=lambda item: item[1]['r2_drop'], reverse=True))
+
+
+def evaluate(model, df, n_folds=CV_FOLDS, n_repeats=PERMUTATION_REPEATS, n_jobs=-1):
+    """
+    Tạo báo cáo đánh giá đầy đủ cho một EmissionModel đã huấn luyện
+
+    Parameters:
+        model: EmissionModel đang phục vụ
+        df: Dữ liệu đã tiền xử lý (load_and_preprocess_data)
+
+    Returns:
+        dict: 'cv' (k-fold của quy trình huấn luyện), 'test' (mô hình đang phục vụ trên tập kiểm tra),
+              'segments' (sai số out-of-fold theo nhóm xe), 'permutation_importance'
+    """
+    start_time = time.perf_counter()
+    X = df[model.features].to_numpy(dtype=np.float64)
+    y = df[model.target].to_numpy(dtype=np.float64)
+    cv, out_of_fold = cross_validate(model.model, X, y, n_folds, n_jobs)
+    # Cùng cách chia với EmissionModel.train (theo mã băm dòng): tập kiểm tra không nằm trong dữ liệu
+    # huấn luyện của bất kỳ cây nào, kể cả các cây thêm vào khi cập nhật tăng dần
+    test = model.test_mask(model.row_hashes(df))
+    X_test, y_test = X[test], y[test]
+    test_predictions = model.predict_batch(X_test)
+    return {
+        'format': EVALUATION_FORMAT,
+        'model_version': model.version,
+        'created_at': time.time(),
+        'n_rows': int(len(df)),
+        'cv': cv,
+        'test': dict(_metrics(y_test, test_predictions), n_rows=int(len(y_test))),
+        'segments': segment_errors(df, y, out_of_fold),
+        'permutation_importance': permutation_importance(model.predict_batch, X_test, y_test,
+                                                         model.features, n_repeats, n_jobs),
+        'elapsed_seconds': time.perf_counter() - start_time
+    }
+
+
+def load_report(path):
+    """Đọc báo cáo đã lưu, None nếu chưa có hoặc file hỏng"""
+    try:
+        with open(path) as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return report if report.get('format') == EVALUATION_FORMAT else None
+
+
+def save_report(report, path):
+    """Ghi báo cáo JSON (ghi file tạm rồi os.replace)"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def summarize_report(report):
+    """Tóm tắt gọn của báo cáo cho /health"""
+    return {
+        'model_version': report['model_version'],
+        'created_at': report['created_at'],
+        'cv': {name: round(values['mean'], 4) for name, values in report['cv'].items()},
+        'test': {name: round(value, 4) for name, value in report['test'].items() if name != 'n_rows'},
+        'top_features': list(report['permutation_importance'])[:3]
+    }
+
+
+if __name__ == '__main__':
+    # Tính trước báo cáo cho mô hình hiện hành (ví dụ trong bước triển khai): python -m utils.evaluation
+    from controllers.emission_controller import EmissionController
+    controller = EmissionController()
+    controller.initialize_model('co2 Emissions.csv')
+    report = controller.get_evaluation_report(compute=True)
+    print(json.dumps(summarize_report(report), indent=2))
+    print(f"Evaluation took {report['elapsed_seconds']:.1f} s")
@@ -0,0 +1,119 @@
+# Mô tả: Chấm điểm cả đội xe (fleet) từ file CSV cho giao diện Streamlit
+# Dự đoán theo từng khối trong luồng nền (không chặn luồng script của Streamlit),
+# cập nhật tiến độ sau mỗi khối và tổng hợp kết quả cho toàn đội xe
+
+import time
+import threading
+import numpy as np
+import pandas as pd
+
+FLEET_CHUNK_ROWS = 10000  # Số xe mỗi khối dự đoán (mỗi lần cập nhật thanh tiến độ)
+
+
+def read_fleet_csv(file, features):
+    """
+    Đọc file CSV đội xe và kiểm tra các cột đặc trưng
+
+    Parameters:
+        file: Đường dẫn hoặc file-like object (ví dụ kết quả của st.file_uploader)
+        features: Danh sách tên cột đặc trưng của mô hình
+
+    Returns:
+        tuple: (DataFrame các dòng hợp lệ, số dòng bị loại do thiếu/sai giá trị)
+
+    Raises:
+        ValueError: File thiếu cột đặc trưng
+    """
+    df = pd.read_csv(file, low_memory=False)
+    df.columns = [str(column).strip() for column in df.columns]
+    missing = [name for name in features if name not in df.columns]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+    values = df[features].apply(pd.to_numeric, errors='coerce')
+    valid = values.notna().all(axis=1).to_numpy()
+    df = df[valid].reset_index(drop=True)
+    df[features] = values[valid].reset_index(drop=True)
+    return df, int((~valid).sum())
+
+
+class FleetScoringJob:
+    """
+    Dự đoán cho một ma trận lớn theo từng khối trong luồng nền
+
+    Luồng script của Streamlit chỉ đọc progress/done để vẽ thanh tiến độ; khi người dùng
+    tương tác (script chạy lại), job vẫn tiếp tục và được lấy lại từ st.session_state.
+    """
+    def __init__(self, predict_fn, X, chunk_rows=FLEET_CHUNK_ROWS):
+        self.predict_fn = predict_fn  # Hàm nhận mảng (n, n_features) trả về mảng dự đoán
+        self.X = X
+        self.chunk_rows = chunk_rows
+        self.predictions = np.empty(len(X))
+        self.rows_done = 0
+        self.error = None
+        self.elapsed = 0.0
+        self._done = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="fleet-scoring", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        start_time = time.perf_counter()
+        try:
+            for start in range(0, len(self.X), self.chunk_rows):
+                chunk = self.X[start:start + self.chunk_rows]
+                self.predictions[start:start + len(chunk)] = self.predict_fn(chunk)
+                self.rows_done = start + len(chunk)
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self.elapsed = time.perf_counter() - start_time
+            self._done.set()
+
+    @property
+    def progress(self):
+        """Tỉ lệ hoàn thành trong khoảng [0, 1]"""
+        return self.rows_done / len(self.X) if len(self.X) else 1.0
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+
+def summarize_fleet(df, predictions, ratings, top_n=10, id_columns=('Make', 'Model', 'Vehicle Class')):
+    """
+    Tổng hợp kết quả của đội xe
+
+    Parameters:
+        df: DataFrame đội xe (các dòng hợp lệ)
+        predictions: Mảng dự đoán g/km tương ứng từng dòng
+        ratings: Mảng xếp hạng A-F tương ứng từng dòng
+        top_n: Số xe phát thải cao nhất cần liệt kê
+
+    Returns:
+        dict: total, mean, median, p90 (g/km), rating_counts (Series A-F),
+              worst (DataFrame top_n xe phát thải cao nhất)
+    """
+    predictions = np.asarray(predictions, dtype=np.float64)
+    rating_counts = pd.Series(ratings).value_counts().reindex(list('ABCDEF'), fill_value=0)
+    # argpartition: chỉ cần top_n phần tử lớn nhất, không sắp xếp cả đội xe
+    k = min(top_n, len(predictions))
+    worst_index = np.argpartition(predictions, -k)[-k:] if k else np.array([], dtype=int)
+    worst_index = worst_index[np.argsort(predictions[worst_index])[::-1]]
+    columns = [column for column in id_columns if column in df.columns]
+    worst = df.iloc[worst_index][columns].copy()
+    worst['Predicted CO2 (g/km)'] = np.round(predictions[worst_index], 1)
+    worst['Rating'] = np.asarray(ratings)[worst_index]
+    return {
+        'total': float(predictions.sum()),
+        'mean': float(predictions.mean()) if len(predictions) else 0.0,
+        'median': float(np.median(predictions)) if len(predictions) else 0.0,
+        'p90': float(np.percentile(predictions, 90)) if len(predictions) else 0.0,
+        'rating_counts': rating_counts,
+        'worst': worst.reset_index(drop=True)
+    }
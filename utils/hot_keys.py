@@ -0,0 +1,126 @@
+# Mô tả: Ghi nhận các vector đặc trưng được yêu cầu nhiều nhất (hot keys)
+# Dùng thuật toán Space-Saving: giữ tối đa capacity khóa với bộ đếm, khi đầy thì khóa mới
+# thay khóa có số đếm nhỏ nhất (kế thừa số đếm đó) - bộ nhớ cố định, không bỏ sót khóa thật sự nóng.
+# Các khóa được nhóm theo số đếm (stream-summary) nên tìm khóa nhỏ nhất là O(1), không quét cả sketch:
+# record() chạy trên mọi request /predict hợp lệ (trước khi tra cache), kể cả luồng request toàn khóa mới.
+# Số đếm được cộng dồn định kỳ vào file JSON để lần khởi động sau nạp sẵn cache cho các khóa này;
+# số đếm cũ trong file giảm dần theo mỗi lần ghi để khóa đã nguội nhường chỗ cho khóa mới.
+
+import os
+import json
+import fcntl
+import threading
+
+HOT_KEYS_DECAY = 0.9  # Hệ số nhân số đếm đã lưu mỗi lần ghi (chu kỳ 60 s -> chu kỳ bán rã ~7 phút)
+HOT_KEYS_MIN_COUNT = 1.0  # Khóa có số đếm đã giảm dưới mức này bị bỏ khỏi file
+
+
+class HotKeySketch:
+    """
+    Sketch top-K các khóa được yêu cầu nhiều nhất
+
+    Khóa là tuple số thực (vector đặc trưng chuẩn hóa của request).
+    """
+    def __init__(self, capacity=1024):
+        self.capacity = capacity  # Số khóa tối đa được theo dõi trong bộ nhớ
+        self._counts = {}  # khóa -> số đếm (đã trừ phần đã ghi ra file)
+        self._buckets = {}  # số đếm -> các khóa có số đếm đó (dict dùng như tập có thứ tự)
+        self._min_count = 0  # Số đếm nhỏ nhất hiện có (0 khi sketch rỗng)
+        self._lock = threading.Lock()
+
+    def _move_locked(self, key, count, new_count):
+        """Chuyển khóa từ nhóm count sang nhóm new_count, cập nhật số đếm nhỏ nhất"""
+        if count:
+            bucket = self._buckets[count]
+            del bucket[key]
+            if not bucket:
+                del self._buckets[count]
+                if count == self._min_count:
+                    # Số đếm chỉ tăng 1 mỗi lần nên nhóm nhỏ nhất mới chính là new_count
+                    self._min_count = new_count
+        self._buckets.setdefault(new_count, {})[key] = None
+        self._counts[key] = new_count
+
+    def record(self, key):
+        """Ghi nhận một lần yêu cầu khóa - O(1)"""
+        with self._lock:
+            count = self._counts.get(key)
+            if count is not None:
+                self._move_locked(key, count, count + 1)
+            elif len(self._counts) < self.capacity:
+                self._move_locked(key, 0, 1)
+                self._min_count = 1
+            else:
+                # Space-Saving: thay khóa nhỏ nhất (cũ nhất trong nhóm), khóa mới nhận số đếm đó + 1 (cận trên)
+                smallest = self._min_count
+                evicted = next(iter(self._buckets[smallest]))
+                del self._counts[evicted]
+                self._buckets[smallest][key] = None
+                del self._buckets[smallest][evicted]
+                self._counts[key] = smallest
+                self._move_locked(key, smallest, smallest + 1)
+
+    def top(self, n):
+        """n khóa có số đếm lớn nhất trong bộ nhớ"""
+        with self._lock:
+            return sorted(self._counts, key=self._counts.get, reverse=True)[:n]
+
+    def __len__(self):
+        return len(self._counts)
+
+    def drain(self):
+        """Lấy toàn bộ số đếm hiện có và bắt đầu đếm lại từ đầu"""
+        with self._lock:
+            counts, self._counts = self._counts, {}
+            self._buckets = {}
+            self._min_count = 0
+        return counts
+
+    def persist(self, path, keep=None, decay=HOT_KEYS_DECAY):
+        """
+        Cộng số đếm trong bộ nhớ vào file và ghi lại nguyên tử
+
+        Nhiều worker cùng ghi một file: mỗi lần ghi giữ khóa flock trên file .lock,
+        đọc số đếm hiện có, nhân với decay, cộng phần mới rồi chỉ giữ lại keep khóa lớn nhất
+        (khóa có số đếm dưới HOT_KEYS_MIN_COUNT bị bỏ). Chu kỳ không có request nào
+        vẫn ghi lại file để số đếm cũ tiếp tục giảm.
+
+        Returns:
+            int: Số khóa trong file sau khi ghi (0 nếu chưa có file và không có gì để ghi)
+        """
+        counts = self.drain()
+        if not counts and not os.path.exists(path):
+            return 0
+        keep = keep or self.capacity
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(f"{path}.lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            merged = {tuple(key): count * decay for key, count in load_hot_keys(path)}
+            for key, count in counts.items():
+                merged[key] = merged.get(key, 0) + count
+            ranked = sorted(((key, count) for key, count in merged.items() if count >= HOT_KEYS_MIN_COUNT),
+                            key=lambda item: item[1], reverse=True)[:keep]
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump([[list(key), count] for key, count in ranked], f)
+            os.replace(tmp_path, path)
+        return len(ranked)
+
+
+def load_hot_keys(path, n=None):
+    """
+    Đọc các khóa nóng đã lưu, sắp xếp theo số đếm giảm dần
+
+    Returns:
+        list: [(tuple khóa, số đếm)], rỗng nếu chưa có file hoặc file hỏng
+    """
+    try:
+        with open(path) as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        return []
+    ranked = sorted(((tuple(float(v) for v in key), count) for key, count in entries),
+                    key=lambda item: item[1], reverse=True)
+    return ranked[:n] if n else ranked
@@ -0,0 +1,60 @@
+# Mô tả: Cache kết quả dự đoán an toàn đa luồng
+# Cache có khóa riêng, chỉ giữ khóa trong vài thao tác dict nên không chặn
+# các luồng đang chạy mô hình (khác với khóa toàn cục bao quanh cả lần dự đoán)
+
+import threading
+from collections import OrderedDict
+
+
+class PredictionCache:
+    """
+    Cache LRU có giới hạn kích thước với đồng bộ hóa chi tiết
+
+    Khóa chỉ bảo vệ thao tác đọc/ghi OrderedDict (cỡ micro giây),
+    việc tính toán dự đoán luôn diễn ra bên ngoài khóa.
+    """
+    def __init__(self, max_size=500):
+        self.max_size = max_size  # Số phần tử tối đa
+        self._data = OrderedDict()  # Dữ liệu cache theo thứ tự truy cập
+        self._lock = threading.Lock()  # Khóa riêng của cache
+        self.hits = 0  # Số lần tìm thấy trong cache
+        self.misses = 0  # Số lần không tìm thấy
+
+    def get(self, key, default=None):
+        """Lấy giá trị từ cache và đánh dấu vừa được sử dụng"""
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Thêm giá trị vào cache, loại bỏ phần tử cũ nhất nếu đầy"""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """Xóa toàn bộ cache, trả về số phần tử đã xóa"""
+        with self._lock:
+            size = len(self._data)
+            self._data.clear()
+            return size
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """Thống kê cache cho endpoint /health"""
+        return {'size': len(self._data), 'max_size': self.max_size,
+                'hits': self.hits, 'misses': self.misses}
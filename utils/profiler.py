@@ -0,0 +1,162 @@
+# Mô tả: Công cụ profiling theo yêu cầu cho worker đang chạy
+# Gồm bộ lấy mẫu stack thống kê (CPU/thời gian) trên tất cả các luồng
+# và chế độ theo dõi cấp phát bộ nhớ dựa trên tracemalloc
+
+import os
+import sys
+import time
+import threading
+import tracemalloc
+from collections import Counter
+
+
+class SamplingProfiler:
+    """
+    Bộ profiling lấy mẫu thống kê
+
+    Một luồng riêng đọc sys._current_frames() theo chu kỳ interval và đếm số lần
+    mỗi stack xuất hiện. Không cài hook vào trình thông dịch nên chi phí cho các
+    luồng đang xử lý request rất thấp (chỉ tranh GIL trong lúc chụp stack).
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval  # Chu kỳ lấy mẫu (giây)
+        self.stacks = Counter()  # Số lần xuất hiện của mỗi stack
+        self.samples = 0  # Tổng số lần lấy mẫu
+        self.duration = 0.0  # Thời gian lấy mẫu thực tế (giây)
+
+    @staticmethod
+    def _frame_label(frame):
+        """Tạo nhãn ngắn gọn cho một frame: hàm (file:dòng)"""
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+    def _walk(self, frame):
+        """Duyệt stack từ frame gốc đến frame lá"""
+        labels = []
+        while frame is not None:
+            labels.append(self._frame_label(frame))
+            frame = frame.f_back
+        labels.reverse()
+        return labels
+
+    def run(self, seconds):
+        """
+        Lấy mẫu tất cả các luồng (trừ luồng hiện tại) trong khoảng thời gian cho trước
+
+        Parameters:
+            seconds: Thời gian lấy mẫu (giây)
+        """
+        own_id = threading.get_ident()
+        start = time.perf_counter()
+        deadline = start + seconds
+        while time.perf_counter() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = [names.get(thread_id, str(thread_id))] + self._walk(frame)
+                self.stacks[tuple(stack)] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+        self.duration = time.perf_counter() - start
+        return self
+
+    def collapsed(self):
+        """Xuất stack dạng collapsed (định dạng đầu vào của flamegraph.pl / speedscope)"""
+        lines = [f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common()]
+        return "\n".join(lines)
+
+    def top(self, n=20):
+        """
+        Tổng hợp các hàm tốn thời gian nhất
+
+        Returns:
+            list: Mỗi phần tử gồm hàm, số mẫu self (hàm ở đỉnh stack)
+                  và số mẫu inclusive (hàm có mặt trong stack)
+        """
+        self_counts = Counter()
+        inclusive_counts = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack[1:]  # Bỏ tên luồng
+            if not frames:
+                continue
+            self_counts[frames[-1]] += count
+            for label in set(frames):
+                inclusive_counts[label] += count
+        total = sum(self.stacks.values()) or 1
+        return [
+            {
+                'function': label,
+                'self_samples': count,
+                'self_pct': round(count / total * 100, 2),
+                'inclusive_samples': inclusive_counts[label],
+                'inclusive_pct': round(inclusive_counts[label] / total * 100, 2)
+            }
+            for label, count in self_counts.most_common(n)
+        ]
+
+
+class AllocationTracker:
+    """
+    Theo dõi tăng trưởng bộ nhớ bằng tracemalloc
+
+    - profile(seconds): so sánh hai snapshot cách nhau seconds giây
+    - since_start(): so sánh với snapshot gốc chụp khi bắt đầu theo dõi,
+      dùng để tìm rò rỉ giữa hai lần worker khởi động lại (max_requests)
+    """
+    def __init__(self, frames=25):
+        self.frames = frames  # Số frame lưu lại cho mỗi lần cấp phát
+        self.baseline = None  # Snapshot gốc
+
+    def start(self):
+        """Bật tracemalloc (nếu chưa bật) và chụp snapshot gốc"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        if self.baseline is None:
+            self.baseline = tracemalloc.take_snapshot()
+        return self
+
+    @staticmethod
+    def _diff(old, new, n):
+        """Top n khác biệt cấp phát theo dòng mã nguồn"""
+        stats = new.compare_to(old, 'lineno')
+        return [
+            {
+                'location': str(stat.traceback[0]),
+                'size_diff_kb': round(stat.size_diff / 1024, 2),
+                'size_kb': round(stat.size / 1024, 2),
+                'count_diff': stat.count_diff
+            }
+            for stat in stats[:n]
+        ]
+
+    def profile(self, seconds, n=20):
+        """Đo cấp phát mới trong một khoảng thời gian"""
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start(self.frames)
+        try:
+            before = tracemalloc.take_snapshot()
+            time.sleep(seconds)
+            after = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            return {
+                'top': self._diff(before, after, n),
+                'traced_current_kb': round(current / 1024, 2),
+                'traced_peak_kb': round(peak / 1024, 2)
+            }
+        finally:
+            # Chỉ tắt nếu chính hàm này đã bật - tránh làm mất snapshot gốc
+            if not was_tracing:
+                tracemalloc.stop()
+
+    def since_start(self, n=20):
+        """So sánh bộ nhớ hiện tại với snapshot gốc"""
+        if self.baseline is None or not tracemalloc.is_tracing():
+            return None
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            'top': self._diff(self.baseline, tracemalloc.take_snapshot(), n),
+            'traced_current_kb': round(current / 1024, 2),
+            'traced_peak_kb': round(peak / 1024, 2)
+        }
@@ -0,0 +1,181 @@
+# Mô tả: Bộ ghi log request bất đồng bộ, có cấu trúc (JSON lines)
+# Handler chỉ đẩy một bản ghi gọn vào hàng đợi không khóa; một luồng nền gom lô
+# và ghi ra file xoay vòng, nên request không phải chờ I/O của việc ghi log
+# Mỗi tiến trình ghi file riêng (requests.<pid>.jsonl): với nhiều worker gunicorn, các
+# RotatingFileHandler độc lập cùng xoay vòng một file sẽ làm mất hoặc xen kẽ bản ghi
+
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import itertools
+from logging.handlers import RotatingFileHandler
+
+# Các mức log luôn được ghi, không bị lấy mẫu
+ALWAYS_LOG_LEVELS = ('warning', 'error')
+
+
+class AsyncRequestLogger:
+    """
+    Bộ ghi log request chạy nền
+
+    - log(): chỉ tạo tuple (thời gian, mức, sự kiện, trường) và put vào queue.SimpleQueue
+      (cài đặt bằng C, không dùng khóa Python) - chi phí cỡ micro giây
+    - Lấy mẫu tất định 1/N bằng bộ đếm itertools.count (nguyên tử dưới GIL),
+      thay cho kiểu lấy mẫu ngẫu nhiên theo thời gian
+    - Lỗi, fallback và các bản ghi always=True luôn được ghi
+    - Luồng nền gom tối đa batch_size bản ghi, chuyển sang JSON và ghi một lần
+    """
+    def __init__(self, path='logs/requests.jsonl', sample_rate=10, max_bytes=10 * 1024 * 1024,
+                 backup_count=5, batch_size=256, flush_interval=0.5):
+        self.path = path  # Đường dẫn file log
+        self.sample_rate = max(1, int(sample_rate))  # Ghi 1 trên N request thành công
+        self.max_bytes = max_bytes  # Kích thước tối đa trước khi xoay vòng file
+        self.backup_count = backup_count  # Số file cũ được giữ lại
+        self.batch_size = batch_size  # Số bản ghi tối đa mỗi lần ghi
+        self.flush_interval = flush_interval  # Thời gian chờ tối đa (giây) trước khi ghi lô
+        self.dropped = 0  # Số bản ghi bị bỏ do lỗi ghi file
+        self._start_lock = threading.Lock()
+        self._reset()
+        atexit.register(self.close)
+
+    def _reset(self):
+        """Tạo lại hàng đợi và bộ đếm (dùng khi khởi tạo và sau khi fork)"""
+        self._queue = queue.SimpleQueue()
+        self._counter = itertools.count()
+        self._thread = None
+        self._pid = os.getpid()
+
+    def _ensure_started(self):
+        """Khởi động luồng nền khi cần - an toàn với fork của gunicorn (preload_app)"""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                # Tiến trình con sau fork: luồng của tiến trình cha không tồn tại ở đây
+                self._reset()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-logger", daemon=True)
+                self._thread.start()
+
+    def log(self, event, level='info', always=False, **fields):
+        """
+        Đẩy một bản ghi vào hàng đợi
+
+        Parameters:
+            event: Tên sự kiện (vd: 'prediction', 'fallback')
+            level: Mức log ('info', 'warning', 'error')
+            always: True để bỏ qua lấy mẫu
+            **fields: Các trường bổ sung, được chuyển sang JSON ở luồng nền
+
+        Returns:
+            bool: True nếu bản ghi được đưa vào hàng đợi
+        """
+        if not always and level not in ALWAYS_LOG_LEVELS:
+            if next(self._counter) % self.sample_rate:
+                return False
+        self._ensure_started()
+        self._queue.put((time.time(), level, event, fields))
+        return True
+
+    def error(self, event, **fields):
+        """Ghi log lỗi - luôn được ghi"""
+        return self.log(event, level='error', **fields)
+
+    def warning(self, event, **fields):
+        """Ghi log cảnh báo (vd: fallback) - luôn được ghi"""
+        return self.log(event, level='warning', **fields)
+
+    def process_path(self, pid=None):
+        """Đường dẫn file log của một tiến trình: logs/requests.jsonl -> logs/requests.<pid>.jsonl"""
+        root, ext = os.path.splitext(self.path)
+        return f"{root}.{pid or os.getpid()}{ext}"
+
+    def _open_handler(self):
+        """Mở file log xoay vòng của tiến trình hiện tại (gọi trong luồng nền, sau fork), tạo thư mục nếu cần"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        handler = RotatingFileHandler(self.process_path(), maxBytes=self.max_bytes,
+                                      backupCount=self.backup_count, encoding='utf-8', delay=True)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        return handler
+
+    @staticmethod
+    def _to_line(record):
+        """Chuyển một bản ghi thành một dòng JSON"""
+        ts, level, event, fields = record
+        entry = {'ts': round(ts, 6), 'level': level, 'event': event}
+        entry.update(fields)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+    def _run(self):
+        """Vòng lặp của luồng nền: chờ bản ghi, gom lô và ghi"""
+        handler = self._open_handler()
+        while True:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            if first is None:
+                break
+            batch = [first]
+            stop = False
+            # Lấy thêm các bản ghi đang chờ mà không chặn
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._write(handler, batch)
+            if stop:
+                break
+        handler.close()
+
+    def _write(self, handler, batch):
+        """Ghi cả lô như một bản ghi logging (một lần kiểm tra xoay vòng cho cả lô)"""
+        try:
+            message = "\n".join(self._to_line(record) for record in batch)
+            handler.handle(logging.makeLogRecord({'msg': message, 'levelno': logging.INFO}))
+        except Exception:
+            self.dropped += len(batch)
+
+    def close(self, timeout=2.0):
+        """Ghi nốt các bản ghi còn lại và dừng luồng nền"""
+        thread = self._thread
+        if thread is None or self._pid != os.getpid():
+            return
+        self._queue.put(None)
+        thread.join(timeout)
+        self._thread = None
+
+
+_request_logger = None
+_request_logger_lock = threading.Lock()
+
+
+def get_request_logger():
+    """
+    Lấy bộ ghi log request dùng chung của tiến trình
+
+    Cấu hình qua biến môi trường:
+        REQUEST_LOG_PATH: Đường dẫn file JSON lines (mặc định logs/requests.jsonl);
+                          mỗi tiến trình ghi vào <tên>.<pid>.jsonl bên cạnh
+        REQUEST_LOG_SAMPLE_RATE: Ghi 1 trên N request thành công (mặc định 10)
+    """
+    global _request_logger
+    if _request_logger is None:
+        with _request_logger_lock:
+            if _request_logger is None:
+                _request_logger = AsyncRequestLogger(
+                    path=os.environ.get('REQUEST_LOG_PATH', 'logs/requests.jsonl'),
+                    sample_rate=int(os.environ.get('REQUEST_LOG_SAMPLE_RATE', '10'))
+                )
+    return _request_logger
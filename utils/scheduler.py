@@ -0,0 +1,196 @@
+# Mô tả: Bộ lập lịch ưu tiên theo làn (priority lanes) với hàng đợi công bằng có trọng số
+# Khi hết chỗ xử lý, request xếp hàng theo làn (interactive/batch/bulk) và được cấp chỗ
+# theo thứ tự thời gian kết thúc ảo (Weighted Fair Queueing): làn trọng số cao được phục vụ
+# nhiều hơn nhưng làn thấp không bị bỏ đói hoàn toàn
+# Request đang chờ vẫn giữ một luồng của worker gthread. Nếu batch/bulk giữ hết luồng, request
+# tương tác mới nằm trong backlog accept của gunicorn (FIFO), nơi bộ lập lịch không thấy được.
+# Vì vậy các làn được định cỡ theo số luồng thật và một phần luồng chỉ dành cho làn tương tác.
+
+import heapq
+import itertools
+import threading
+
+RESERVED_LANE = 'interactive'  # Làn được dùng cả các luồng dự trữ
+
+
+class LaneConfig:
+    """Cấu hình một làn: trọng số WFQ, thời gian chờ tối đa và độ dài hàng đợi tối đa"""
+    def __init__(self, weight, max_wait, max_queue):
+        self.weight = weight  # Trọng số - tỉ lệ phục vụ khi các làn cùng có request chờ
+        self.max_wait = max_wait  # Thời gian xếp hàng tối đa (giây)
+        self.max_queue = max_queue  # Số request chờ tối đa; vượt quá thì từ chối ngay
+
+
+def reserved_threads(threads):
+    """Số luồng chỉ dành cho làn tương tác: một phần tư số luồng, ít nhất 1"""
+    return max(1, threads // 4) if threads > 1 else 0
+
+
+def lanes_for_threads(threads):
+    """
+    Cấu hình làn theo số luồng của worker
+
+    Làn tương tác được ưu tiên cao và chờ được lâu nhưng tổng số request chờ luôn nhỏ hơn số luồng;
+    làn benchmark/bulk chỉ giữ vài request chờ trong phần luồng không dự trữ.
+    """
+    shared = max(1, threads - reserved_threads(threads))
+    return {
+        'interactive': LaneConfig(weight=8, max_wait=2.0, max_queue=max(1, threads - 1)),
+        'batch': LaneConfig(weight=2, max_wait=5.0, max_queue=max(1, shared // 4)),
+        'bulk': LaneConfig(weight=1, max_wait=30.0, max_queue=max(1, shared // 8))
+    }
+
+
+class _Waiter:
+    """Một request đang xếp hàng"""
+    __slots__ = ('lane', 'event', 'granted', 'cancelled')
+
+    def __init__(self, lane):
+        self.lane = lane
+        self.event = threading.Event()
+        self.granted = False
+        self.cancelled = False
+
+
+class PriorityScheduler:
+    """
+    Cấp chỗ xử lý cho request theo làn ưu tiên
+
+    Số chỗ do bộ giới hạn đồng thời (AdaptiveConcurrencyLimiter) quyết định;
+    bộ lập lịch chỉ quyết định request nào được nhận chỗ tiếp theo.
+
+    Ngoài chỗ xử lý, bộ lập lịch đếm số luồng của worker mà mỗi làn đang giữ (đang chờ,
+    đang tính hoặc đang chạy luồng dữ liệu): các làn khác RESERVED_LANE không được giữ quá
+    threads - reserved_threads(threads) luồng, vượt quá thì bị từ chối ngay (503) thay vì chờ.
+    """
+    def __init__(self, limiter, threads=16, lanes=None):
+        self.limiter = limiter
+        self.threads = threads  # Số luồng của worker
+        self.reserved = reserved_threads(threads)  # Số luồng chỉ dành cho RESERVED_LANE
+        self.lanes = lanes or lanes_for_threads(threads)
+        self._lock = threading.Lock()
+        self._heap = []  # (thời gian kết thúc ảo, thứ tự, waiter)
+        self._sequence = itertools.count()
+        self._virtual_time = 0.0  # Thời gian ảo của hệ thống
+        self._last_finish = {lane: 0.0 for lane in self.lanes}  # Thời gian kết thúc ảo cuối của mỗi làn
+        self._queued = {lane: 0 for lane in self.lanes}  # Số request đang chờ theo làn
+        self._held = {lane: 0 for lane in self.lanes}  # Số luồng của worker đang bị giữ theo làn
+        self.served = {lane: 0 for lane in self.lanes}
+        self.rejected = {lane: 0 for lane in self.lanes}
+
+    def _enter_locked(self, lane):
+        """Ghi nhận một luồng bị làn giữ; False nếu làn đã dùng hết phần luồng không dự trữ"""
+        if lane != RESERVED_LANE:
+            shared_held = sum(held for name, held in self._held.items() if name != RESERVED_LANE)
+            if shared_held >= self.threads - self.reserved:
+                self.rejected[lane] += 1
+                return False
+        self._held[lane] += 1
+        return True
+
+    def enter(self, lane):
+        """
+        Giữ một luồng cho làn trong suốt một request dài (vd luồng chấm điểm streaming),
+        các khối bên trong xin chỗ bằng acquire(lane, hold_thread=False)
+
+        Returns:
+            str hoặc None: None nếu được nhận, 'threads_reserved' nếu phải từ chối
+        """
+        with self._lock:
+            return None if self._enter_locked(lane) else 'threads_reserved'
+
+    def leave(self, lane):
+        """Trả luồng đã giữ bằng enter()"""
+        with self._lock:
+            self._held[lane] -= 1
+
+    def acquire(self, lane, timeout=None, hold_thread=True):
+        """
+        Xin một chỗ xử lý cho request thuộc làn lane
+
+        Parameters:
+            lane: Tên làn
+            timeout: Thời gian chờ tối đa (giây), mặc định là max_wait của làn
+            hold_thread: True nếu luồng của request được tính cho làn cho tới release(lane=...);
+                         False khi luồng đã được giữ bằng enter()
+
+        Returns:
+            str hoặc None: None nếu được cấp chỗ, ngược lại là lý do từ chối
+                           ('threads_reserved', 'queue_full' hoặc 'queue_timeout')
+        """
+        config = self.lanes[lane]
+        with self._lock:
+            if hold_thread and not self._enter_locked(lane):
+                return 'threads_reserved'
+            # Chỉ đi thẳng khi không ai đang chờ - giữ thứ tự công bằng giữa các làn
+            if not self._heap and self.limiter.try_acquire(count_rejection=False):
+                self.served[lane] += 1
+                return None
+            # Request chờ giữ luồng: luôn chừa ít nhất một luồng không bị request chờ chiếm
+            if self._queued[lane] >= config.max_queue or sum(self._queued.values()) >= self.threads - 1:
+                self.rejected[lane] += 1
+                if hold_thread:
+                    self._held[lane] -= 1
+                return 'queue_full'
+            waiter = _Waiter(lane)
+            start = max(self._virtual_time, self._last_finish[lane])
+            finish = start + 1.0 / config.weight
+            self._last_finish[lane] = finish
+            heapq.heappush(self._heap, (finish, next(self._sequence), waiter))
+            self._queued[lane] += 1
+            self._dispatch_locked()
+
+        wait = config.max_wait if timeout is None else min(timeout, config.max_wait)
+        if waiter.event.wait(max(wait, 0)):
+            return None
+        with self._lock:
+            if waiter.granted:
+                # Được cấp chỗ đúng lúc hết hạn chờ - vẫn nhận
+                return None
+            waiter.cancelled = True
+            self._queued[lane] -= 1
+            self.rejected[lane] += 1
+            if hold_thread:
+                self._held[lane] -= 1
+        return 'queue_timeout'
+
+    def waiting(self):
+        """Tổng số request đang chờ ở mọi làn (> 0 nghĩa là server đang bão hòa)"""
+        return sum(self._queued.values())
+
+    def release(self, latency, success=True, lane=None):
+        """
+        Trả chỗ cho bộ giới hạn và cấp chỗ cho request chờ tiếp theo
+
+        Parameters:
+            lane: Làn của request nếu luồng được giữ bởi acquire(hold_thread=True)
+        """
+        self.limiter.release(latency, success)
+        with self._lock:
+            if lane is not None:
+                self._held[lane] -= 1
+            self._dispatch_locked()
+
+    def _dispatch_locked(self):
+        """Cấp chỗ trống cho các request có thời gian kết thúc ảo nhỏ nhất (gọi khi giữ khóa)"""
+        while self._heap:
+            finish, _, waiter = self._heap[0]
+            if waiter.cancelled:
+                heapq.heappop(self._heap)
+                continue
+            if not self.limiter.try_acquire(count_rejection=False):
+                return
+            heapq.heappop(self._heap)
+            self._virtual_time = max(self._virtual_time, finish)
+            self._queued[waiter.lane] -= 1
+            self.served[waiter.lane] += 1
+            waiter.granted = True
+            waiter.event.set()
+
+    def stats(self):
+        """Thống kê theo làn cho endpoint /health"""
+        return {
+            lane: {'queued': self._queued[lane], 'threads': self._held[lane], 'served': self.served[lane],
+                   'rejected': self.rejected[lane], 'weight': config.weight}
+            for lane, config in self.lanes.items()
+        }
@@ -0,0 +1,232 @@
+# Mô tả: Trạng thái dùng chung giữa các worker gunicorn trên cùng một máy, không cần dịch vụ ngoài
+# Một bảng băm kích thước cố định nằm trong file được memory-map (nên đặt trong /dev/shm),
+# chia thành các bucket 8 ô; mỗi nhóm bucket (stripe) được bảo vệ bởi một khóa byte-range fcntl
+# (loại trừ giữa các tiến trình) cùng một threading.Lock (loại trừ giữa các luồng trong tiến trình).
+# Bảng được dùng cho bộ đếm của Flask-Limiter (scheme shm://) và cache kết quả dự đoán.
+
+import os
+import time
+import fcntl
+import mmap
+import hashlib
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from limits.storage import Storage
+
+# Mỗi ô: khóa băm 64 bit (0 = trống), giá trị, mốc thời gian
+# (bộ đếm: thời điểm hết hạn; cache: lần truy cập gần nhất - dùng để chọn ô bị thay thế)
+SLOT_DTYPE = np.dtype([('key', '<u8'), ('value', '<f8'), ('stamp', '<f8')])
+BUCKET_SLOTS = 8  # Số ô trong một bucket (bảng băm kết hợp theo tập)
+HEADER_SIZE = 64  # Phần đầu file: magic, số bucket, số ô mỗi bucket
+MAGIC = b'CO2SHM01'
+LOCK_BASE = 1 << 30  # Vị trí byte khóa của stripe (khóa fcntl được phép vượt quá cuối file)
+
+
+def _hash_key(key):
+    """Băm khóa chuỗi thành số 64 bit ổn định giữa các tiến trình (khác 0)"""
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') or 1
+
+
+class SharedTable:
+    """
+    Bảng băm trong vùng nhớ dùng chung
+
+    Tiến trình đầu tiên mở file sẽ tạo (hoặc tạo lại nếu kích thước khác) bảng;
+    với gunicorn preload_app, tiến trình master tạo bảng và các worker kế thừa vùng map.
+    """
+    def __init__(self, path, n_buckets, n_stripes=64):
+        self.path = path
+        self.n_buckets = max(1, int(n_buckets))
+        self.n_stripes = max(1, min(n_stripes, self.n_buckets))
+        size = HEADER_SIZE + self.n_buckets * BUCKET_SLOTS * SLOT_DTYPE.itemsize
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        # Khóa byte 0 trong lúc kiểm tra/khởi tạo phần đầu file
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, 0)
+        try:
+            header = os.pread(self._fd, HEADER_SIZE, 0)
+            expected = MAGIC + np.array([self.n_buckets, BUCKET_SLOTS], dtype='<u8').tobytes()
+            if os.fstat(self._fd).st_size != size or not header.startswith(expected):
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, expected, 0)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, 0)
+
+        self._map = mmap.mmap(self._fd, size)
+        self._slots = np.frombuffer(self._map, dtype=SLOT_DTYPE, count=self.n_buckets * BUCKET_SLOTS,
+                                    offset=HEADER_SIZE).reshape(self.n_buckets, BUCKET_SLOTS)
+        self._thread_locks = [threading.Lock() for _ in range(self.n_stripes)]
+        if hasattr(os, 'register_at_fork'):
+            # Khóa luồng có thể đang bị giữ lúc fork - tạo mới trong tiến trình con
+            os.register_at_fork(after_in_child=self._reset_thread_locks)
+
+    def _reset_thread_locks(self):
+        self._thread_locks = [threading.Lock() for _ in range(self.n_stripes)]
+
+    @contextmanager
+    def _stripe_locked(self, stripe):
+        with self._thread_locks[stripe]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, LOCK_BASE + stripe)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, LOCK_BASE + stripe)
+
+    @contextmanager
+    def bucket(self, key):
+        """
+        Khóa và trả về bucket chứa khóa
+
+        Yields:
+            tuple: (view 8 ô của bucket - ghi trực tiếp vào vùng nhớ dùng chung, khóa băm)
+        """
+        hashed = _hash_key(key)
+        index = hashed % self.n_buckets
+        with self._stripe_locked(index % self.n_stripes):
+            yield self._slots[index], hashed
+
+    @staticmethod
+    def find(bucket, hashed):
+        """Vị trí ô chứa khóa trong bucket, None nếu không có"""
+        matches = np.flatnonzero(bucket['key'] == hashed)
+        return int(matches[0]) if matches.size else None
+
+    @staticmethod
+    def victim(bucket):
+        """
+        Ô sẽ được ghi đè khi thêm khóa mới: ô có mốc thời gian nhỏ nhất
+
+        Ô trống có mốc 0 nên luôn được chọn trước; sau đó là bộ đếm đã hết hạn
+        (hết hạn sớm nhất) hoặc phần tử cache lâu nhất chưa được truy cập.
+        """
+        return int(np.argmin(bucket['stamp']))
+
+    def clear(self):
+        """Xóa toàn bộ bảng (giữ lần lượt mọi khóa stripe), trả về số ô đã xóa"""
+        removed = 0
+        for stripe in range(self.n_stripes):
+            with self._stripe_locked(stripe):
+                rows = self._slots[stripe::self.n_stripes]
+                removed += int(np.count_nonzero(rows['key']))
+                rows[...] = 0
+        return removed
+
+    def __len__(self):
+        # Đếm không khóa - chỉ dùng cho thống kê
+        return int(np.count_nonzero(self._slots['key']))
+
+    @property
+    def capacity(self):
+        return self.n_buckets * BUCKET_SLOTS
+
+
+class SharedMemoryStorage(Storage):
+    """
+    Backend lưu trữ cho limits/Flask-Limiter dùng SharedTable
+
+    Dùng với storage_uri="shm:///dev/shm/co2-api.limits": bộ đếm giới hạn là chung
+    cho mọi worker nên giới hạn không bị nhân lên theo số worker.
+    Hỗ trợ chiến lược fixed-window.
+    """
+    STORAGE_SCHEME = ['shm']
+
+    def __init__(self, uri, wrap_exceptions=False, n_buckets=4096, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.table = SharedTable(uri.split('://', 1)[1], int(n_buckets))
+
+    @property
+    def base_exceptions(self):
+        return OSError
+
+    def incr(self, key, expiry, amount=1):
+        now = time.time()
+        with self.table.bucket(key) as (bucket, hashed):
+            slot = SharedTable.find(bucket, hashed)
+            if slot is None or bucket['stamp'][slot] <= now:
+                # Khóa mới hoặc cửa sổ cũ đã hết hạn: bắt đầu cửa sổ mới
+                if slot is None:
+                    slot = SharedTable.victim(bucket)
+                bucket[slot] = (hashed, amount, now + expiry)
+            else:
+                bucket['value'][slot] += amount
+            return int(bucket['value'][slot])
+
+    def get(self, key):
+        with self.table.bucket(key) as (bucket, hashed):
+            slot = SharedTable.find(bucket, hashed)
+            if slot is None or bucket['stamp'][slot] <= time.time():
+                return 0
+            return int(bucket['value'][slot])
+
+    def get_expiry(self, key):
+        with self.table.bucket(key) as (bucket, hashed):
+            slot = SharedTable.find(bucket, hashed)
+            return float(bucket['stamp'][slot]) if slot is not None else time.time()
+
+    def check(self):
+        return True
+
+    def reset(self):
+        return self.table.clear()
+
+    def clear(self, key):
+        with self.table.bucket(key) as (bucket, hashed):
+            slot = SharedTable.find(bucket, hashed)
+            if slot is not None:
+                bucket[slot] = 0
+
+
+class SharedPredictionCache:
+    """
+    Cache kết quả dự đoán dùng chung giữa các worker, cùng giao diện với PredictionCache
+
+    Giá trị phải là số thực. Thay thế theo LRU trong từng bucket (xấp xỉ LRU toàn cục);
+    hits/misses được đếm riêng trong mỗi tiến trình.
+    """
+    def __init__(self, path, max_size=500):
+        self.table = SharedTable(path, -(-max_size // BUCKET_SLOTS))
+        self.max_size = self.table.capacity
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Lấy giá trị từ cache và đánh dấu vừa được sử dụng"""
+        with self.table.bucket(key) as (bucket, hashed):
+            slot = SharedTable.find(bucket, hashed)
+            if slot is None:
+                self.misses += 1
+                return default
+            bucket['stamp'][slot] = time.time()
+            self.hits += 1
+            return float(bucket['value'][slot])
+
+    def put(self, key, value):
+        """Thêm giá trị vào cache, thay thế phần tử lâu nhất chưa dùng trong bucket nếu đầy"""
+        with self.table.bucket(key) as (bucket, hashed):
+            slot = SharedTable.find(bucket, hashed)
+            if slot is None:
+                slot = SharedTable.victim(bucket)
+            bucket[slot] = (hashed, float(value), time.time())
+
+    def clear(self):
+        """Xóa toàn bộ cache (của mọi worker), trả về số phần tử đã xóa"""
+        return self.table.clear()
+
+    def __contains__(self, key):
+        with self.table.bucket(key) as (bucket, hashed):
+            return SharedTable.find(bucket, hashed) is not None
+
+    def __len__(self):
+        return len(self.table)
+
+    def stats(self):
+        """Thống kê cache cho endpoint /health"""
+        return {'size': len(self.table), 'max_size': self.max_size,
+                'hits': self.hits, 'misses': self.misses, 'shared': self.table.path}
@@ -0,0 +1,61 @@
+# Mô tả: Gộp các lời gọi trùng nhau đang diễn ra đồng thời (single-flight)
+# Khi nhiều luồng cùng yêu cầu một khóa, chỉ luồng đầu tiên thực sự tính toán,
+# các luồng còn lại chờ trên cùng một Future và nhận chung kết quả
+
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """
+    Bộ gộp lời gọi theo khóa
+
+    Khác với cache, kết quả không được giữ lại sau khi lời gọi kết thúc:
+    chỉ các lời gọi đến trong lúc lời gọi đầu tiên còn chạy mới được gộp.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()  # Bảo vệ dict các lời gọi đang chạy
+        self._calls = {}  # khóa -> Future của lời gọi đang chạy
+        self.leaders = 0  # Số lời gọi thực sự được thực thi
+        self.shared = 0  # Số lời gọi được gộp vào lời gọi khác
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Thực thi fn(*args, **kwargs) một lần cho mỗi khóa đang chạy
+
+        Parameters:
+            key: Khóa định danh lời gọi (phải hashable)
+            fn: Hàm cần thực thi
+
+        Returns:
+            tuple: (kết quả, True nếu kết quả được chia sẻ từ lời gọi khác)
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+                self.leaders += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            # Ngoại lệ của lời gọi đầu tiên cũng được ném lại cho các lời gọi chờ
+            return future.result(), True
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def stats(self):
+        """Thống kê số lời gọi thực thi và được gộp"""
+        return {'in_flight': len(self._calls), 'executed': self.leaders, 'coalesced': self.shared}
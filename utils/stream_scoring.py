@@ -0,0 +1,144 @@
+# Mô tả: Chấm điểm dạng luồng (streaming) cho file xe lớn qua API
+# Đọc từng dòng NDJSON/CSV từ body request, gom thành khối cố định để dự đoán theo lô
+# và trả kết quả ngay khi mỗi khối xong - bộ nhớ chỉ phụ thuộc kích thước khối, không phụ thuộc file
+
+import csv
+import json
+import math
+import time
+import itertools
+import threading
+
+NDJSON_MIME = 'application/x-ndjson'
+CSV_MIME = 'text/csv'
+
+
+def stream_format(mimetype):
+    """Định dạng luồng theo Content-Type/Accept: 'csv' hoặc 'ndjson' (mặc định)"""
+    return 'csv' if mimetype and CSV_MIME in mimetype.lower() else 'ndjson'
+
+
+def _finite(values):
+    """Trả lại values nếu mọi giá trị hữu hạn; NaN so sánh luôn sai nên sẽ đi lệch nhánh cây một cách âm thầm"""
+    if not all(math.isfinite(value) for value in values):
+        raise ValueError(f"non-finite value in {values}")
+    return values
+
+
+def iter_records(lines, fmt, features):
+    """
+    Đọc từng bản ghi từ các dòng văn bản
+
+    NDJSON: mỗi dòng là object {tên đặc trưng: giá trị, "id": tùy chọn} hoặc mảng giá trị.
+    CSV: dòng đầu là header chứa đủ các cột đặc trưng (cột "id" tùy chọn, cột khác bỏ qua).
+    Dòng có giá trị không hữu hạn (nan, inf) được trả về như dòng lỗi.
+
+    Yields:
+        tuple: (id, danh sách giá trị float hoặc None, thông báo lỗi hoặc None)
+
+    Raises:
+        ValueError: Header CSV thiếu cột đặc trưng (kiểm tra ngay khi bắt đầu đọc)
+    """
+    if fmt == 'csv':
+        reader = csv.reader(lines)
+        header = [name.strip() for name in next(reader, [])]
+        missing = [name for name in features if name not in header]
+        if missing:
+            raise ValueError(f"CSV header is missing columns: {missing}")
+        columns = [header.index(name) for name in features]
+        id_column = header.index('id') if 'id' in header else None
+        for fields in reader:
+            if not fields:
+                continue
+            row_id = fields[id_column] if id_column is not None and id_column < len(fields) else None
+            try:
+                yield row_id, _finite([float(fields[i]) for i in columns]), None
+            except (ValueError, IndexError) as e:
+                yield row_id, None, str(e)
+        return
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        row_id = None
+        try:
+            record = json.loads(line)
+            if isinstance(record, dict):
+                row_id = record.get('id')
+                values = [float(record[name]) for name in features]
+            else:
+                values = [float(value) for value in record]
+                if len(values) != len(features):
+                    raise ValueError(f"expected {len(features)} values, got {len(values)}")
+            yield row_id, _finite(values), None
+        except (ValueError, KeyError, TypeError) as e:
+            yield row_id, None, f"{type(e).__name__}: {e}"
+
+
+def encode_results(rows, fmt):
+    """
+    Mã hóa kết quả của một khối
+
+    Parameters:
+        rows: Danh sách (số thứ tự dòng, id, dự đoán hoặc None, lỗi hoặc None)
+        fmt: 'ndjson' hoặc 'csv' (cột: row,id,prediction,error)
+    """
+    if fmt == 'csv':
+        return ''.join(
+            f"{row},{'' if row_id is None else row_id},"
+            f"{'' if prediction is None else round(prediction, 4)},"
+            f"{'' if error is None else json.dumps(error)}\n"
+            for row, row_id, prediction, error in rows)
+    chunks = []
+    for row, row_id, prediction, error in rows:
+        record = {'row': row}
+        if row_id is not None:
+            record['id'] = row_id
+        if error is None:
+            record['prediction'] = round(prediction, 4)
+        else:
+            record['error'] = error
+        chunks.append(json.dumps(record))
+    return '\n'.join(chunks) + '\n'
+
+
+class StreamTracker:
+    """Bộ đếm tiến độ của các luồng chấm điểm (hiển thị qua /health)"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.active = {}  # id luồng -> tiến độ
+        self.completed = 0
+        self.rows_total = 0  # Tổng số dòng đã chấm của mọi luồng
+
+    def start(self, request_id=None):
+        """Đăng ký một luồng mới, trả về dict tiến độ (được cập nhật tại chỗ)"""
+        with self._lock:
+            stream_id = next(self._ids)
+            progress = {'id': stream_id, 'request_id': request_id, 'rows': 0, 'errors': 0,
+                        'blocks': 0, 'started_at': time.time()}
+            self.active[stream_id] = progress
+            return progress
+
+    def advance(self, progress, rows, errors):
+        """Cộng tiến độ sau mỗi khối"""
+        with self._lock:
+            progress['rows'] += rows
+            progress['errors'] += errors
+            progress['blocks'] += 1
+            self.rows_total += rows
+
+    def finish(self, progress):
+        with self._lock:
+            self.active.pop(progress['id'], None)
+            self.completed += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active': [dict(progress, elapsed_s=round(time.time() - progress['started_at'], 1))
+                           for progress in self.active.values()],
+                'completed': self.completed,
+                'rows_total': self.rows_total
+            }
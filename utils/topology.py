@@ -0,0 +1,218 @@
+# Mô tả: Tự động chọn số worker/thread của gunicorn và kích thước micro-batch
+# Dựa trên số CPU và bộ nhớ thực sự được cấp (kể cả giới hạn cgroup của container)
+# cùng chi phí suy luận đo được khi khởi động
+
+import os
+import math
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Các giá trị mặc định khi không thể hiệu chỉnh (chưa có mô hình đã huấn luyện)
+DEFAULT_SINGLE_MS = 1.0  # Thời gian một lần dự đoán đơn (ms)
+DEFAULT_PER_ROW_MS = 0.05  # Thời gian mỗi dòng trong dự đoán theo lô (ms)
+DEFAULT_WORKER_MB = 250  # Bộ nhớ ước tính của một worker (MB)
+
+
+def _read_first_line(path):
+    """Đọc dòng đầu tiên của file, trả về None nếu không đọc được"""
+    try:
+        with open(path) as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+
+def available_cpus():
+    """
+    Số CPU thực sự dùng được: min(CPU affinity, quota cgroup v2/v1)
+
+    Returns:
+        tuple: (số CPU, mô tả nguồn)
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    source = 'affinity'
+
+    quota = None
+    cpu_max = _read_first_line('/sys/fs/cgroup/cpu.max')  # cgroup v2: "<quota> <period>"
+    if cpu_max:
+        parts = cpu_max.split()
+        if parts[0] != 'max':
+            quota = int(parts[0]) / int(parts[1])
+    else:
+        quota_us = _read_first_line('/sys/fs/cgroup/cpu/cpu.cfs_quota_us')  # cgroup v1
+        period_us = _read_first_line('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+        if quota_us and period_us and int(quota_us) > 0:
+            quota = int(quota_us) / int(period_us)
+
+    if quota is not None and quota < cpus:
+        cpus = max(1, math.floor(quota))
+        source = f'cgroup quota {quota:.2f}'
+    return cpus, source
+
+
+def available_memory_bytes():
+    """
+    Bộ nhớ được cấp: giới hạn cgroup (v2/v1) nếu có, nếu không là MemTotal của hệ thống
+
+    Returns:
+        tuple: (số byte, mô tả nguồn)
+    """
+    total = None
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemTotal:'):
+                    total = int(line.split()[1]) * 1024
+                    break
+    except OSError:
+        pass
+
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        value = _read_first_line(path)
+        if value and value != 'max':
+            limit = int(value)
+            # cgroup v1 dùng một số rất lớn để biểu thị "không giới hạn"
+            if total is None or limit < total:
+                return limit, f'cgroup {path}'
+    return total or DEFAULT_WORKER_MB * 4 * 1024 * 1024, 'meminfo'
+
+
+def _current_rss_bytes():
+    """RSS hiện tại của tiến trình (byte)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def calibrate_inference(n_single=50, batch_rows=1024):
+    """
+    Đo chi phí suy luận thực tế của EmissionModel
+
+    Returns:
+        dict hoặc None: single_ms (trung vị một lần dự đoán), per_row_ms, batch_fixed_ms,
+                        worker_bytes (RSS sau khi tải mô hình); None nếu chưa có mô hình
+    """
+    import numpy as np
+    from models.emission_model import EmissionModel
+
+    model = EmissionModel()
+    if not model.load_model():
+        return None
+
+    rng = np.random.default_rng(0)
+    # Mẫu đại diện trong miền giá trị của giao diện nhập liệu
+    low = np.array([1.0, 3, 4.0, 100, 1000, 2015])
+    high = np.array([8.0, 12, 20.0, 800, 4000, 2024])
+    X = rng.uniform(low, high, size=(batch_rows, len(low)))
+
+    model.predict_batch(X[:8])  # Khởi động (chạm vào các trang của mô hình)
+    timings = []
+    for i in range(n_single):
+        start = time.perf_counter()
+        model.predict(dict(zip(model.features, X[i % batch_rows])))
+        timings.append((time.perf_counter() - start) * 1000)
+    single_ms = float(np.median(timings))
+
+    start = time.perf_counter()
+    model.predict_batch(X)
+    batch_ms = (time.perf_counter() - start) * 1000
+    per_row_ms = max(batch_ms - single_ms, 0.0) / batch_rows
+
+    return {
+        'single_ms': single_ms,
+        'per_row_ms': per_row_ms,
+        'batch_fixed_ms': single_ms,
+        'worker_bytes': _current_rss_bytes()
+    }
+
+
+def derive_topology(cpus, memory_bytes, single_ms, per_row_ms, worker_bytes,
+                    io_ms=5.0, target_latency_ms=50.0, memory_fraction=0.8):
+    """
+    Suy ra cấu hình worker/thread/micro-batch từ tài nguyên và chi phí suy luận
+
+    - workers: một worker mỗi CPU (mô hình được memory-map dùng chung),
+      giới hạn bởi bộ nhớ: memory_fraction * bộ nhớ / bộ nhớ mỗi worker
+    - threads: đủ để che thời gian chờ I/O của một request (io_ms) trong lúc
+      một luồng khác đang tính toán: ceil((io_ms + single_ms) / single_ms), từ 2 đến 16
+    - micro_batch_size: lũy thừa của 2 lớn nhất sao cho một lô chạy xong
+      trong nửa ngân sách độ trễ target_latency_ms
+
+    Returns:
+        tuple: (dict cấu hình, danh sách các dòng giải thích)
+    """
+    reasons = []
+    by_memory = max(1, int(memory_bytes * memory_fraction // max(worker_bytes, 1)))
+    workers = max(1, min(cpus, by_memory))
+    reasons.append(f"workers={workers}: {cpus} CPU, memory allows {by_memory} "
+                   f"({memory_bytes / 2**20:.0f} MB x {memory_fraction} / {worker_bytes / 2**20:.0f} MB per worker)")
+
+    threads = int(min(16, max(2, math.ceil((io_ms + single_ms) / max(single_ms, 1e-3)))))
+    reasons.append(f"threads={threads}: single prediction {single_ms:.2f} ms, "
+                   f"assumed I/O wait {io_ms:.1f} ms per request")
+
+    budget_ms = target_latency_ms / 2 - single_ms
+    rows = budget_ms / max(per_row_ms, 1e-6) if budget_ms > 0 else 16
+    micro_batch_size = int(min(65536, max(16, 2 ** int(math.log2(max(rows, 1))))))
+    reasons.append(f"micro_batch_size={micro_batch_size}: {per_row_ms * 1000:.1f} us per row, "
+                   f"half of {target_latency_ms:.0f} ms latency budget")
+
+    return {'workers': workers, 'threads': threads, 'micro_batch_size': micro_batch_size}, reasons
+
+
+def plan_topology():
+    """
+    Lập cấu hình cho gunicorn_config.py
+
+    Biến môi trường ghi đè (luôn được ưu tiên):
+        WEB_CONCURRENCY hoặc GUNICORN_WORKERS, GUNICORN_THREADS, MICRO_BATCH_SIZE
+    Tham số hiệu chỉnh:
+        TOPOLOGY_IO_MS (mặc định 5), TOPOLOGY_TARGET_LATENCY_MS (mặc định 50)
+
+    Returns:
+        dict: workers, threads, micro_batch_size
+    """
+    cpus, cpu_source = available_cpus()
+    memory_bytes, memory_source = available_memory_bytes()
+    logger.info(f"Topology: {cpus} CPU ({cpu_source}), {memory_bytes / 2**20:.0f} MB memory ({memory_source})")
+
+    try:
+        calibration = calibrate_inference()
+    except Exception as e:
+        logger.warning(f"Topology: calibration failed ({e}), using defaults")
+        calibration = None
+    if calibration is None:
+        logger.info("Topology: no trained model to calibrate against, using default inference cost")
+        calibration = {'single_ms': DEFAULT_SINGLE_MS, 'per_row_ms': DEFAULT_PER_ROW_MS,
+                       'worker_bytes': None}
+    worker_bytes = calibration.get('worker_bytes') or DEFAULT_WORKER_MB * 2**20
+
+    plan, reasons = derive_topology(
+        cpus, memory_bytes, calibration['single_ms'], calibration['per_row_ms'], worker_bytes,
+        io_ms=float(os.environ.get('TOPOLOGY_IO_MS', '5')),
+        target_latency_ms=float(os.environ.get('TOPOLOGY_TARGET_LATENCY_MS', '50'))
+    )
+
+    overrides = {
+        'workers': os.environ.get('GUNICORN_WORKERS') or os.environ.get('WEB_CONCURRENCY'),
+        'threads': os.environ.get('GUNICORN_THREADS'),
+        'micro_batch_size': os.environ.get('MICRO_BATCH_SIZE')
+    }
+    for key, value in overrides.items():
+        if value:
+            plan[key] = int(value)
+            reasons.append(f"{key}={plan[key]}: explicit override from environment")
+
+    for reason in reasons:
+        logger.info(f"Topology: {reason}")
+    return plan
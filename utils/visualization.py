@@ -58,6 +58,37 @@ def plot_emission_comparison(prediction, avg_emission):
     
     return fig
 
+def plot_feature_contributions(explanation):
+    """Vẽ biểu đồ thác nước các đóng góp của từng đặc trưng vào một dự đoán
+
+    Input: explanation - dict gồm base_value, contributions (tên đặc trưng -> g/km), prediction
+    Output: fig - Đối tượng matplotlib Figure
+
+    Mỗi thanh bắt đầu từ nơi thanh trước kết thúc: đi từ dự đoán trung bình (base_value)
+    tới dự đoán của xe; thanh đỏ làm tăng, thanh xanh làm giảm lượng khí thải
+    """
+    # Đặc trưng ảnh hưởng lớn nhất đứng đầu (vẽ ở trên cùng)
+    items = sorted(explanation['contributions'].items(), key=lambda item: abs(item[1]), reverse=True)
+    values = np.array([value for _, value in items])
+    starts = explanation['base_value'] + np.concatenate([[0], np.cumsum(values[:-1])])
+    positions = np.arange(len(items))[::-1]
+    fig, ax = plt.subplots(figsize=(10, 5))
+    for y, value, start in zip(positions, values, starts):
+        ax.barh(y, value, left=start, color='lightcoral' if value > 0 else 'lightgreen')
+        ax.text(start + value, y, f' {value:+.1f} ', va='center', ha='left' if value > 0 else 'right')
+    ax.set_yticks(positions)
+    ax.set_yticklabels([name for name, _ in items])
+    ax.axvline(explanation['base_value'], color='gray', linestyle='--', linewidth=1)
+    ax.axvline(explanation['prediction'], color='black', linewidth=1)
+    # Chừa chỗ cho nhãn giá trị ở hai đầu (thanh ngang bỏ qua ax.margins tại mép thanh)
+    edges = np.concatenate([starts, starts + values])
+    padding = 0.15 * (edges.max() - edges.min() or 1.0)
+    ax.set_xlim(edges.min() - padding, edges.max() + padding)
+    plt.title(f"Từ mức trung bình {explanation['base_value']:.1f} tới dự đoán {explanation['prediction']:.1f} g/km")
+    plt.xlabel('Khí thải (g/km)')
+    fig.tight_layout()
+    return fig
+
 def create_gauge_chart(value, min_val, max_val, title):
     """Create a gauge chart for emissions
     
@@ -1,6 +1,7 @@
 import streamlit as st
 from utils.visualization import (
     plot_feature_importance,
+    plot_feature_contributions,
     plot_emission_comparison,
     create_gauge_chart,
     style_metric_cards
@@ -9,10 +10,16 @@ import pandas as pd
 import time
 import numpy as np
 from utils.benchmark_utils import BenchmarkUtils
+from utils.fleet_scoring import FleetScoringJob, read_fleet_csv, summarize_fleet
+from utils.bulk_codec import encode_matrix, decode_vector
 import requests
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
 
+# Request benchmark đi vào làn ưu tiên thấp của API để không chen lấn người dùng tương tác
+BENCHMARK_HEADERS = {'X-Client-Source': 'benchmark'}
+DEFAULT_API_URL = 'https://thuco2tiep.onrender.com'
+
 class MainView:
     """
     MainView là lớp chính quản lý giao diện người dùng của ứng dụng Streamlit
@@ -32,7 +39,7 @@ class MainView:
     def show(self):
         """
         Hiển thị giao diện chính của ứng dụng với thanh điều hướng bên và các trang tương ứng
-        Người dùng có thể chuyển đổi giữa các trang: Dự đoán, Phân tích và Benchmark
+        Người dùng có thể chuyển đổi giữa các trang: Dự đoán, Đội xe, Phân tích và Benchmark
         """
         # Thêm CSS tùy chỉnh để làm đẹp giao diện
         st.markdown(style_metric_cards(), unsafe_allow_html=True)
@@ -41,11 +48,13 @@ class MainView:
         with st.sidebar:
             st.markdown("# 🚗 CO2 Emission Predictor")
             st.markdown("---")
-            page = st.radio("Navigation", ["Prediction", "Analysis", "Benchmark"])
+            page = st.radio("Navigation", ["Prediction", "Fleet", "Analysis", "Benchmark"])
 
         # Hiển thị trang tương ứng theo lựa chọn người dùng
         if page == "Prediction":
             self._show_prediction_page()
+        elif page == "Fleet":
+            self._show_fleet_page()
         elif page == "Analysis":
             self._show_analysis_page()
         else:
@@ -107,18 +116,18 @@ class MainView:
                                  value=2023,
                                  step=1)
 
+        # Tạo dictionary thông số xe để truyền vào controller
+        features = {
+            'Engine Size(L)': engine_size,
+            'Cylinders': cylinders,
+            'Fuel Consumption Comb (L/100 km)': fuel_consumption,
+            'Horsepower': horsepower,
+            'Weight (kg)': weight,
+            'Year': year
+        }
+
         # Nút dự đoán để kích hoạt quá trình dự đoán
         if st.button("🔍 Predict Emissions", type="primary"):
-            # Tạo dictionary thông số xe để truyền vào controller
-            features = {
-                'Engine Size(L)': engine_size,
-                'Cylinders': cylinders,
-                'Fuel Consumption Comb (L/100 km)': fuel_consumption,
-                'Horsepower': horsepower,
-                'Weight (kg)': weight,
-                'Year': year
-            }
-
             try:
                 # Thực hiện dự đoán và lấy các thông tin liên quan
                 prediction = self.controller.predict_emission(features)
@@ -174,6 +183,12 @@ class MainView:
                         unsafe_allow_html=True
                     )
 
+                # Mức bất đồng giữa các cây của rừng (tính trong cùng một lần duyệt cây)
+                uncertainty = self.controller.predict_with_uncertainty(features, (0.05, 0.95))
+                low, high = uncertainty['quantiles'][0.05], uncertainty['quantiles'][0.95]
+                st.caption(f"90% of the forest's trees predict between {low:.0f} and {high:.0f} g/km "
+                           f"(standard deviation {uncertainty['std']:.1f} g/km).")
+
                 # Hiển thị biểu đồ trực quan
                 st.markdown("### 📈 Visualization")
                 col1, col2 = st.columns(2)
@@ -186,14 +201,167 @@ class MainView:
                 with col2:
                     st.pyplot(create_gauge_chart(prediction, 0, 300, "Emission Meter"))
 
+                # Vì sao xe này có con số này: đóng góp TreeSHAP của từng đặc trưng (vài mili giây)
+                try:
+                    explanation = self.controller.explain_prediction(features)
+                    st.markdown("### 🧩 Why This Prediction")
+                    st.pyplot(plot_feature_contributions(explanation))
+                    st.caption(f"Average vehicle: {explanation['base_value']:.1f} g/km. Each bar shows how much "
+                               "one specification moves this vehicle's prediction up or down from that average.")
+                except ValueError:
+                    pass  # Mô hình chưa có bộ giải thích - bỏ qua phần này
+
                 # Hiển thị mẹo thân thiện môi trường
                 st.markdown("### 🌱 Eco-friendly Tips")
                 for tip in tips:
                     st.markdown(f"- {tip}")
 
+                # Các xe thật trong bộ dữ liệu có thông số gần nhất (tìm bằng KD-tree)
+                try:
+                    similar = self.controller.find_similar_vehicles(features, k=5)
+                    st.markdown("### 🚘 Real Vehicles Like Yours")
+                    st.dataframe(pd.DataFrame([
+                        {'Make': vehicle.get('Make'), 'Model': vehicle.get('Model'),
+                         'Vehicle Class': vehicle.get('Vehicle Class'),
+                         'Measured CO2 (g/km)': vehicle['co2_emissions'],
+                         **vehicle['features']}
+                        for vehicle in similar
+                    ]), use_container_width=True)
+                except ValueError:
+                    pass  # Mô hình chưa có chỉ mục xe - bỏ qua phần này
+
             except Exception as e:
                 st.error(f"Error making prediction: {str(e)}")
 
+        # What-if: nằm ngoài nút Predict nên cập nhật ngay khi thay đổi thông số,
+        # cả đường cong được dự đoán trong một lần gọi rừng cây
+        self._show_sensitivity_sweep(features)
+
+    def _show_sensitivity_sweep(self, features):
+        """
+        Hiển thị đường cong độ nhạy khi thay đổi một hoặc hai thông số của xe đang nhập
+
+        Parameters:
+            features: dict thông số xe gốc
+        """
+        st.markdown("### 🎛️ What-if Sensitivity")
+        vary = st.multiselect("Vary one or two inputs", list(features), default=['Engine Size(L)'],
+                              max_selections=2, key="sweep_features")
+        if not vary:
+            return
+        try:
+            sweep = self.controller.sweep(features, vary, points=25 if len(vary) == 1 else 15)
+        except Exception as e:
+            st.error(f"Error running sensitivity sweep: {str(e)}")
+            return
+
+        if len(vary) == 1:
+            curve = pd.DataFrame({'Predicted CO2 (g/km)': sweep['predictions']},
+                                 index=pd.Index(np.round(sweep['grids'][0], 2), name=vary[0]))
+            st.line_chart(curve)
+        else:
+            # Bảng 2-D: dòng là đặc trưng thứ nhất, cột là đặc trưng thứ hai
+            table = pd.DataFrame(sweep['predictions'],
+                                 index=pd.Index(np.round(sweep['grids'][0], 2), name=vary[0]),
+                                 columns=pd.Index(np.round(sweep['grids'][1], 2), name=vary[1]))
+            st.dataframe(table.style.format("{:.0f}").background_gradient(cmap='RdYlGn_r', axis=None),
+                         use_container_width=True)
+        st.caption(f"Current vehicle: {sweep['base_prediction']:.1f} g/km. "
+                   f"Other inputs are held at their current values.")
+
+    def _show_fleet_page(self):
+        """
+        Hiển thị trang chấm điểm đội xe
+        Người dùng tải lên file CSV có các cột đặc trưng của mô hình; đội xe được dự đoán theo từng
+        khối trong luồng nền (mô hình cục bộ hoặc API /predict/batch) kèm thanh tiến độ,
+        sau đó hiển thị tổng và trung bình g/km, phân bố xếp hạng và các xe phát thải cao nhất
+        """
+        st.title("🚚 Fleet Emissions")
+        features = self.controller.model.features
+        st.markdown(f"Upload a CSV with the columns {', '.join(f'`{name}`' for name in features)}. "
+                    "Optional `Make`, `Model` and `Vehicle Class` columns label the worst offenders.")
+
+        uploaded = st.file_uploader("📄 Fleet CSV", type=["csv"])
+        source = st.radio("Scoring engine", ["Local model", "API"], horizontal=True)
+
+        if uploaded is not None and st.button("🔍 Score Fleet", type="primary"):
+            try:
+                fleet, dropped = read_fleet_csv(uploaded, features)
+            except ValueError as e:
+                st.error(f"Invalid fleet file: {str(e)}")
+                return
+            if dropped:
+                st.warning(f"Skipped {dropped:,} rows with missing or non-numeric values")
+            if source == "API":
+                predict_fn = self._remote_batch_predictor(os.environ.get('API_URL', DEFAULT_API_URL))
+            else:
+                predict_fn = self.controller.predict_batch
+            # Job chạy trong luồng nền và được giữ trong session_state: khi script chạy lại
+            # (người dùng tương tác với trang) job vẫn tiếp tục và tiến độ được hiển thị tiếp
+            st.session_state['fleet_job'] = FleetScoringJob(
+                predict_fn, fleet[features].to_numpy(dtype=np.float64)).start()
+            st.session_state['fleet_data'] = fleet
+            st.session_state.pop('fleet_summary', None)
+
+        job = st.session_state.get('fleet_job')
+        if job is None:
+            return
+
+        progress_bar = st.progress(0.0)
+        while not job.done:
+            progress_bar.progress(job.progress, text=f"Scored {job.rows_done:,} / {len(job.X):,} vehicles")
+            time.sleep(0.2)
+        progress_bar.progress(1.0, text=f"Scored {len(job.X):,} vehicles in {job.elapsed:.2f} s")
+        if job.error:
+            st.error(f"Fleet scoring failed: {job.error}")
+            return
+
+        # Tổng hợp một lần cho mỗi job, các lần chạy lại script dùng lại kết quả
+        if 'fleet_summary' not in st.session_state:
+            fleet = st.session_state['fleet_data'].copy()
+            fleet['Predicted CO2 (g/km)'] = np.round(job.predictions, 2)
+            fleet['Rating'] = self.controller.get_emission_ratings(job.predictions)
+            summary = summarize_fleet(fleet, job.predictions, fleet['Rating'].to_numpy())
+            summary['csv'] = fleet.to_csv(index=False).encode('utf-8')
+            st.session_state['fleet_summary'] = summary
+        summary = st.session_state['fleet_summary']
+
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Vehicles", f"{len(job.X):,}")
+        col2.metric("Total CO2 (g/km)", f"{summary['total']:,.0f}")
+        col3.metric("Mean CO2 (g/km)", f"{summary['mean']:.1f}")
+        col4.metric("90th percentile (g/km)", f"{summary['p90']:.1f}")
+
+        st.subheader("🏷️ Rating Distribution")
+        st.bar_chart(summary['rating_counts'])
+
+        st.subheader("🔥 Worst Offenders")
+        st.dataframe(summary['worst'], use_container_width=True)
+
+        st.download_button("💾 Download scored fleet", summary['csv'],
+                           file_name="fleet_scored.csv", mime="text/csv")
+
+    def _remote_batch_predictor(self, api_url):
+        """
+        Tạo hàm dự đoán theo khối qua endpoint /predict/batch của API
+
+        Mỗi khối được gửi dưới dạng nhị phân dạng cột (không mã hóa JSON từng xe)
+        và nhận lại vector dự đoán nhị phân.
+        """
+        session = requests.Session()
+
+        def predict(X):
+            body, mimetype = encode_matrix(X)
+            response = session.post(
+                f"{api_url}/predict/batch",
+                data=body,
+                headers={'Content-Type': mimetype, 'Accept': mimetype, 'X-Client-Source': 'fleet'},
+                timeout=120
+            )
+            response.raise_for_status()
+            return decode_vector(response.content, response.headers.get('Content-Type'))
+        return predict
+
     def _show_analysis_page(self):
         """
         Hiển thị trang phân tích các tính năng quan trọng ảnh hưởng đến phát thải CO2
@@ -222,7 +390,112 @@ class MainView:
         except Exception as e:
             st.error(f"Error getting feature importance: {str(e)}")
 
-        # Phần này có thể mở rộng để thêm các phân tích khác
+        # Partial dependence tính sẵn khi huấn luyện (lưu cùng artifact mô hình)
+        partial_dependence = self.controller.get_partial_dependence()
+        if partial_dependence:
+            st.subheader("📉 Partial Dependence")
+            st.markdown("Average predicted emission as each input changes, over the training vehicles.")
+            names = list(partial_dependence)
+            for row_start in range(0, len(names), 3):
+                for column, name in zip(st.columns(3), names[row_start:row_start + 3]):
+                    with column:
+                        curve = partial_dependence[name]
+                        st.markdown(f"**{name}**")
+                        st.line_chart(pd.DataFrame({'CO2 (g/km)': curve['average']},
+                                                   index=pd.Index(curve['grid'], name=name)),
+                                      height=200)
+
+        # Báo cáo đánh giá mô hình (lưu theo phiên bản mô hình + dữ liệu, chỉ tính một lần)
+        self._show_model_evaluation()
+
+        # Phân tích drill-down khí thải theo nhóm xe, trả lời từ cube tổng hợp tính sẵn
+        st.subheader("🔎 Emission Drill-down")
+        try:
+            cube = self.controller.get_analytics_cube()
+        except Exception as e:
+            st.error(f"Error loading analytics cube: {str(e)}")
+            return
+
+        # Bộ lọc: mỗi chiều một multiselect (để trống = lấy tất cả)
+        filters = {}
+        filter_columns = st.columns(len(cube.dimensions))
+        for column, dimension in zip(filter_columns, cube.dimensions):
+            with column:
+                filters[dimension] = st.multiselect(dimension, cube.labels[dimension].tolist(),
+                                                    key=f"cube_filter_{dimension}")
+
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            group_by = st.selectbox("Group by", cube.dimensions, index=cube.dimensions.index('Vehicle Class'))
+        with col2:
+            drill_down = st.selectbox("Drill down by", ["None"] + [d for d in cube.dimensions if d != group_by])
+        with col3:
+            measure = st.selectbox("Measure", cube.measures)
+
+        query_start = time.perf_counter()
+        overall = cube.query(filters, measure=measure)
+        groups = cube.query(filters, [group_by] + ([drill_down] if drill_down != "None" else []), measure=measure)
+        query_ms = (time.perf_counter() - query_start) * 1000
+
+        if not len(groups):
+            st.info("No vehicles match the selected filters.")
+            return
+        total = overall.iloc[0]
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Vehicles", f"{int(total['count']):,}")
+        col2.metric("Mean", f"{total['mean']:.1f}")
+        col3.metric("Median", f"{total['p50']:.1f}")
+        col4.metric("90th percentile", f"{total['p90']:.1f}")
+
+        if drill_down == "None":
+            st.bar_chart(groups.set_index(group_by)['mean'].sort_values(ascending=False))
+        else:
+            # Bảng chéo: mỗi dòng một nhóm, mỗi cột một giá trị drill-down, ô là giá trị trung bình
+            st.dataframe(groups.pivot(index=group_by, columns=drill_down, values='mean').round(1),
+                         use_container_width=True)
+        st.dataframe(groups.round(1), use_container_width=True)
+        st.caption(f"{len(cube):,} precomputed cells over {cube.n_rows:,} vehicles · "
+                   f"answered in {query_ms:.1f} ms")
+
+    def _show_model_evaluation(self):
+        """Hiển thị kiểm định chéo, sai số theo nhóm xe và độ quan trọng hoán vị của mô hình hiện tại"""
+        st.subheader("📋 Model Evaluation")
+        try:
+            report = self.controller.get_evaluation_report()
+            if report is None:
+                st.info("No evaluation report for this model version yet. Running it retrains the model "
+                        "once per cross-validation fold, in parallel across CPU cores.")
+                if not st.button("Run evaluation", key="run_evaluation"):
+                    return
+                with st.spinner("Evaluating model..."):
+                    report = self.controller.get_evaluation_report(compute=True)
+        except Exception as e:
+            st.error(f"Error getting evaluation report: {str(e)}")
+            return
+
+        cv = report['cv']
+        col1, col2, col3 = st.columns(3)
+        col1.metric(f"R² ({len(cv['r2']['folds'])}-fold CV)", f"{cv['r2']['mean']:.3f}", f"± {cv['r2']['std']:.3f}",
+                    delta_color="off")
+        col2.metric("MAE (g/km)", f"{cv['mae']['mean']:.2f}", f"± {cv['mae']['std']:.2f}", delta_color="off")
+        col3.metric("RMSE (g/km)", f"{cv['rmse']['mean']:.2f}", f"± {cv['rmse']['std']:.2f}", delta_color="off")
+
+        col1, col2 = st.columns(2)
+        with col1:
+            # Mức giảm R2 trên tập kiểm tra khi xáo trộn từng đặc trưng của mô hình đang phục vụ
+            st.markdown("**Permutation importance** (drop in test R²)")
+            st.bar_chart(pd.Series({name: values['r2_drop']
+                                    for name, values in report['permutation_importance'].items()},
+                                   name='R² drop'))
+        with col2:
+            segment_column = st.selectbox("Errors by", list(report['segments']), key="evaluation_segment")
+            st.dataframe(pd.DataFrame(report['segments'][segment_column]).set_index('segment').round(2),
+                         use_container_width=True)
+        test = report['test']
+        st.caption(f"Served model on the {test['n_rows']:,}-vehicle held-out split (no tree trained on it, "
+                   f"including trees added by updates): R² {test['r2']:.3f}, "
+                   f"MAE {test['mae']:.2f} g/km. Segment errors are out-of-fold; bias > 0 means over-prediction. "
+                   f"Report for model {report['model_version']}, computed in {report['elapsed_seconds']:.0f} s.")
 
     def _show_benchmark_page(self):
         """
@@ -233,7 +506,7 @@ class MainView:
         st.title("⏱️ Benchmark 1000 Requests")
         
         # Lấy URL API từ biến môi trường hoặc sử dụng giá trị mặc định
-        API_URL = os.environ.get('API_URL', 'https://thuco2tiep.onrender.com')
+        API_URL = os.environ.get('API_URL', DEFAULT_API_URL)
         st.info(f"Using API endpoint: {API_URL}")
         
         # Kiểm tra trạng thái khả dụng của API
@@ -311,6 +584,7 @@ class MainView:
                     warm_up_response = requests.post(
                         f"{API_URL}/predict",
                         json=features,
+                        headers=BENCHMARK_HEADERS,
                         timeout=60  # Chờ lâu hơn cho request đầu tiên
                     )
                     
@@ -361,6 +635,7 @@ class MainView:
                     response = requests.post(
                         f"{API_URL}/predict",
                         json=request_features,
+                        headers=BENCHMARK_HEADERS,
                         timeout=timeout  # Timeout động
                     )
                     req_end_time = time.perf_counter()